@@ -4,10 +4,10 @@ import os
 import random
 import asyncio
 import time
-from src.candidate_generator import get_target_author, get_candidates
+from src.candidate_generator import get_target_author, get_candidates, load_name_index, semantic_recall
 #from src.full_feature_extractor import build_author_profiles 
 #from src.semantic_feature_extractor import build_author_profiles 
-from src.bge_feature_extractor import build_author_profiles
+from src.bge_feature_extractor import build_author_profiles, build_author_profiles_async, get_target_embedding, get_ann_index, EMBEDDING_CACHE, ENCODER
 # from src.llm_decider import ask_deepseek_async
 # from src.llm_decider_twostage import ask_deepseek_two_stage_async
 # LLM 模式:
@@ -23,6 +23,16 @@ else:
     from src.llm2 import ask_deepseek_two_stage_async
 from config import init_dspy 
 from src.util import get_vector_cache_path, build_feature_text
+from src.pub_store import open_pub_db
+from src.pub_facts import open_pub_facts
+from src.feature_pool import FeaturePool
+from src.scheduler import run_worker_pool
+from src.result_writer import ResultWriter
+from src.resume_index import ResumeIndex
+from src.candidate_budget import truncate_to_budget
+from src.token_counter import TOKEN_COUNTER, enable_usage_tracking
+from src.llm_client import init_http_pool, close_http_pool, LLM_LIMITER
+from src.llm_cache import LLM_CACHE, LLMCacheMiss
 
 # 配置路径 
 DATA_DIR = "dataset/valid"
@@ -32,9 +42,18 @@ WHOLE_AUTHOR_PATH = os.path.join(DATA_DIR, "whole_author_profiles.json")
 WHOLE_PUB_PATH = os.path.join(DATA_DIR, "whole_author_profiles_pub.json") 
 SAVE_PATH = "output/result.json"
 LOG_PATH = "output/analysis_log.jsonl"
-# 并发控制锁和信号量
-file_lock = asyncio.Lock()
-sem = asyncio.Semaphore(10)  # 限制同时开启 9 个 LLM 请求 HYBRID模式/SINGLE建议 3
+NAME_INDEX_PATH = "output/name_index.json"
+RESUME_INDEX_PATH = "output/resume_index.sqlite"
+# LLM 并发由自适应控制器管理 (src/concurrency.py)：从起始值出发，延迟和错误率正常时逐步加并发，
+# 遇到 429 / 超时 / p95 上升时成倍回退，不再按服务商手调信号量
+LLM_CONCURRENCY_INIT = 10
+LLM_CONCURRENCY_MIN = 1
+LLM_CONCURRENCY_MAX = 64
+# 候选人画像的 token 预算：超出时按合作者重合 / 机构一致 / 向量分数保留靠前的候选人 (src/candidate_budget.py)。
+# 默认 None = 不截断，已有实验的提示词不变；用环境变量开启，例如 PROFILE_TOKEN_BUDGET=12000
+PROFILE_TOKEN_BUDGET = int(os.environ.get("PROFILE_TOKEN_BUDGET", 0)) or None
+# task_id -> 截断信息，LLM 决策成功后由 process_single_task 写入、handle_result 取出写进分析日志
+TRUNCATION_STATS = {}
 # 'SINGLE' - 全部强制走单层（用于跑 Baseline 数据）
 # 'HYBRID' - 混合模式：候选人 > 20 走两层，否则走单层
 # simple_concat 模式下会自动强制为 SINGLE，避免误调用两阶段函数
@@ -42,65 +61,127 @@ STRATEGY = 'HYBRID'
 if LLM_MODE == "simple_concat":
     STRATEGY = "SINGLE"
 USE_GPU_MODE =  False   # True=GPU串行模式 | False=CPU并发模式
+SEMANTIC_RECALL = False # True=姓名召回之外，再用 ANN 索引补充语义召回 (需先运行 python -m src.ann_index)
+# 特征提取 (召回 + 画像) 的执行方式: "thread" / "process" = 放进执行池，不阻塞事件循环里的 LLM 请求；
+# None = 在事件循环里直接跑 (画像走 build_author_profiles_async)
+FEATURE_POOL_KIND = "thread"
+FEATURE_WORKERS = 4
+FEATURE_MAX_PENDING = 16 # 同时提交给执行池的任务上限
+feature_pool = None
+
+# 特征提取用到的只读数据库：主进程在 main() 里加载，process 模式下每个工作进程由 init_feature_worker 各加载一份
+FEATURE_DBS = {}
+
+def load_feature_dbs():
+    with open(UNASS_PUB_PATH, 'r', encoding='utf-8') as f: pubs_db = json.load(f)
+    with open(WHOLE_AUTHOR_PATH, 'r', encoding='utf-8') as f: author_db = json.load(f)
+    whole_pub_db = open_pub_db(WHOLE_PUB_PATH)  # 列存存在时内存映射打开，否则回退 json.load
+    load_name_index(author_db, NAME_INDEX_PATH)  # 召回用的姓名倒排索引
+    pub_facts = open_pub_facts(WHOLE_AUTHOR_PATH)  # (论文, 作者) 事实表，没有则为 None
+    FEATURE_DBS.update(pubs_db=pubs_db, author_db=author_db, whole_pub_db=whole_pub_db, pub_facts=pub_facts)
+    return FEATURE_DBS
+
+def init_feature_worker():
+    load_feature_dbs()
+
+def extract_candidates(task_id):
+    """阶段 A: 粗筛 (本地计算)，返回 (目标作者, 候选人 ID 列表)"""
+    paper_id, author_idx = task_id.split('-')
+    paper_info = FEATURE_DBS["pubs_db"].get(paper_id, {})
+    target_author = get_target_author(paper_info, int(author_idx))
+    author_db = FEATURE_DBS["author_db"]
+    candidate_ids = get_candidates(target_author, author_db)
+    if SEMANTIC_RECALL:
+        target_embedding = get_target_embedding(paper_info, paper_id)
+        candidate_ids += semantic_recall(target_author, author_db, target_embedding, get_ann_index(), exclude=candidate_ids)
+    return target_author, candidate_ids
+
+def extract_profiles(task_id, candidate_ids):
+    """阶段 B: 特征提取 (带磁盘缓存)，语义向量模型的特征提取函数需要目标论文。返回 (画像, 向量分数)"""
+    paper_id = task_id.split('-')[0]
+    embedding_scores = {}
+    profiles = build_author_profiles(candidate_ids, FEATURE_DBS["author_db"], FEATURE_DBS["whole_pub_db"],
+                                     target_paper=FEATURE_DBS["pubs_db"].get(paper_id, {}),
+                                     pub_facts=FEATURE_DBS["pub_facts"], target_id=paper_id, scores_out=embedding_scores)
+    return profiles, embedding_scores
 
 async def process_single_task(task_id, pubs_db, author_db, whole_pub_db, results, total_count, current_idx):
     """单个任务的异步工作流"""
 
-    paper_id, author_idx = task_id.split('-')
-    author_idx = int(author_idx)
+    paper_id = task_id.split('-')[0]
+    paper_info = pubs_db.get(paper_id, {})
 
     # 阶段 A: 粗筛 (本地计算)
-    paper_info = pubs_db.get(paper_id, {})
-    target_author = get_target_author(paper_info, author_idx)
+    if feature_pool is None:
+        target_author, candidate_ids = extract_candidates(task_id)
+    else:
+        target_author, candidate_ids = await feature_pool.run("candidates", extract_candidates, task_id)
     target_name = target_author.get('name', "")
-    candidate_ids = get_candidates(target_author, author_db)
     correct_auth_id = paper_to_author.get(paper_id)
     if not candidate_ids:
         return task_id, "NIL", "No candidates", 0, 0, 0, 0, 0, 1, (correct_auth_id is None)
 
     # 阶段 B: 特征提取 (带磁盘缓存)
     #candidate_profiles = build_author_profiles(candidate_ids, author_db, whole_pub_db)
-    candidate_profiles = build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper=paper_info)#语义向量模型的特征提取函数需要目标论文
+    if feature_pool is None:
+        embedding_scores = {}
+        candidate_profiles = await build_author_profiles_async(candidate_ids, author_db, whole_pub_db, target_paper=paper_info, pub_facts=FEATURE_DBS["pub_facts"], target_id=paper_id, scores_out=embedding_scores)
+    else:
+        candidate_profiles, embedding_scores = await feature_pool.run("profiles", extract_profiles, task_id, candidate_ids)
+    truncation = None
+    if PROFILE_TOKEN_BUDGET:
+        candidate_profiles, truncation = truncate_to_budget(
+            candidate_profiles, paper_info, target_name, embedding_scores, budget=PROFILE_TOKEN_BUDGET, gt_id=correct_auth_id)
     num_candidates = len(candidate_profiles)
 
     # 阶段 C: LLM 决策 (异步 I/O)
     try:
-        async with sem:   # 只锁 LLM
-
-            if (
-                STRATEGY == 'HYBRID'
-                and num_candidates > 20
-                and ask_deepseek_two_stage_async is not None
-            ):
-               return await ask_deepseek_two_stage_async(
-                  task_id, paper_info, candidate_profiles, 
-                  current_index=current_idx, 
-                  target_name=target_name,
-                  gt_id=correct_auth_id,
-                   total_count=total_count
-                )
-            else:
-                target_id, reason, cand_count, in_t, out_t = await ask_deepseek_async(
-                    task_id, paper_info, candidate_profiles, target_name, current_idx, total_count
-                )
-                l1_hit_dummy = 1 
-                is_nil_dummy = (correct_auth_id is None)
-                print(f"[{current_idx}/{total_count}] 任务完成: {task_id} -> {target_id if target_id else 'NIL'}")
-                return (task_id, target_id, reason, cand_count, cand_count, in_t, in_t, out_t, l1_hit_dummy, is_nil_dummy)
+        if (
+            STRATEGY == 'HYBRID'
+            and num_candidates > 20
+            and ask_deepseek_two_stage_async is not None
+        ):
+           result = await ask_deepseek_two_stage_async(
+              task_id, paper_info, candidate_profiles, 
+              current_index=current_idx, 
+              target_name=target_name,
+              gt_id=correct_auth_id,
+               total_count=total_count
+            )
+        else:
+            target_id, reason, cand_count, in_t, out_t = await ask_deepseek_async(
+                task_id, paper_info, candidate_profiles, target_name, current_idx, total_count
+            )
+            l1_hit_dummy = 1 
+            is_nil_dummy = (correct_auth_id is None)
+            print(f"[{current_idx}/{total_count}] 任务完成: {task_id} -> {target_id if target_id else 'NIL'}")
+            result = (task_id, target_id, reason, cand_count, cand_count, in_t, in_t, out_t, l1_hit_dummy, is_nil_dummy)
 
+    except LLMCacheMiss:
+        raise  # 回放模式下未命中：交给调度器跳过，不写结果、不记断点
     except Exception as e:
         print(f" 任务 {task_id} LLM 调用失败: {e}")
         return task_id, None, f"Error: {str(e)}", 0, 0, 0, 0, 0, 0, (correct_auth_id is None)
+    if truncation is not None:
+        TRUNCATION_STATS[task_id] = truncation
+    return result
 async def main():
     start_time = time.perf_counter()
     init_dspy()
+    enable_usage_tracking()
+    TOKEN_COUNTER.start()  # 配置了 DEEPSEEK_TOKENIZER_DIR 时在后台线程加载分词器
+    init_http_pool()
+    LLM_LIMITER.configure(LLM_CONCURRENCY_INIT, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX)
 
     # 1. 加载数据
     print("正在加载数据库...")
     with open(UNASS_PATH, 'r', encoding='utf-8') as f: unass_list = json.load(f)
-    with open(UNASS_PUB_PATH, 'r', encoding='utf-8') as f: pubs_db = json.load(f)
-    with open(WHOLE_AUTHOR_PATH, 'r', encoding='utf-8') as f: author_db = json.load(f)
-    with open(WHOLE_PUB_PATH, 'r', encoding='utf-8') as f: whole_pub_db = json.load(f)
+    dbs = load_feature_dbs()
+    pubs_db, author_db, whole_pub_db = dbs["pubs_db"], dbs["author_db"], dbs["whole_pub_db"]
+    global feature_pool
+    if FEATURE_POOL_KIND:
+        feature_pool = FeaturePool(FEATURE_POOL_KIND, max_workers=FEATURE_WORKERS, max_pending=FEATURE_MAX_PENDING,
+                                   initializer=init_feature_worker if FEATURE_POOL_KIND == "process" else None)
     GT_PATH = os.path.join(DATA_DIR, "cna_valid_ground_truth.json")
     global paper_to_author
     paper_to_author = {}
@@ -112,20 +193,10 @@ async def main():
                     for pid in papers:
                         paper_to_author[pid] = auth_id
 
-    # 2. 精确断点恢复
-    results = {}
-    processed_tasks = set()
-    if os.path.exists(LOG_PATH):
-        with open(LOG_PATH, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line)
-                    tid = entry.get("task_id")
-                    if tid:
-                        processed_tasks.add(tid)
-                        res_id = entry.get("result", "NIL")
-                        results.setdefault(res_id, []).append(tid)
-                except: continue
+    # 2. 精确断点恢复：读断点索引，只回放日志里索引之后新增的尾部，不再逐行解析整个日志
+    resume_index = ResumeIndex(RESUME_INDEX_PATH, LOG_PATH)
+    processed_tasks = resume_index.processed()
+    results = resume_index.results()
 
     test_limit = 150
     candidate_pool = unass_list[:test_limit]
@@ -136,6 +207,7 @@ async def main():
     current_global_idx = processed_count
     if not tasks_to_run:
         print(" 所有任务已在断点记录中，无需重跑。")
+        resume_index.close()
         return
 
     # test_limit = 100
@@ -146,63 +218,56 @@ async def main():
     total_actual_run = 0
     actual_nil_count = 0
 
-    # 3. 分批异步处理 (Batch Processing)
-    BATCH_SIZE = 100 #(GPU模式建议 1，CPU模式可适当增大)
-    for i in range(0, len(tasks_to_run), BATCH_SIZE):
-        batch = tasks_to_run[i : i + BATCH_SIZE]
-        if USE_GPU_MODE:
-            batch_results = []
-            for idx, tid in enumerate(batch):
-                current_global_idx += 1  # 每处理一个就增加
-                result = await process_single_task(tid, pubs_db, author_db, whole_pub_db, results, test_limit,  current_global_idx)
-                batch_results.append(result)
-        else:
+    # 3. 连续调度：NUM_WORKERS 个 worker 从队列取任务，做完一个取下一个，结果按完成顺序写出
+    NUM_WORKERS = 1 if USE_GPU_MODE else 100 # 同时在途的任务数 (GPU模式建议 1，CPU模式可适当增大)
 
-            coros = [
-                process_single_task(tid, pubs_db, author_db, whole_pub_db, results, test_limit, len(processed_tasks) + i + idx + 1) 
-                for idx, tid in enumerate(batch)
-            ]
-        
-            batch_results = await asyncio.gather(*coros)
-
-        # 4. 批量保存结果
-        async with file_lock:
-            for tid, target_id, reason, l1_c, l2_c, ts_in, orig_in, out_t, l1_hit, is_nil_case in batch_results:
-                total_actual_run += 1
-                total_l1_hits += l1_hit
-                if is_nil_case:
-                    actual_nil_count += 1
-
-                final_res = target_id if target_id else "NIL"
-                analysis_entry = {
-                    "task_id": tid,
-                    "stats": {
-                        "l1_hit": "YES" if l1_hit == 1 else "NO",
-                        "is_new_author": is_nil_case,
-                        "candidates_ratio": f"{l1_c} -> {l2_c}",
-                        "input_tokens_comparison": {
-                        "original_single_layer": orig_in,    # 原单层全量输入
-                        "two_layer_total": ts_in,            # 两层合计输入 (L1+L2)
-                        "saved_tokens": orig_in - ts_in      # 节省的 Token
-                    },
-                    "output_tokens": out_t
-                    },
-                    "result": final_res,
-                    "reasoning": reason
-                }
-                with open(LOG_PATH, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(analysis_entry, ensure_ascii=False) + "\n")
-                
-                #  更新内存中的字典 (使用 NIL 或具体 ID)
-                key = final_res if final_res != "NIL" else "new_author"
-                if key not in results:
-                    results[key] = []
-                if tid not in results[key]:
-                    results[key].append(tid)
-
-            os.makedirs(os.path.dirname(SAVE_PATH), exist_ok=True)
-            with open(SAVE_PATH, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=4, ensure_ascii=False)
+    async def run_task(idx, tid):
+        return await process_single_task(tid, pubs_db, author_db, whole_pub_db, results, test_limit, current_global_idx + idx + 1)
+
+    # 4. 写出结果 (只在写入协程里串行执行)：日志缓冲追加 + 定期 fsync，result.json 只在检查点和结束时重写
+    writer = ResultWriter(LOG_PATH, SAVE_PATH, results, resume_index=resume_index)
+
+    def handle_result(result):
+        nonlocal total_actual_run, total_l1_hits, actual_nil_count
+        tid, target_id, reason, l1_c, l2_c, ts_in, orig_in, out_t, l1_hit, is_nil_case = result
+        total_actual_run += 1
+        total_l1_hits += l1_hit
+        if is_nil_case:
+            actual_nil_count += 1
+
+        final_res = target_id if target_id else "NIL"
+        analysis_entry = {
+            "task_id": tid,
+            "stats": {
+                "l1_hit": "YES" if l1_hit == 1 else "NO",
+                "is_new_author": is_nil_case,
+                "candidates_ratio": f"{l1_c} -> {l2_c}",
+                "input_tokens_comparison": {
+                "original_single_layer": orig_in,    # 原单层全量输入
+                "two_layer_total": ts_in,            # 两层合计输入 (L1+L2)
+                "saved_tokens": orig_in - ts_in      # 节省的 Token
+            },
+            "output_tokens": out_t
+            },
+            "result": final_res,
+            "reasoning": reason
+        }
+        truncation = TRUNCATION_STATS.pop(tid, None)
+        if truncation is not None:
+            analysis_entry["stats"]["budget_truncation"] = truncation
+        # API 返回的 usage (含提示词模板)，与上面的本地计数分开记录
+        api_usage = TOKEN_COUNTER.pop_usage(tid)
+        if api_usage is not None:
+            analysis_entry["stats"]["api_usage"] = api_usage
+        #  更新内存中的字典 (使用 NIL 或具体 ID)
+        key = final_res if final_res != "NIL" else "new_author"
+        writer.write(analysis_entry, key, tid)
+
+    try:
+        await run_worker_pool(tasks_to_run, run_task, handle_result, num_workers=NUM_WORKERS,
+                              on_idle=writer.maybe_sync)
+    finally:
+        writer.close()
 
     if total_actual_run > 0:
         overall_hit_rate = (total_l1_hits / total_actual_run) * 100
@@ -226,7 +291,18 @@ async def main():
         print(f"   - 其中 已有作者(ID)样本数: {id_cases}")
         print(f"   - 总体命中率: {overall_hit_rate:.2f}%")
         print(f"   - 总运行时间: {hours:02d}:{minutes:02d}:{seconds:05.2f}")
+        print(f"   - {EMBEDDING_CACHE.summary()}")
+        print(f"   - {ENCODER.summary()}")
+        print(f"   - {LLM_CACHE.summary()}")
+        print(f"   - {LLM_LIMITER.summary()}")
+        print(f"   - {TOKEN_COUNTER.summary()}")
+        if feature_pool is not None:
+            print(f"   - {feature_pool.summary()}")
         print("="*50 + "\n")
+    if feature_pool is not None:
+        feature_pool.shutdown()
+    await close_http_pool()
+    LLM_CACHE.close()
     print(f"\n处理完成！")
 
 if __name__ == "__main__":
@@ -4,10 +4,21 @@ import os
 import asyncio
 import time
 from src.sa_lzk.convert_gt import convert_to_snake_pinyin 
-from src.candidate_generator import get_candidates # 内部逻辑需确保支持拼音匹配
-from src.bge_feature_extractor import build_author_profiles
+from src.candidate_generator import get_candidates, load_name_index, semantic_recall # 内部逻辑需确保支持拼音匹配
+from src.bge_feature_extractor import build_author_profiles, build_author_profiles_async, get_target_embedding, get_ann_index, EMBEDDING_CACHE, ENCODER
 from src.llm_decider_sl import ask_deepseek_async
 from src.llm_decider_twostage_sl import ask_deepseek_two_stage_async
+from src.pub_store import open_pub_db
+from src.pub_facts import open_pub_facts
+from src.feature_pool import FeaturePool
+from src.scheduler import run_worker_pool
+from src.result_writer import ResultWriter
+from src.resume_index import ResumeIndex
+from src.candidate_budget import truncate_to_budget
+from src.token_counter import TOKEN_COUNTER, enable_usage_tracking
+from src.llm_client import init_http_pool, close_http_pool, LLM_LIMITER
+from src.llm_cache import LLM_CACHE, LLMCacheMiss
+from src.util import build_sa_paper_info
 from config import init_dspy 
 
 # --- 1. 配置新路径 ---
@@ -22,25 +33,74 @@ OUTPUT_BASE = "output/sa_lzk"
 os.makedirs(OUTPUT_BASE, exist_ok=True)
 SAVE_PATH = os.path.join(OUTPUT_BASE, "result.json")
 LOG_PATH = os.path.join(OUTPUT_BASE, "analysis_log.jsonl")
+NAME_INDEX_PATH = os.path.join(OUTPUT_BASE, "name_index.json")
+RESUME_INDEX_PATH = os.path.join(OUTPUT_BASE, "resume_index.sqlite")
 
-sem = asyncio.Semaphore(5) 
-file_lock = asyncio.Lock()
+# LLM 并发由自适应控制器管理 (src/concurrency.py)，这里只给起始值和区间
+LLM_CONCURRENCY_INIT = 5
+LLM_CONCURRENCY_MIN = 1
+LLM_CONCURRENCY_MAX = 50
+# 候选人画像的 token 预算 (src/candidate_budget.py)，默认 None = 不截断；用环境变量开启，例如 PROFILE_TOKEN_BUDGET=12000
+PROFILE_TOKEN_BUDGET = int(os.environ.get("PROFILE_TOKEN_BUDGET", 0)) or None
+TRUNCATION_STATS = {}
 STRATEGY = 'HYBRID'
+SEMANTIC_RECALL = False # True=姓名召回之外，再用 ANN 索引补充语义召回 (需先运行 python -m src.ann_index)
+# 特征提取 (召回 + 画像) 的执行方式: "thread" / "process" = 放进执行池，不阻塞事件循环里的 LLM 请求；
+# None = 在事件循环里直接跑 (画像走 build_author_profiles_async)
+FEATURE_POOL_KIND = "thread"
+FEATURE_WORKERS = 4
+FEATURE_MAX_PENDING = 16 # 同时提交给执行池的任务上限
+feature_pool = None
 
-async def process_single_task(item, pubs_db, author_db, whole_pub_db, total_count, current_idx):
-    """针对新数据集简化的异步工作流"""
-    # 直接获取 wos 作为 task_id
-    task_id = item.get('wos', 'unknown')
+# 特征提取用到的只读数据库：主进程在 main() 里加载，process 模式下每个工作进程由 init_feature_worker 各加载一份
+FEATURE_DBS = {}
+
+def load_feature_dbs():
+    with open(WHOLE_AUTHOR_PATH, 'r', encoding='utf-8') as f: author_db = json.load(f)
+    whole_pub_db = open_pub_db(WHOLE_PUB_PATH)
+    load_name_index(author_db, NAME_INDEX_PATH)
+    pub_facts = open_pub_facts(WHOLE_AUTHOR_PATH)
+    FEATURE_DBS.update(author_db=author_db, whole_pub_db=whole_pub_db, pub_facts=pub_facts)
+    return FEATURE_DBS
+
+def init_feature_worker():
+    load_feature_dbs()
+
+def extract_candidates(item):
+    """阶段 A: 粗筛，返回 (检索用的拼音名, 候选人 ID 列表)"""
     target_name_cn = item.get('name', '')
-    
-    # 阶段 A: 粗筛
     # 构造 target_author 对象兼容旧接口，或者直接传 name
     target_name_key = convert_to_snake_pinyin(target_name_cn) 
 
     print(f"DEBUG: 原始姓名={target_name_cn} -> 检索Key={target_name_key}")
 
     target_author = {"name": target_name_key}
+    author_db = FEATURE_DBS["author_db"]
     candidate_ids = get_candidates(target_author, author_db)
+    if SEMANTIC_RECALL:
+        target_embedding = get_target_embedding(build_sa_paper_info(item), item.get('wos', 'unknown'))
+        candidate_ids += semantic_recall(target_author, author_db, target_embedding, get_ann_index(), exclude=candidate_ids)
+    return target_name_key, candidate_ids
+
+def extract_profiles(item, candidate_ids):
+    """阶段 B: 特征提取，返回 (画像, 向量分数)"""
+    embedding_scores = {}
+    profiles = build_author_profiles(candidate_ids, FEATURE_DBS["author_db"], FEATURE_DBS["whole_pub_db"],
+                                     target_paper=build_sa_paper_info(item), pub_facts=FEATURE_DBS["pub_facts"],
+                                     target_id=item.get('wos', 'unknown'), scores_out=embedding_scores)
+    return profiles, embedding_scores
+
+async def process_single_task(item, pubs_db, author_db, whole_pub_db, total_count, current_idx):
+    """针对新数据集简化的异步工作流"""
+    # 直接获取 wos 作为 task_id
+    task_id = item.get('wos', 'unknown')
+    target_name_cn = item.get('name', '')
+    
+    # 阶段 A: 粗筛
+    if feature_pool is None:
+        target_name_key, candidate_ids = extract_candidates(item)
+    else:
+        target_name_key, candidate_ids = await feature_pool.run("candidates", extract_candidates, item)
     
     # 获取真实答案用于统计
     correct_auth_id = paper_to_author.get(task_id)
@@ -51,43 +111,58 @@ async def process_single_task(item, pubs_db, author_db, whole_pub_db, total_coun
     # 阶段 B: 特征提取
     # 这里的 item 本身就包含了题目的 title(lzmc), venue(cbsorqkmc) 等信息
     # 映射字段名以适配 bge_feature_extractor
-    paper_info = {
-        "title": item.get("lzmc", ""),
-        "venue": item.get("cbsorqkmc", ""),
-        "abstract": "" # 新数据中若无摘要则留空
-    }
-    
-    candidate_profiles = build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper=paper_info)
+    paper_info = build_sa_paper_info(item)
+    if feature_pool is None:
+        embedding_scores = {}
+        candidate_profiles = await build_author_profiles_async(candidate_ids, author_db, whole_pub_db, target_paper=paper_info, pub_facts=FEATURE_DBS["pub_facts"], target_id=task_id, scores_out=embedding_scores)
+    else:
+        candidate_profiles, embedding_scores = await feature_pool.run("profiles", extract_profiles, item, candidate_ids)
+    truncation = None
+    if PROFILE_TOKEN_BUDGET:
+        candidate_profiles, truncation = truncate_to_budget(
+            candidate_profiles, paper_info, target_name_cn, embedding_scores, budget=PROFILE_TOKEN_BUDGET, gt_id=correct_auth_id)
     num_candidates = len(candidate_profiles)
 
-    # 阶段 C: LLM 决策
+    # 阶段 C: LLM 决策 (每次 Predict 请求经 src/llm_client.py：响应缓存 + 自适应并发)
     try:
-        async with sem:
-            if STRATEGY == 'HYBRID' and num_candidates > 20:
-                return await ask_deepseek_two_stage_async(
-                    task_id, paper_info, candidate_profiles, 
-                    current_index=current_idx, 
-                    target_name=target_name_cn,
-                    gt_id=correct_auth_id,
-                    total_count=total_count, 
-                    target_name_key=target_name_key
-                )
-            else:
-                target_id, reason, cand_count, in_t, out_t = await ask_deepseek_async(
-                    task_id, paper_info, candidate_profiles, target_name_cn
-                )
-                return (task_id, target_id, reason, cand_count, cand_count, in_t, in_t, out_t, 1, (correct_auth_id is None), target_name_key)
+        if STRATEGY == 'HYBRID' and num_candidates > 20:
+            result = await ask_deepseek_two_stage_async(
+                task_id, paper_info, candidate_profiles, 
+                current_index=current_idx, 
+                target_name=target_name_cn,
+                gt_id=correct_auth_id,
+                total_count=total_count, 
+                target_name_key=target_name_key
+            )
+        else:
+            target_id, reason, cand_count, in_t, out_t = await ask_deepseek_async(
+                task_id, paper_info, candidate_profiles, target_name_cn
+            )
+            result = (task_id, target_id, reason, cand_count, cand_count, in_t, in_t, out_t, 1, (correct_auth_id is None), target_name_key)
+    except LLMCacheMiss:
+        raise  # 回放模式下未命中：交给调度器跳过，不写结果、不记断点
     except Exception as e:
         return task_id, None, f"Error: {str(e)}", 0, 0, 0, 0, 0, 0, (correct_auth_id is None),target_name_key
+    if truncation is not None:
+        TRUNCATION_STATS[task_id] = truncation
+    return result
 
 async def main():
     start_time = time.perf_counter()
     init_dspy()
+    enable_usage_tracking()
+    TOKEN_COUNTER.start()  # 配置了 DEEPSEEK_TOKENIZER_DIR 时在后台线程加载分词器
+    init_http_pool()
+    LLM_LIMITER.configure(LLM_CONCURRENCY_INIT, LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX)
 
     print("正在加载 sa_lzk_data 数据库...")
     with open(UNASS_PATH, 'r', encoding='utf-8') as f: unass_list = json.load(f)
-    with open(WHOLE_AUTHOR_PATH, 'r', encoding='utf-8') as f: author_db = json.load(f)
-    with open(WHOLE_PUB_PATH, 'r', encoding='utf-8') as f: whole_pub_db = json.load(f)
+    dbs = load_feature_dbs()
+    author_db, whole_pub_db = dbs["author_db"], dbs["whole_pub_db"]
+    global feature_pool
+    if FEATURE_POOL_KIND:
+        feature_pool = FeaturePool(FEATURE_POOL_KIND, max_workers=FEATURE_WORKERS, max_pending=FEATURE_MAX_PENDING,
+                                   initializer=init_feature_worker if FEATURE_POOL_KIND == "process" else None)
     
     # 构建 GT 映射
     global paper_to_author
@@ -100,17 +175,10 @@ async def main():
                     for pid in pids: paper_to_author[pid] = aid
 
     
-    processed_tasks = set()
-    if os.path.exists(LOG_PATH):
-        with open(LOG_PATH, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    full_tid = json.loads(line).get("task_id")
-                    if full_tid:
-                     
-                        short_tid = full_tid.split('-')[0]
-                        processed_tasks.add(short_tid)
-                except: continue
+    # 断点恢复：读断点索引 (只回放日志尾部)，结果分组也从索引还原，不再重新加载 result.json
+    resume_index = ResumeIndex(RESUME_INDEX_PATH, LOG_PATH)
+    processed_tasks = {full_tid.split('-')[0] for full_tid in resume_index.processed()}
+    results = resume_index.results()
 
     test_limit = 200 # 测试前100题
     tasks_to_run = [item for item in unass_list[:test_limit] if item.get('wos') not in processed_tasks]
@@ -120,71 +188,64 @@ async def main():
     current_global_idx = processed_count
     if not tasks_to_run:
         print(" 所有任务已在断点记录中，无需重跑。")
+        resume_index.close()
         return
 
     total_l1_hits = 0
     total_actual_run = 0
     actual_nil_count = 0
 
-    # 分批处理
-    BATCH_SIZE = 50
-    results = {}
-    if os.path.exists(SAVE_PATH):
-        try:
-            with open(SAVE_PATH, 'r', encoding='utf-8') as f:
-                results = json.load(f)
-            print(f" 成功加载已有结果，当前包含 {len(results)} 个作者的记录。")
-        except Exception as e:
-            print(f" 加载旧结果失败，将从空开始: {e}")
-            results = {}
-    for i in range(0, len(tasks_to_run), BATCH_SIZE):
-        batch = tasks_to_run[i : i + BATCH_SIZE]
-        coros = [
-            process_single_task(item, None, author_db, whole_pub_db, test_limit, len(processed_tasks) + i + idx + 1) 
-            for idx, item in enumerate(batch)
-        ]
-        batch_results = await asyncio.gather(*coros)
-
-       
-
-        async with file_lock:
-               for tid, target_id, reason, l1_c, l2_c, ts_in, orig_in, out_t, l1_hit, is_nil_case, formatted_name in batch_results:
-                task_id_with_name = f"{tid}-{formatted_name}"
-                total_actual_run += 1
-                total_l1_hits += l1_hit
-                if is_nil_case:
-                    actual_nil_count += 1
-
-                final_res = target_id if target_id else "NIL"
-                analysis_entry = {
-                    "task_id": task_id_with_name,
-                    "stats": {
-                        "l1_hit": "YES" if l1_hit == 1 else "NO",
-                        "is_new_author": is_nil_case,
-                        "candidates_ratio": f"{l1_c} -> {l2_c}",
-                        "input_tokens_comparison": {
-                        "original_single_layer": orig_in,    # 原单层全量输入
-                        "two_layer_total": ts_in,            # 两层合计输入 (L1+L2)
-                        "saved_tokens": orig_in - ts_in      # 节省的 Token
-                    },
-                    "output_tokens": out_t
-                    },
-                    "result": final_res,
-                    "reasoning": reason
-                }
-                with open(LOG_PATH, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(analysis_entry, ensure_ascii=False) + "\n")
-                
-                #  更新内存中的字典 (使用 NIL 或具体 ID)
-                key = final_res if final_res != "NIL" else "new_author"
-                if key not in results:
-                    results[key] = []
-                if task_id_with_name not in results[key]:
-                    results[key].append(task_id_with_name)
-
-        os.makedirs(os.path.dirname(SAVE_PATH), exist_ok=True)
-        with open(SAVE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
+    # 连续调度：NUM_WORKERS 个 worker 从队列取任务，做完一个取下一个，结果按完成顺序写出
+    NUM_WORKERS = 50
+
+    async def run_task(idx, item):
+        return await process_single_task(item, None, author_db, whole_pub_db, test_limit, current_global_idx + idx + 1)
+
+    # 写出结果 (只在写入协程里串行执行)：日志缓冲追加 + 定期 fsync，result.json 只在检查点和结束时重写
+    writer = ResultWriter(LOG_PATH, SAVE_PATH, results, resume_index=resume_index)
+
+    def handle_result(result):
+        nonlocal total_actual_run, total_l1_hits, actual_nil_count
+        tid, target_id, reason, l1_c, l2_c, ts_in, orig_in, out_t, l1_hit, is_nil_case, formatted_name = result
+        task_id_with_name = f"{tid}-{formatted_name}"
+        total_actual_run += 1
+        total_l1_hits += l1_hit
+        if is_nil_case:
+            actual_nil_count += 1
+
+        final_res = target_id if target_id else "NIL"
+        analysis_entry = {
+            "task_id": task_id_with_name,
+            "stats": {
+                "l1_hit": "YES" if l1_hit == 1 else "NO",
+                "is_new_author": is_nil_case,
+                "candidates_ratio": f"{l1_c} -> {l2_c}",
+                "input_tokens_comparison": {
+                "original_single_layer": orig_in,    # 原单层全量输入
+                "two_layer_total": ts_in,            # 两层合计输入 (L1+L2)
+                "saved_tokens": orig_in - ts_in      # 节省的 Token
+            },
+            "output_tokens": out_t
+            },
+            "result": final_res,
+            "reasoning": reason
+        }
+        truncation = TRUNCATION_STATS.pop(tid, None)
+        if truncation is not None:
+            analysis_entry["stats"]["budget_truncation"] = truncation
+        # API 返回的 usage (含提示词模板)，与上面的本地计数分开记录
+        api_usage = TOKEN_COUNTER.pop_usage(tid)
+        if api_usage is not None:
+            analysis_entry["stats"]["api_usage"] = api_usage
+        #  更新内存中的字典 (使用 NIL 或具体 ID)
+        key = final_res if final_res != "NIL" else "new_author"
+        writer.write(analysis_entry, key, task_id_with_name)
+
+    try:
+        await run_worker_pool(tasks_to_run, run_task, handle_result, num_workers=NUM_WORKERS,
+                              on_idle=writer.maybe_sync)
+    finally:
+        writer.close()
 
     if total_actual_run > 0:
         overall_hit_rate = (total_l1_hits / total_actual_run) * 100
@@ -208,7 +269,18 @@ async def main():
         print(f"   - 其中 已有作者(ID)样本数: {id_cases}")
         print(f"   - 总体命中率: {overall_hit_rate:.2f}%")
         print(f"   - 总运行时间: {hours:02d}:{minutes:02d}:{seconds:05.2f}")
+        print(f"   - {EMBEDDING_CACHE.summary()}")
+        print(f"   - {ENCODER.summary()}")
+        print(f"   - {LLM_CACHE.summary()}")
+        print(f"   - {LLM_LIMITER.summary()}")
+        print(f"   - {TOKEN_COUNTER.summary()}")
+        if feature_pool is not None:
+            print(f"   - {feature_pool.summary()}")
         print("="*50 + "\n")
+    if feature_pool is not None:
+        feature_pool.shutdown()
+    await close_http_pool()
+    LLM_CACHE.close()
     print(f"\n处理完成！")
 
 
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+全量论文向量的近似最近邻索引 (IVF，倒排文件)：
+用 k-means 把所有作者的论文向量分成 nlist 个簇，查询时只扫描离目标论文最近的 nprobe 个簇，
+再把命中的论文行映射回作者，得到"语义上最接近的作者"。
+用于 candidate_generator.semantic_recall：same_name 漏召回的姓名变体 (多段名、连字符等)。
+
+索引建在向量缓存目录下的 ann_ivf/ 里:
+  centroids.npy      (nlist, dim) 簇中心
+  list_offsets.npy   每个簇在 list_rows 中的起止位置
+  list_rows.npy      按簇排好的矩阵行号
+  list_codes.npy / list_scales.npy
+                     按簇排好、连续存放的 int8 量化向量 (与 src/quantized_store.py 相同的每行对称量化)，
+                     查询时直接对命中簇的切片打分，不再按行号从大矩阵里零散取数
+  indexed_rows.npy   被作者引用的行号 (升序)，与 author_offsets 一起构成 行号 -> 作者序号 的映射
+  author_offsets.npy / author_ords.npy / authors.json
+  source.json        构建时打包库的行数和 generation；打包库被 compact 过 (行号重排) 后索引拒绝加载
+粗排出的前 k 行再读打包库的原始 float16 行精确打分。
+
+构建: python -m src.ann_index   (在 preprocess_vectors 之后运行)
+"""
+import json
+import os
+import shutil
+import numpy as np
+
+from .quantized_store import quantize_int8
+
+ANN_DIR_NAME = "ann_ivf"
+NPROBE = 16
+TRAIN_SAMPLE = 50000
+KMEANS_ITERS = 8
+CHUNK_ROWS = 65536
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _assign(matrix, rows, centers):
+    """分块计算每行最近的簇"""
+    assign = np.empty(len(rows), dtype=np.int64)
+    for i in range(0, len(rows), CHUNK_ROWS):
+        chunk = np.asarray(matrix[rows[i:i + CHUNK_ROWS]], dtype=np.float32)
+        assign[i:i + CHUNK_ROWS] = np.argmax(chunk @ centers.T, axis=1)
+    return assign
+
+
+def train_centroids(matrix, rows, nlist, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = rows if len(rows) <= TRAIN_SAMPLE else np.sort(rng.choice(rows, size=TRAIN_SAMPLE, replace=False))
+    vectors = _normalize(np.asarray(matrix[sample], dtype=np.float32))
+    centers = vectors[rng.choice(len(vectors), size=nlist, replace=False)]
+    for _ in range(KMEANS_ITERS):
+        assign = np.argmax(vectors @ centers.T, axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # 空簇重新随机挑一个样本做中心
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centers = _normalize(sums)
+    return centers
+
+
+def build_ann_index(store, cache_dir, nlist=None):
+    """store 为候选人向量库 (DedupVectorStore 或 PackedVectorStore)，整体重建后替换旧索引"""
+    matrix = getattr(store, "content", store).matrix
+    authors = list(store.keys())
+    row_lists = [store.row_ids(auth_id) for auth_id in authors]
+    all_rows = np.concatenate(row_lists) if row_lists else np.zeros(0, dtype=np.int64)
+    all_ords = np.repeat(np.arange(len(authors), dtype=np.int64), [len(r) for r in row_lists])
+    if not len(all_rows):
+        raise ValueError("向量库为空，无法构建 ANN 索引")
+
+    # 行号 -> 作者序号 (去重库里同一行可能被多个作者引用)
+    order = np.lexsort((all_ords, all_rows))
+    all_rows, all_ords = all_rows[order], all_ords[order]
+    indexed_rows, starts = np.unique(all_rows, return_index=True)
+    author_offsets = np.append(starts, len(all_rows)).astype(np.int64)
+
+    nlist = nlist or max(1, min(len(indexed_rows), int(np.sqrt(len(indexed_rows)))))
+    print(f"ANN 索引: {len(indexed_rows)} 条论文向量 / {len(authors)} 个作者，{nlist} 个簇")
+    centers = train_centroids(matrix, indexed_rows, nlist)
+    assign = _assign(matrix, indexed_rows, centers)
+    list_order = np.argsort(assign, kind="stable")
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+    list_rows = indexed_rows[list_order]
+
+    index_dir = os.path.join(cache_dir, ANN_DIR_NAME)
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centers.astype(np.float32))
+    np.save(os.path.join(tmp_dir, "list_offsets.npy"), list_offsets)
+    np.save(os.path.join(tmp_dir, "list_rows.npy"), list_rows)
+    codes = np.lib.format.open_memmap(os.path.join(tmp_dir, "list_codes.npy"), mode="w+", dtype=np.int8,
+                                      shape=(len(list_rows), matrix.shape[1]))
+    scales = np.lib.format.open_memmap(os.path.join(tmp_dir, "list_scales.npy"), mode="w+", dtype=np.float32,
+                                       shape=(len(list_rows),))
+    for i in range(0, len(list_rows), CHUNK_ROWS):
+        rows = list_rows[i:i + CHUNK_ROWS]
+        order = np.argsort(rows)  # 按行号顺序读内存映射
+        chunk = np.empty((len(rows), matrix.shape[1]), dtype=np.float32)
+        chunk[order] = matrix[rows[order]]
+        codes[i:i + CHUNK_ROWS], scales[i:i + CHUNK_ROWS] = quantize_int8(chunk)
+    codes.flush()
+    scales.flush()
+    codes = scales = None  # 先释放内存映射再改名
+    np.save(os.path.join(tmp_dir, "indexed_rows.npy"), indexed_rows)
+    np.save(os.path.join(tmp_dir, "author_offsets.npy"), author_offsets)
+    np.save(os.path.join(tmp_dir, "author_ords.npy"), all_ords)
+    with open(os.path.join(tmp_dir, "authors.json"), 'w', encoding='utf-8') as f:
+        json.dump(authors, f, ensure_ascii=False)
+    source = getattr(store, "content", store)
+    with open(os.path.join(tmp_dir, "source.json"), 'w', encoding='utf-8') as f:
+        json.dump({"rows": source.rows, "generation": source.generation}, f)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    print(f"ANN 索引已保存: {index_dir}")
+
+
+class IVFIndex:
+    def __init__(self, index_dir, matrix, nprobe=NPROBE):
+        self.matrix = matrix
+        self.nprobe = nprobe
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(index_dir, "list_offsets.npy"))
+        self.list_rows = load("list_rows.npy")
+        self.list_codes = load("list_codes.npy")
+        self.list_scales = load("list_scales.npy")
+        self.indexed_rows = load("indexed_rows.npy")
+        self.author_offsets = load("author_offsets.npy")
+        self.author_ords = load("author_ords.npy")
+        with open(os.path.join(index_dir, "authors.json"), 'r', encoding='utf-8') as f:
+            self.authors = json.load(f)
+
+    def search_rows(self, query, k=200, nprobe=None):
+        """返回 (行号, 余弦分数)，按分数降序"""
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        cand_pos, cand_scores = [], []
+        for p in probe:
+            start, end = int(self.list_offsets[p]), int(self.list_offsets[p + 1])
+            if start == end:
+                continue
+            # 簇内 int8 向量连续存放：切片不拷贝，逐簇打分，只保留每簇的前 k 个
+            scores = (self.list_codes[start:end] @ query) * self.list_scales[start:end]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                scores = scores[top]
+            else:
+                top = np.arange(len(scores))
+            cand_pos.append(top + start)
+            cand_scores.append(scores)
+        if not cand_pos:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        pos = np.concatenate(cand_pos)
+        scores = np.concatenate(cand_scores)
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            pos = pos[keep]
+        # 粗排前 k 行读原始向量精确打分
+        rows = np.sort(np.asarray(self.list_rows[pos], dtype=np.int64))
+        scores = np.asarray(self.matrix[rows], dtype=np.float32) @ query
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def nearest_authors(self, query, top_n=20, k_rows=200, nprobe=None):
+        """离目标论文最近的作者 [(auth_id, 最高论文分数)]，按分数降序"""
+        rows, scores = self.search_rows(query, k=k_rows, nprobe=nprobe)
+        best = {}
+        for pos, score in zip(np.searchsorted(self.indexed_rows, rows), scores):
+            for ord_ in self.author_ords[self.author_offsets[pos]:self.author_offsets[pos + 1]]:
+                auth_id = self.authors[ord_]
+                if auth_id not in best:
+                    best[auth_id] = float(score) # 行已按分数降序，先出现的就是该作者的最高分
+        return sorted(best.items(), key=lambda x: -x[1])[:top_n]
+
+
+def open_ann_index(cache_dir, store, nprobe=NPROBE):
+    """索引不存在或已与向量库对不上时返回 None；store 为构建时用的候选人向量库"""
+    index_dir = os.path.join(cache_dir, ANN_DIR_NAME)
+    if store is None or not os.path.exists(os.path.join(index_dir, "authors.json")):
+        return None
+    source = getattr(store, "content", store)
+    source_path = os.path.join(index_dir, "source.json")
+    built = None
+    if os.path.exists(source_path) and os.path.exists(os.path.join(index_dir, "list_codes.npy")):
+        with open(source_path, 'r', encoding='utf-8') as f:
+            built = json.load(f)
+    if built is None or built["generation"] != source.generation or built["rows"] > source.rows:
+        print("ANN 索引与向量库对不上 (旧格式或向量库被 compact 过)，已忽略，请重新构建: python -m src.ann_index")
+        return None
+    return IVFIndex(index_dir, source.matrix, nprobe=nprobe)
+
+
+if __name__ == "__main__":
+    from .util import get_vector_cache_path, get_content_cache_path
+    from .vector_store import DedupVectorStore, PackedVectorStore
+
+    cache_dir = get_vector_cache_path()
+    if DedupVectorStore.exists(cache_dir):
+        source = DedupVectorStore(cache_dir, get_content_cache_path())
+    else:
+        source = PackedVectorStore(cache_dir)
+    build_ann_index(source, cache_dir)
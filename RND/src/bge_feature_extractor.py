@@ -2,6 +2,7 @@
 import json
 import os
 import re
+import asyncio
 import torch
 import numpy as np
 import glob
@@ -9,9 +10,15 @@ import huggingface_hub
 from collections import Counter
 from typing import Dict, List
 from rapidfuzz import fuzz
-from sentence_transformers import SentenceTransformer
 from safetensors.torch import load_file
-from .util import build_feature_text, get_vector_cache_path
+from .util import build_feature_text, get_vector_cache_path, get_content_cache_path, embedding_model_id, TARGET_MAX_SEQ_LENGTH
+from .vector_store import PackedVectorStore, DedupVectorStore
+from .embedding_cache import EmbeddingLRUCache
+from .encoder_service import EncoderService
+from .encoder_backend import load_encoder, ENCODER_BACKEND
+from .quantized_store import QuantizedVectors
+from .centroid_index import CENTROID_STORE_NAME, rank_by_centroids
+from .ann_index import open_ann_index
 VECTOR_CACHE_DIR = get_vector_cache_path()
 os.environ['HF_HUB_OFFLINE'] = '1'
 os.environ['TRANSFORMERS_OFFLINE'] = '1'
@@ -29,7 +36,16 @@ else:
     os.environ.pop('HF_HUB_OFFLINE', None)
     snapshot_path = "BAAI/bge-m3"  
 device = "cuda" if torch.cuda.is_available() else "cpu"
-MODEL = SentenceTransformer(snapshot_path, device=device)
+# 编码器后端由 ENCODER_BACKEND 选择 (见 src/encoder_backend.py)，无 GPU 的机器可用 torch_int8 / onnx
+MODEL = load_encoder(snapshot_path, backend=ENCODER_BACKEND, device=device, max_seq_length=TARGET_MAX_SEQ_LENGTH) #512
+# 预计算的目标论文向量库必须由同一模型标识编出，否则与现场编码的向量不可比
+TARGET_MODEL_ID = embedding_model_id(ENCODER_BACKEND, TARGET_MAX_SEQ_LENGTH)
+device = MODEL.device.type # int8 / onnx 后端固定在 CPU 上
+
+# 所有现场编码 (目标论文、未缓存的候选人) 都经编码服务合批，并发任务的请求会拼进同一个批次
+ENCODER_MAX_BATCH = 64
+ENCODER_MAX_WAIT_MS = 5
+ENCODER = EncoderService(MODEL, max_batch=ENCODER_MAX_BATCH, max_wait_ms=ENCODER_MAX_WAIT_MS)
 
 
 # 常见噪音词/层级词（用于文本清洗）
@@ -130,44 +146,291 @@ def same_name(a: str, b: str) -> bool:
         
     # 情况 3: 多段名，首尾互换
     return False
-    
+
+# (缓存目录, 库名) -> 向量库 (没有时为 None，走旧的逐文件缓存)
+# 库名 "vectors" 为候选人论文向量：优先用内容去重库的作者视图，其次是按作者打包的库；
+# "targets" 为待消歧论文向量 (src/precompute_targets.py 生成)，模型标识与 TARGET_MODEL_ID 不一致时视为没有
+_VECTOR_STORES = {}
+
+# 跨任务共享的候选人向量 LRU 缓存 (单位 MB)，main.py / main_sl.py 在汇总里打印命中统计
+EMBEDDING_CACHE_MB = 1024
+EMBEDDING_CACHE = EmbeddingLRUCache(max_mb=EMBEDDING_CACHE_MB)
+
+# 候选人论文粗排：None = 直接用 float16 全量打分；"int8" / "binary" = 先用量化副本 (python -m src.quantized_store 生成)
+# 粗排，每个候选人只取 PROFILE_TOP_K * RESCORE_FACTOR 条短名单读 float16 精确重排
+QUANTIZED_MODE = None
+RESCORE_FACTOR = 4
+PROFILE_TOP_K = 6
+_QUANTIZED = {}
+
+# 候选人质心粗排：None = 不粗排；整数 N = 先用质心索引 (python -m src.centroid_index 生成) 给候选人排序，
+# 只为前 N 名加载全部论文向量、构建画像 (索引里没有的候选人一律保留)
+CENTROID_TOP_N = None
+
+def get_vector_store(cache_dir, name="vectors"):
+    key = (cache_dir, name)
+    if key not in _VECTOR_STORES:
+        if name == "vectors" and DedupVectorStore.exists(cache_dir):
+            _VECTOR_STORES[key] = DedupVectorStore(cache_dir, get_content_cache_path())
+        elif PackedVectorStore.exists(cache_dir, name):
+            store = PackedVectorStore(cache_dir, name)
+            if name == "targets" and store.model_id != TARGET_MODEL_ID:
+                print(f"目标论文向量库的模型标识 {store.model_id} 与当前编码器 {TARGET_MODEL_ID} 不一致，已忽略，"
+                      "请重新运行 src/precompute_targets.py")
+                store = None
+            _VECTOR_STORES[key] = store
+        else:
+            _VECTOR_STORES[key] = None
+    return _VECTOR_STORES[key]
+
+def get_quantized_vectors(cache_dir, store):
+    """候选人向量库的量化副本，未开启或未构建时为 None"""
+    if not QUANTIZED_MODE or store is None:
+        return None
+    key = (cache_dir, QUANTIZED_MODE)
+    if key not in _QUANTIZED:
+        # 去重库量化的是共享的 content 矩阵，打包库量化的是它自己
+        _QUANTIZED[key] = QuantizedVectors.open(getattr(store, "content", store), QUANTIZED_MODE)
+    return _QUANTIZED[key]
+
+# 缓存目录 -> 全量论文向量的 ANN 索引 (python -m src.ann_index 生成，没有时为 None)
+_ANN_INDEXES = {}
+
+def get_ann_index(cache_dir=None):
+    cache_dir = cache_dir or get_vector_cache_path()
+    if cache_dir not in _ANN_INDEXES:
+        _ANN_INDEXES[cache_dir] = open_ann_index(cache_dir, get_vector_store(cache_dir))
+    return _ANN_INDEXES[cache_dir]
+
+# 预计算库未命中时现场编码的目标论文向量，同一篇论文的多个待消歧作者 (pid-0, pid-3 ...) 只编码一次
+_TARGET_EMBEDDINGS = {}
+
+def lookup_target_embedding(target_id, cache_dir):
+    """目标论文向量：预计算库 -> 进程内缓存，都没有时返回 None"""
+    if not target_id:
+        return None
+    store = get_vector_store(cache_dir, "targets")
+    cached = store.get(target_id) if store is not None else None
+    if cached is not None:
+        return torch.from_numpy(cached[0]).to(device).half()
+    return _TARGET_EMBEDDINGS.get((cache_dir, target_id))
+
+def remember_target_embedding(target_id, cache_dir, target_embedding):
+    if target_id:
+        _TARGET_EMBEDDINGS[(cache_dir, target_id)] = target_embedding
+    return target_embedding
+
+def get_target_embedding(target_paper, target_id, cache_dir=None):
+    """目标论文向量：预计算库 -> 进程内缓存 -> 现场编码"""
+    cache_dir = cache_dir or get_vector_cache_path()
+    target_embedding = lookup_target_embedding(target_id, cache_dir)
+    if target_embedding is None:
+        target_embedding = ENCODER.encode_blocking([build_feature_text(target_paper)])[0]
+        remember_target_embedding(target_id, cache_dir, target_embedding)
+    return target_embedding
+
+async def get_target_embedding_async(target_paper, target_id, cache_dir=None):
+    cache_dir = cache_dir or get_vector_cache_path()
+    target_embedding = lookup_target_embedding(target_id, cache_dir)
+    if target_embedding is None:
+        target_embedding = (await ENCODER.encode([build_feature_text(target_paper)]))[0]
+        remember_target_embedding(target_id, cache_dir, target_embedding)
+    return target_embedding
+
+def lookup_candidate_embeddings(auth_id, cache_dir, store, quantized=None):
+    """
+    LRU 缓存 -> 打包向量库 / 旧逐文件缓存，都没有时返回 None (需要现场编码)。
+    开启量化粗排时，库里有的作者只返回行号数组，由 score_candidates 粗排后再读短名单的向量。
+    """
+    lru_key = (cache_dir, auth_id)
+    cand_embeddings = EMBEDDING_CACHE.get(lru_key)
+    if cand_embeddings is not None:
+        return cand_embeddings
+    if quantized is not None:
+        row_ids = store.row_ids(auth_id)
+        if row_ids is not None:
+            return row_ids
+
+    cached = None
+    if store is not None:
+        # 打包库为内存映射上的零拷贝切片，去重库为按行号聚合
+        cached = store.get(auth_id)
+        if cached is not None:
+            cached = torch.from_numpy(cached)
+    else:
+        cache_path = os.path.join(cache_dir, f"{auth_id}.safetensors")
+        if os.path.exists(cache_path):
+            cached = load_file(cache_path)["embeddings"]
+    if cached is None:
+        return None
+
+    cand_embeddings = cached.to(device).half()
+    EMBEDDING_CACHE.put(lru_key, cand_embeddings)
+    return cand_embeddings
+
+def candidate_texts(pub_ids, whole_pub_db):
+    return [build_feature_text(whole_pub_db.get(pid, {})) for pid in pub_ids]
+
+def load_candidate_embeddings(auth_id, pub_ids, whole_pub_db, cache_dir, store, quantized=None):
+    """缓存未命中时经编码服务现场编码，返回设备上的半精度张量 (或量化粗排用的行号)，没有论文时为 None"""
+    cand_embeddings = lookup_candidate_embeddings(auth_id, cache_dir, store, quantized)
+    if cand_embeddings is None:
+        pub_texts_all = candidate_texts(pub_ids, whole_pub_db)
+        if not pub_texts_all: return None
+        cand_embeddings = ENCODER.encode_blocking(pub_texts_all)
+        EMBEDDING_CACHE.put((cache_dir, auth_id), cand_embeddings)
+    return cand_embeddings
+
+async def load_all_candidate_embeddings_async(candidate_ids, author_db, whole_pub_db, cache_dir, store, quantized=None):
+    """
+    所有候选人的向量：命中缓存的直接用，未命中的一起提交给编码服务，
+    和其他任务的请求拼批编码，期间事件循环可以继续跑别的任务。
+    返回 [(auth_id, 向量)]，顺序与 candidate_ids 一致、跳过没有论文的作者。
+    """
+    embeddings = {}
+    misses = {}
+    for auth_id in candidate_ids:
+        cand_embeddings = lookup_candidate_embeddings(auth_id, cache_dir, store, quantized)
+        if cand_embeddings is not None:
+            embeddings[auth_id] = cand_embeddings
+            continue
+        pub_texts_all = candidate_texts(author_db.get(auth_id, {}).get('pubs', []), whole_pub_db)
+        if pub_texts_all:
+            misses[auth_id] = ENCODER.submit(pub_texts_all)
+
+    if misses:
+        encoded = await asyncio.gather(*(asyncio.wrap_future(f) for f in misses.values()))
+        for auth_id, cand_embeddings in zip(misses.keys(), encoded):
+            EMBEDDING_CACHE.put((cache_dir, auth_id), cand_embeddings)
+            embeddings[auth_id] = cand_embeddings
+    return [(auth_id, embeddings[auth_id]) for auth_id in candidate_ids if auth_id in embeddings]
+
+def segmented_topk(scores, counts, k, return_values=False):
+    """
+    分段 top-k：scores 是所有候选人论文分数首尾相接的一维张量，counts 是每段长度。
+    把各段散布到 (段数, 最长段) 的矩阵里、空位补 -inf，一次 topk 取出每段的段内下标，
+    与逐段调用 torch.topk 的结果一致。return_values=True 时同时返回每段的 top-k 分数。
+    """
+    if not counts:
+        return ([], []) if return_values else []
+    max_len = max(counts)
+    if max_len == 0:
+        empty = [[] for _ in counts]
+        return (empty, [[] for _ in counts]) if return_values else empty
+    device_ = scores.device
+    counts_t = torch.tensor(counts, device=device_)
+    offsets = torch.cumsum(counts_t, 0) - counts_t
+    seg_ids = torch.repeat_interleave(torch.arange(len(counts), device=device_), counts_t)
+    local_pos = torch.arange(scores.numel(), device=device_) - offsets[seg_ids]
+
+    padded = torch.full((len(counts), max_len), float("-inf"), dtype=scores.dtype, device=device_)
+    padded[seg_ids, local_pos] = scores
+    top = torch.topk(padded, k=min(k, max_len), dim=1)
+    indices = [row[:min(k, c)] for row, c in zip(top.indices.tolist(), counts)]
+    if not return_values:
+        return indices
+    return indices, [row[:min(k, c)] for row, c in zip(top.values.float().tolist(), counts)]
+
 @torch.no_grad()
-def build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper: Dict):
-    MODEL.max_seq_length = 256 #512
-    MODEL.half()
-    profiles_text = {}
+def shortlist_by_centroids(candidate_ids, target_embedding, cache_dir):
+    """开启 CENTROID_TOP_N 且有质心索引时，只保留质心分数靠前的候选人"""
+    if not CENTROID_TOP_N:
+        return candidate_ids
+    centroids = get_vector_store(cache_dir, CENTROID_STORE_NAME)
+    if centroids is None:
+        return candidate_ids
+    return rank_by_centroids(candidate_ids, target_embedding, centroids, CENTROID_TOP_N)
+
+def score_candidates(scored, target_embedding, quantized=None, k=PROFILE_TOP_K, return_values=False):
+    """
+    每个候选人 top-k 论文在其 pubs 里的下标。向量为行号数组的候选人 (量化粗排) 先按量化分数
+    取短名单，只读短名单的 float16 行，与其他候选人一起拼成大矩阵精确打分。
+    return_values=True 时同时返回对应的相似度分数。
+    """
+    shortlists = {}
+    row_entries = [i for i, (_, emb) in enumerate(scored) if isinstance(emb, np.ndarray)]
+    if row_entries:
+        query = target_embedding.float().cpu().numpy()
+        picked = quantized.shortlist([scored[i][1] for i in row_entries], query, k * RESCORE_FACTOR)
+        for i, short in zip(row_entries, picked):
+            shortlists[i] = np.sort(short)
+
+    segment_embeddings = []
+    for i, (_, emb) in enumerate(scored):
+        if i in shortlists:
+            rows = emb[shortlists[i]]
+            emb = torch.from_numpy(quantized.store.matrix[rows]).to(device).half()
+        segment_embeddings.append(emb)
+
+    # 拼成一个大矩阵，一次矩阵乘法算完所有分数，再分段取 top-k
+    counts = [emb.size(0) for emb in segment_embeddings]
+    all_scores = torch.cat(segment_embeddings, dim=0) @ target_embedding
+    all_top_indices, all_top_values = segmented_topk(all_scores, counts, k=k, return_values=True)
+    picked = [
+        [int(shortlists[i][j]) for j in top] if i in shortlists else top
+        for i, top in enumerate(all_top_indices)
+    ]
+    return (picked, all_top_values) if return_values else picked
+
+def build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper: Dict, pub_facts=None, target_id=None, scores_out=None):
+    """
+    target_id 为目标论文 ID (valid 为 pid，sa_lzk 为 wos)，用于查预计算的目标论文向量。
+    给了 scores_out (dict) 时顺便填入每个候选人 top-k 论文的平均相似度，供 token 预算截断排序。
+    """
+    cache_dir = get_vector_cache_path()
+    target_embedding = get_target_embedding(target_paper, target_id, cache_dir)
+    candidate_ids = shortlist_by_centroids(candidate_ids, target_embedding, cache_dir)
 
-    target_text = build_feature_text(target_paper)
-    target_embedding = MODEL.encode(
-        [target_text],
-        batch_size=1,
-        convert_to_tensor=True,
-        normalize_embeddings=True
-    ).half()[0]
-   
+    # 1. 收集所有候选人的论文向量
+    store = get_vector_store(cache_dir)
+    quantized = get_quantized_vectors(cache_dir, store)
+    scored = []
     for auth_id in candidate_ids:
-        cache_path = os.path.join(get_vector_cache_path(), f"{auth_id}.safetensors")
         basic_info = author_db.get(auth_id, {})
         pub_ids = basic_info.get('pubs', [])
+        cand_embeddings = load_candidate_embeddings(auth_id, pub_ids, whole_pub_db, cache_dir, store, quantized)
+        if cand_embeddings is None: continue
+        scored.append((auth_id, cand_embeddings))
 
-        current_author_name = basic_info.get('name', '')
+    return describe_candidates(scored, target_embedding, author_db, whole_pub_db, pub_facts, quantized, scores_out)
 
-        if os.path.exists(cache_path):
-            data = load_file(cache_path)
-            cand_embeddings = data["embeddings"].to(device).half()
-        else:
-            pub_texts_all = []
-            for pid in pub_ids:
-                p = whole_pub_db.get(pid, {})
-                pub_texts_all.append(build_feature_text(p))
-            if not pub_texts_all: continue
-            cand_embeddings = MODEL.encode(pub_texts_all, batch_size=16, convert_to_tensor=True,normalize_embeddings=True).half()
-
-        scores = cand_embeddings @ target_embedding
-        # 取 top-k 论文来动态构建机构和合作者信息，k 的值可以根据实际情况调整
-        top_k_val = min(6, cand_embeddings.size(0))
-        topk = torch.topk(scores, k=top_k_val)
-        top_indices = topk.indices.tolist()
+async def build_author_profiles_async(candidate_ids, author_db, whole_pub_db, target_paper: Dict, pub_facts=None, target_id=None, scores_out=None):
+    """与 build_author_profiles 结果相同；现场编码走编码服务，等待期间不阻塞事件循环"""
+    cache_dir = get_vector_cache_path()
+    store = get_vector_store(cache_dir)
+    quantized = get_quantized_vectors(cache_dir, store)
+    if CENTROID_TOP_N:
+        # 质心粗排要先拿到目标论文向量
+        target_embedding = await get_target_embedding_async(target_paper, target_id, cache_dir)
+        candidate_ids = shortlist_by_centroids(candidate_ids, target_embedding, cache_dir)
+        scored = await load_all_candidate_embeddings_async(candidate_ids, author_db, whole_pub_db, cache_dir, store, quantized)
+    else:
+        target_embedding, scored = await asyncio.gather(
+            get_target_embedding_async(target_paper, target_id, cache_dir),
+            load_all_candidate_embeddings_async(candidate_ids, author_db, whole_pub_db, cache_dir, store, quantized),
+        )
+    return describe_candidates(scored, target_embedding, author_db, whole_pub_db, pub_facts, quantized, scores_out)
+
+@torch.no_grad()
+def describe_candidates(scored, target_embedding, author_db, whole_pub_db, pub_facts=None, quantized=None, scores_out=None):
+    """scored 为 [(auth_id, 论文向量或行号)]：打分取每人 top-k 论文，构建画像文本"""
+    profiles_text = {}
+    if not scored:
+        return profiles_text
+    scored_authors = [auth_id for auth_id, _ in scored]
+
+    # 2. 打分并分段取 top-k
+    # 取 top-k 论文来动态构建机构和合作者信息，k 的值可以根据实际情况调整 (PROFILE_TOP_K)
+    all_top_indices, all_top_values = score_candidates(scored, target_embedding, quantized, return_values=True)
+    if scores_out is not None:
+        for auth_id, values in zip(scored_authors, all_top_values):
+            scores_out[auth_id] = sum(values) / len(values) if values else 0.0
+
+    # 3. 逐个候选人构建画像
+    for auth_id, top_indices in zip(scored_authors, all_top_indices):
+        basic_info = author_db.get(auth_id, {})
+        pub_ids = basic_info.get('pubs', [])
+        current_author_name = basic_info.get('name', '')
 
         # THRESHOLD = 0.65 # 阈值
         # MIN_KEEP = 3       # 搜索质量差时的保底数
@@ -199,7 +462,12 @@ def build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper:
             p_text = build_feature_text(pub_detail)
             top_works_texts.append(p_text)
 
-            # 提取机构和合作者
+            # 提取机构和合作者：优先查离线事实表 (src/pub_facts.py)，查不到再逐个作者解析
+            fact = pub_facts.get(pid, auth_id) if pub_facts is not None else None
+            if fact is not None:
+                dynamic_orgs.extend(fact["orgs"])
+                dynamic_collabs.update(fact["collabs"])
+                continue
             for auth_entry in pub_detail.get('authors', []):
                 entry_name = auth_entry.get('name', '')
                 if same_name(entry_name, current_author_name):
@@ -243,6 +511,5 @@ def build_author_profiles(candidate_ids, author_db, whole_pub_db, target_paper:
         desc += "\n"
 
         profiles_text[auth_id] = desc
-        del cand_embeddings
 
     return profiles_text
\ No newline at end of file
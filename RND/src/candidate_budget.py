@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用前的 token 预算截断：同名候选人很多时，画像全部拼进提示词会超过 16,384 tokens。
+按几个便宜的本地信号给候选人排序，在 PROFILE_TOKEN_BUDGET 之内尽量多保留：
+  1. 合作者重合：画像 collaborators 与目标论文合作者的同名个数
+  2. 机构一致：画像 orgs 与目标作者机构的模糊匹配 (与 merge_similar_orgs 同一阈值)
+  3. 向量分数：候选人 top-k 论文与目标论文的平均相似度 (build_author_profiles 的 scores_out)
+优先级与提示词一致：合作者 > 机构 > 领域。保留的候选人维持原来的顺序，没超预算时提示词逐字节不变。
+画像长度用 src/token_counter.py 的字符估算 (在事件循环里同步执行，不等分词器)。
+入口脚本 (main.py / sa_lzk/main_sl.py) 默认不截断，设置环境变量 PROFILE_TOKEN_BUDGET 后才开启。
+"""
+from rapidfuzz import fuzz
+
+from .feature_extractor import normalize_org, same_name
+from .token_counter import estimate_tokens
+
+PROFILE_TOKEN_BUDGET = 12000  # truncate_to_budget 的默认预算，只算候选人画像部分，论文信息和提示词模板另有约 1-2k
+MIN_KEEP = 1
+COAUTHOR_WEIGHT = 1.0
+COAUTHOR_CAP = 3
+ORG_WEIGHT = 0.5
+ORG_MATCH_THRESHOLD = 80
+
+
+def _profile_field(profile, name):
+    """画像里 '- collaborators: a, b' 这样的单行字段"""
+    marker = f"- {name}: "
+    if marker not in profile:
+        return []
+    line = profile.split(marker, 1)[1].split("\n", 1)[0].strip()
+    return [] if line in ("", "N/A") else [x.strip() for x in line.split(",") if x.strip()]
+
+
+def _profile_orgs(profile):
+    if "- orgs:" not in profile:
+        return []
+    section = profile.split("- orgs:", 1)[1].split("- keywords:", 1)[0]
+    orgs = []
+    for line in section.splitlines():
+        line = line.strip()
+        if line and line != "(Unknown)":
+            orgs.append(line.split(". ", 1)[-1])
+    return orgs
+
+
+def rank_candidates(candidate_profiles, paper_info, target_name, embedding_scores=None):
+    """返回 [(auth_id, 排序分数)]，分数降序"""
+    authors = paper_info.get('authors', [])
+    co_authors = [a.get('name', '') for a in authors if a.get('name') and a.get('name') != target_name]
+    target_org = ""
+    for auth in authors:
+        if auth.get('name') == target_name:
+            target_org = normalize_org(auth.get('org', '')).lower()
+            break
+    embedding_scores = embedding_scores or {}
+
+    ranked = []
+    for auth_id, profile in candidate_profiles.items():
+        collabs = _profile_field(profile, "collaborators")
+        overlap = sum(1 for c in collabs if any(same_name(c, name) for name in co_authors))
+        org_match = bool(target_org) and any(
+            fuzz.ratio(target_org, org.lower()) >= ORG_MATCH_THRESHOLD for org in _profile_orgs(profile))
+        score = (COAUTHOR_WEIGHT * min(overlap, COAUTHOR_CAP) + ORG_WEIGHT * org_match
+                 + float(embedding_scores.get(auth_id, 0.0)))
+        ranked.append((auth_id, score))
+    ranked.sort(key=lambda x: x[1], reverse=True)
+    return ranked
+
+
+def truncate_to_budget(candidate_profiles, paper_info, target_name, embedding_scores=None,
+                       budget=PROFILE_TOKEN_BUDGET, count_tokens=estimate_tokens, gt_id=None):
+    """
+    返回 (保留的画像 dict, 截断信息)。按排序贪心装入预算，放不下的跳过、继续尝试后面的，
+    至少保留 MIN_KEEP 个。截断信息写进 analysis_log：
+      kept / dropped / profile_tokens (保留部分) / gt_survived (GT 作者不在候选池里时为 None)
+    """
+    tokens = {auth_id: count_tokens(profile) for auth_id, profile in candidate_profiles.items()}
+    total = sum(tokens.values())
+    if total <= budget:
+        kept_ids = set(candidate_profiles)
+    else:
+        kept_ids, used = set(), 0
+        for auth_id, _ in rank_candidates(candidate_profiles, paper_info, target_name, embedding_scores):
+            if used + tokens[auth_id] <= budget or len(kept_ids) < MIN_KEEP:
+                kept_ids.add(auth_id)
+                used += tokens[auth_id]
+
+    kept = {auth_id: profile for auth_id, profile in candidate_profiles.items() if auth_id in kept_ids}
+    info = {
+        "kept": len(kept),
+        "dropped": len(candidate_profiles) - len(kept),
+        "profile_tokens": sum(tokens[auth_id] for auth_id in kept),
+        "budget": budget,
+        "gt_survived": (gt_id in kept_ids) if gt_id in candidate_profiles else None,
+    }
+    return kept, info
@@ -1,27 +1,191 @@
+import hashlib
 import json
 import os
 # -*- coding: utf-8 -*-
-from src.feature_extractor import same_name
+from src.feature_extractor import same_name, normalize_name
+
+NAME_INDEX_VERSION = 2
 
 def get_target_author(paper_info, author_idx):
     """
-    根据后缀索引获取具体的待消歧作者对象 
+    根据后缀索引获取具体的待消歧作者对象
     """
     authors = paper_info.get('authors', [])
     if author_idx < len(authors):
         return authors[author_idx]
     return None
 
+
+def author_names_hash(author_db):
+    """作者库 (作者 ID, 姓名) 序列的哈希：增删作者、顺序变化或改名都会使它改变"""
+    digest = hashlib.blake2b(digest_size=16)
+    for author_id, profile in author_db.items():
+        digest.update(f"{author_id}\x1f{profile.get('name', '')}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class NameIndex:
+    """
+    same_name 的倒排索引：把 same_name 接受的几种情况预先展开成字典键，
+    召回从全表扫描变成几次 dict 查找，结果 (含顺序) 与线性扫描完全一致。
+      exact:   规范化全名
+      swap:    两段名按互换顺序登记 (li_wei 也登记在 wei_li 下)
+      abbr:    作者本身是缩写 (j_li)，按 (首字母, 姓) 登记
+      initial: 两段名按 (名首字母, 姓) 登记，供缩写形式的目标名查找
+    值均为作者在 author_db 中的序号，查询后按序号排序即还原扫描顺序。
+    source_hash 为构建时作者库的 author_names_hash，落盘的索引据此判断是否过期。
+    """
+
+    def __init__(self, author_ids, exact, swap, abbr, initial, source_size=None, source_hash=None):
+        self.author_ids = author_ids
+        self.exact = exact
+        self.swap = swap
+        self.abbr = abbr
+        self.initial = initial
+        self.source_size = len(author_ids) if source_size is None else source_size
+        self.source_hash = source_hash
+
+    @classmethod
+    def build(cls, author_db, source_hash=None):
+        author_ids = []
+        exact, swap, abbr, initial = {}, {}, {}, {}
+        for pos, (author_id, profile) in enumerate(author_db.items()):
+            author_ids.append(author_id)
+            norm = normalize_name(profile.get('name', ""))
+            if not norm:
+                continue
+            exact.setdefault(norm, []).append(pos)
+            parts = norm.split("_")
+            if len(parts) != 2:
+                continue
+            first, last = parts
+            swap.setdefault(f"{last}_{first}", []).append(pos)
+            if len(first) == 1:
+                abbr.setdefault(f"{first}_{last}", []).append(pos)
+            if first:
+                initial.setdefault(f"{first[0]}_{last}", []).append(pos)
+        return cls(author_ids, exact, swap, abbr, initial, source_hash=source_hash or author_names_hash(author_db))
+
+    def lookup(self, target_name):
+        norm = normalize_name(target_name)
+        if not norm:
+            return []
+        hits = set(self.exact.get(norm, []))
+        parts = norm.split("_")
+        if len(parts) == 2:
+            first, last = parts
+            hits.update(self.swap.get(norm, []))
+            # 作者是缩写：作者首字母必须是目标名的前缀
+            if first:
+                hits.update(self.abbr.get(f"{first[0]}_{last}", []))
+            # 目标是缩写：作者名以该首字母开头
+            if len(first) == 1:
+                hits.update(self.initial.get(f"{first}_{last}", []))
+        return [self.author_ids[pos] for pos in sorted(hits)]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": NAME_INDEX_VERSION,
+                "source_hash": self.source_hash,
+                "author_ids": self.author_ids,
+                "exact": self.exact,
+                "swap": self.swap,
+                "abbr": self.abbr,
+                "initial": self.initial,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != NAME_INDEX_VERSION:
+            raise ValueError(f"姓名索引版本不匹配: {path}")
+        return cls(data["author_ids"], data["exact"], data["swap"], data["abbr"], data["initial"],
+                   source_hash=data.get("source_hash"))
+
+
+# author_db 对象 id -> NameIndex，进程内只构建一次
+_NAME_INDEXES = {}
+
+def load_name_index(author_db, index_path=None):
+    """
+    为 author_db 准备姓名索引并登记：优先读取磁盘上的索引 (作者 ID 与姓名都需与当前库一致)，
+    否则现场构建，给了 index_path 时顺便落盘。
+    """
+    index = None
+    source_hash = None
+    if index_path and os.path.exists(index_path):
+        try:
+            index = NameIndex.load(index_path)
+            source_hash = author_names_hash(author_db)
+            if index.source_hash != source_hash:
+                print(f"姓名索引与作者库不一致，重新构建: {index_path}")
+                index = None
+        except Exception as e:
+            print(f"姓名索引读取失败，重新构建: {e}")
+            index = None
+    if index is None:
+        index = NameIndex.build(author_db, source_hash)
+        if index_path:
+            index.save(index_path)
+    _NAME_INDEXES[id(author_db)] = (author_db, index)
+    return index
+
 def get_candidates(target_author, author_db):
     """
     第一阶段：召回。根据名字找到所有可能的专家 ID。
     """
     target_name = target_author.get('name', "")
+
+    entry = _NAME_INDEXES.get(id(author_db))
+    if entry is None or entry[0] is not author_db:
+        load_name_index(author_db)
+        entry = _NAME_INDEXES[id(author_db)]
+    return entry[1].lookup(target_name)
+
+
+def get_candidates_scan(target_author, author_db):
+    """原始线性扫描实现，保留用于核对索引结果"""
+    target_name = target_author.get('name', "")
     candidates = []
-    
+
     for author_id, profile in author_db.items():
         profile_name = profile.get('name', "")
         if same_name(profile_name, target_name):
             candidates.append(author_id)
-            
+
     return candidates
+
+
+# 语义召回：ANN 最近邻作者里再按名字宽松过滤，补回 same_name 漏掉的姓名变体
+SEMANTIC_RECALL_TOP_N = 10
+
+def loose_name_match(a, b):
+    """宽松匹配：两个名字规范化后至少共享一个两字母以上的片段 (li_weimin / wei_min_li 共享 li)"""
+    ta = {t for t in normalize_name(a).split("_") if len(t) > 1}
+    tb = {t for t in normalize_name(b).split("_") if len(t) > 1}
+    return bool(ta & tb)
+
+def semantic_recall(target_author, author_db, target_embedding, ann_index, exclude=(), top_n=SEMANTIC_RECALL_TOP_N):
+    """
+    第一阶段补充召回：按目标论文向量查 ANN 索引 (src/ann_index.py)，
+    返回名字与目标宽松匹配、且不在 exclude (姓名召回结果) 里的作者，按语义分数降序。
+    """
+    if ann_index is None or target_embedding is None:
+        return []
+    target_name = target_author.get('name', "")
+    exclude = set(exclude)
+    query = target_embedding.float().cpu().numpy() if hasattr(target_embedding, "cpu") else target_embedding
+    recalled = []
+    for author_id, _ in ann_index.nearest_authors(query, top_n=top_n * 10):
+        if author_id in exclude or author_id not in author_db:
+            continue
+        if loose_name_match(author_db[author_id].get('name', ""), target_name):
+            recalled.append(author_id)
+            if len(recalled) >= top_n:
+                break
+    return recalled
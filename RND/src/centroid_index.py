@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+作者质心索引：每个作者一行归一化的平均向量，论文多的作者再加几个 k-means 子质心
+(研究方向分散的作者，单个平均向量会被拉到几个方向中间)。
+存成向量缓存目录下的 centroids 打包库，键为作者 ID，值为 (1 + 子质心数, dim)。
+
+运行时先用目标论文向量和所有候选人的质心做一次小矩阵乘法 (每人取各行最大值) 排序，
+只有排在前面的候选人才去加载全部论文向量、构建画像 (见 bge_feature_extractor.CENTROID_TOP_N)。
+
+构建: python -m src.centroid_index   (在 preprocess_vectors 之后运行，作者论文有变化时重跑)
+"""
+import os
+import numpy as np
+import torch
+from .vector_store import PackedVectorStore
+
+CENTROID_STORE_NAME = "centroids"
+SUBCENTROID_MIN_PUBS = 40 # 论文数达到该值的作者才做 k-means
+NUM_SUBCENTROIDS = 4
+KMEANS_ITERS = 10
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def spherical_kmeans(vectors, k, iters=KMEANS_ITERS, seed=0):
+    """余弦距离下的 k-means，返回归一化的簇中心 (去掉空簇)"""
+    rng = np.random.default_rng(seed)
+    centers = vectors[rng.choice(len(vectors), size=k, replace=False)]
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centers.T, axis=1)
+        new_centers = []
+        for c in range(len(centers)):
+            members = vectors[assign == c]
+            if len(members):
+                new_centers.append(members.mean(axis=0))
+        centers = _normalize(np.stack(new_centers))
+    return centers
+
+
+def author_centroids(vectors):
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    rows = [_normalize(vectors.mean(axis=0))]
+    if len(vectors) >= SUBCENTROID_MIN_PUBS:
+        rows.extend(spherical_kmeans(vectors, NUM_SUBCENTROIDS))
+    return np.stack(rows)
+
+
+def build_centroid_index(store, cache_dir, flush_every=2000):
+    """store 为候选人向量库 (DedupVectorStore 或 PackedVectorStore)，结果整体重建后原子替换"""
+    build_name = CENTROID_STORE_NAME + ".build"
+    for suffix in (".bin", ".index.json", ".meta.json"):
+        # 上次中断留下的半成品
+        if os.path.exists(os.path.join(cache_dir, build_name + suffix)):
+            os.remove(os.path.join(cache_dir, build_name + suffix))
+    tmp = PackedVectorStore(cache_dir, name=build_name)
+    for i, auth_id in enumerate(list(store.keys())):
+        vectors = store.get(auth_id)
+        if vectors is None or not len(vectors):
+            continue
+        tmp.append(auth_id, author_centroids(vectors))
+        if (i + 1) % flush_every == 0:
+            tmp.flush()
+    tmp.close()
+    tmp._matrix = None
+    for suffix in (".bin", ".index.json", ".meta.json"):
+        os.replace(os.path.join(cache_dir, tmp.name + suffix),
+                   os.path.join(cache_dir, CENTROID_STORE_NAME + suffix))
+    final = PackedVectorStore(cache_dir, name=CENTROID_STORE_NAME)
+    print(f"质心索引完成: {len(final)} 个作者 / {final.rows} 行 -> {cache_dir}")
+    return final
+
+
+def rank_by_centroids(candidate_ids, target_embedding, centroids, top_n):
+    """
+    用质心给候选人打分 (各行与目标论文的最大余弦)，返回保留下来的候选人，顺序与 candidate_ids 一致。
+    索引里没有的作者 (新作者、未预处理) 无法粗排，一律保留。
+    """
+    indexed = [auth_id for auth_id in candidate_ids if auth_id in centroids]
+    if len(indexed) <= top_n:
+        return list(candidate_ids)
+
+    blocks = [centroids.get(auth_id) for auth_id in indexed]
+    counts = torch.tensor([len(b) for b in blocks])
+    matrix = torch.from_numpy(np.concatenate(blocks)).to(target_embedding.device, target_embedding.dtype)
+    scores = (matrix @ target_embedding).float()
+    seg_ids = torch.repeat_interleave(torch.arange(len(blocks)), counts).to(scores.device)
+    best = torch.full((len(blocks),), float("-inf"), device=scores.device).scatter_reduce(0, seg_ids, scores, reduce="amax")
+    keep = {indexed[i] for i in torch.topk(best, k=top_n).indices.tolist()}
+    return [auth_id for auth_id in candidate_ids if auth_id in keep or auth_id not in centroids]
+
+
+if __name__ == "__main__":
+    from .util import get_vector_cache_path, get_content_cache_path
+    from .vector_store import DedupVectorStore
+
+    cache_dir = get_vector_cache_path()
+    if DedupVectorStore.exists(cache_dir):
+        source = DedupVectorStore(cache_dir, get_content_cache_path())
+    else:
+        source = PackedVectorStore(cache_dir)
+    build_centroid_index(source, cache_dir)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发控制 (AIMD)：代替手调的 asyncio.Semaphore(N)。
+  - 加性增：一个观察窗口 (= 当前上限个请求) 内没有错误、p95 延迟正常、且并发真的用满了，上限 +1
+  - 乘性减：遇到 429 / 超时 / 服务过载立即把上限乘以 BACKOFF；窗口内错误率过高，或某类请求的 p95
+    比它的基线高出 P95_FACTOR 倍时同样回退
+  - 一次回退之后，在回退前就已发出的请求再报错不会重复回退 (它们反映的是旧的并发水平)
+延迟按请求类型 (kind，例如 L1 过滤 / L2 分析 / 单层 Disambiguator) 分开统计：每类攒够 MIN_P95_SAMPLES
+个回退后发出的请求才算一次 p95，基线是历次 p95 的指数滑动平均 (BASELINE_ALPHA)，服务商整体变慢时基线
+会跟着升上去。与负载无关的延迟抖动不会让上限一路降到 1。
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+
+BACKOFF = 0.7
+P95_FACTOR = 2.0
+ERROR_RATE_LIMIT = 0.1
+LATENCY_WINDOW = 200
+MIN_P95_SAMPLES = 40
+BASELINE_ALPHA = 0.2
+DEFAULT_KIND = "default"
+OVERLOAD_STATUS = (429, 503, 529)
+OVERLOAD_ERRORS = ("RateLimitError", "Timeout", "APITimeoutError", "ServiceUnavailableError", "TimeoutError")
+
+
+def is_overload(exc):
+    """429、超时、服务过载：说明并发开大了 (任务被取消不算，见 release)"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status in OVERLOAD_STATUS:
+        return True
+    return type(exc).__name__ in OVERLOAD_ERRORS or "429" in str(exc)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=10, min_limit=1, max_limit=64):
+        self.configure(initial, min_limit, max_limit)
+        self.in_flight = 0
+        self._cond = None
+        # kind -> 最近的延迟 (汇总用)、回退后攒下的待评估样本、p95 基线
+        self.kinds = defaultdict(lambda: {"latencies": deque(maxlen=LATENCY_WINDOW), "pending": [], "baseline": None})
+        self._last_decrease = 0.0
+        self._window = {"ok": 0, "errors": 0, "peak": 0}
+        self.completed = 0
+        self.overloads = 0
+        self.errors = 0
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+        self._first_start = None
+        self._last_end = None
+
+    def configure(self, initial=10, min_limit=1, max_limit=64):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial, self.min_limit), self.max_limit)
+        self.peak_limit = self.limit
+
+    async def acquire(self):
+        if self._cond is None:
+            # Condition 必须在事件循环里创建
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._window["peak"] = max(self._window["peak"], self.in_flight)
+        now = time.monotonic()
+        if self._first_start is None:
+            self._first_start = now
+        return now
+
+    async def release(self, started_at, exc=None, kind=DEFAULT_KIND):
+        """started_at 为 acquire 的返回值；exc 为请求抛出的异常 (成功时为 None)；kind 为请求类型"""
+        now = time.monotonic()
+        self._last_end = now
+        if isinstance(exc, asyncio.CancelledError):
+            # worker 取消或进程退出：与服务端负载无关，只归还名额，不计入统计
+            pass
+        elif exc is None:
+            self.completed += 1
+            self._window["ok"] += 1
+            self._record_latency(kind, started_at, now)
+        elif is_overload(exc):
+            self.overloads += 1
+            if started_at >= self._last_decrease:
+                self._decrease(now)
+        else:
+            self.errors += 1
+            self._window["errors"] += 1
+
+        if self._window["ok"] + self._window["errors"] >= self.limit:
+            self._evaluate_window(now)
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def run(self, coro_fn, *args, kind=DEFAULT_KIND, **kwargs):
+        started_at = await self.acquire()
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except BaseException as e:
+            await asyncio.shield(self.release(started_at, e, kind))
+            raise
+        await self.release(started_at, kind=kind)
+        return result
+
+    def _record_latency(self, kind, started_at, now):
+        state = self.kinds[kind]
+        state["latencies"].append(now - started_at)
+        if started_at < self._last_decrease:
+            return  # 回退前发出的请求反映的是旧的并发水平
+        state["pending"].append(now - started_at)
+        if len(state["pending"]) < MIN_P95_SAMPLES:
+            return
+        p95 = percentile(state["pending"], 0.95)
+        state["pending"] = []
+        baseline = state["baseline"]
+        state["baseline"] = p95 if baseline is None else (1 - BASELINE_ALPHA) * baseline + BASELINE_ALPHA * p95
+        if baseline is not None and p95 > baseline * P95_FACTOR:
+            self._decrease(now)
+
+    def _evaluate_window(self, now):
+        """错误率和加性增按窗口判断；延迟在 _record_latency 里按类型判断"""
+        w = self._window
+        total = w["ok"] + w["errors"]
+        if w["errors"] / total > ERROR_RATE_LIMIT:
+            self._decrease(now)
+        elif w["peak"] >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.increases += 1
+            self.peak_limit = max(self.peak_limit, self.limit)
+        self._window = {"ok": 0, "errors": 0, "peak": self.in_flight}
+
+    def _decrease(self, now):
+        new_limit = max(self.min_limit, int(self.limit * BACKOFF))
+        if new_limit < self.limit:
+            self.limit = new_limit
+            self.decreases += 1
+        self._last_decrease = now
+        self._window = {"ok": 0, "errors": 0, "peak": self.in_flight}
+        for state in self.kinds.values():
+            state["pending"] = []
+
+    def throughput(self):
+        if self._first_start is None or self._last_end is None or self._last_end <= self._first_start:
+            return 0.0
+        return self.completed / (self._last_end - self._first_start)
+
+    def summary(self):
+        p95 = " / ".join(f"{kind} {percentile(state['latencies'], 0.95):.2f}s"
+                         for kind, state in self.kinds.items() if state["latencies"]) or "N/A"
+        return (f"LLM 自适应并发: 当前上限 {self.limit} (区间 {self.min_limit}-{self.max_limit}，峰值 {self.peak_limit}，"
+                f"+{self.increases}/-{self.decreases}) | 完成 {self.completed} 次请求，吞吐 {self.throughput():.2f} 次/秒"
+                f" | p95 {p95} | 限流/超时 {self.overloads} 次，其他错误 {self.errors} 次")
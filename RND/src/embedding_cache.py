@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+候选人向量的进程内 LRU 缓存：常见姓名簇 (同一批 li_wei) 会出现在大量任务里，
+命中时直接复用已经搬到设备上、转成半精度的张量，不再重复读缓存和编码。
+"""
+import threading
+from collections import OrderedDict
+
+
+class EmbeddingLRUCache:
+    def __init__(self, max_mb=1024):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _nbytes(tensor):
+        return tensor.element_size() * tensor.nelement()
+
+    def get(self, key):
+        with self._lock:
+            tensor = self._items.get(key)
+            if tensor is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return tensor
+
+    def put(self, key, tensor):
+        size = self._nbytes(tensor)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self._nbytes(old)
+            self._items[key] = tensor
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= self._nbytes(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "size_mb": round(self.current_bytes / 1024 / 1024, 1),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0.0,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"向量 LRU 缓存: 命中 {s['hits']} / 未命中 {s['misses']} (命中率 {s['hit_rate']:.2f}%) | "
+                f"淘汰 {s['evictions']} | 占用 {s['size_mb']}/{s['max_mb']} MB, {s['entries']} 个作者")
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+bge-m3 编码器后端，运行时 (bge_feature_extractor) 和离线脚本 (preprocess_vectors / precompute_targets) 共用。
+
+可选后端 (环境变量 ENCODER_BACKEND 或下面的默认值):
+  "torch"      原始 SentenceTransformer；只有在 GPU 上才转半精度，CPU 上保持 float32
+  "torch_int8" CPU 上对所有 Linear 层做 int8 动态量化 (torch.quantization.quantize_dynamic)
+  "onnx"       ONNX Runtime 推理 (需要 sentence-transformers>=3.2 以及 optimum[onnxruntime])
+
+换后端前先用 src/encoder_parity.py 核对与参考模型的余弦一致性和吞吐。
+非 torch 后端的名字参与离线向量的内容哈希 (util.embedding_model_id)，换后端后 preprocess_vectors 会重编，
+不会与 torch 编出的向量混在同一个键下。
+"""
+import os
+import glob
+import torch
+from sentence_transformers import SentenceTransformer
+
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+BACKENDS = ("torch", "torch_int8", "onnx")
+
+
+def find_snapshot_path():
+    """本地 huggingface 缓存里的 bge-m3 快照，没有时返回模型名 (联网下载)"""
+    snapshot_pattern = os.path.expanduser("~/.cache/huggingface/hub/models--BAAI--bge-m3/snapshots/*")
+    snapshot_paths = glob.glob(snapshot_pattern)
+    return snapshot_paths[0] if snapshot_paths else "BAAI/bge-m3"
+
+
+def load_encoder(snapshot_path, backend=None, device=None, max_seq_length=256):
+    backend = backend or ENCODER_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的编码器后端: {backend}，可选 {BACKENDS}")
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if backend == "torch":
+        model = SentenceTransformer(snapshot_path, device=device)
+        if device == "cuda":
+            model.half() # 半精度只对 GPU 有意义，CPU 上反而更慢甚至不支持
+    elif backend == "torch_int8":
+        model = SentenceTransformer(snapshot_path, device="cpu")
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    else:
+        try:
+            model = SentenceTransformer(snapshot_path, device="cpu", backend="onnx")
+        except (TypeError, ImportError) as e:
+            raise RuntimeError("onnx 后端需要 sentence-transformers>=3.2 和 optimum[onnxruntime]") from e
+
+    model.max_seq_length = max_seq_length
+    return model
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+编码器后端一致性检查：用同一批论文文本分别跑参考模型 (float32 的 torch 后端) 和待测后端，
+报告逐条余弦相似度 (均值 / 最小值 / 低于阈值的条数) 和两边的编码吞吐。
+
+用法: python src/encoder_parity.py [后端 ...]   (默认检查 torch_int8 和 onnx)
+"""
+import os
+import sys
+import time
+import torch
+from util import build_feature_text
+from pub_store import open_pub_db
+from encoder_backend import BACKENDS, find_snapshot_path, load_encoder
+
+# --- 配置区 ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WHOLE_PUB_PATH = os.path.join(BASE_DIR, "..", "dataset", "valid", "whole_author_profiles_pub.json")
+SAMPLE_SIZE = 1000
+BATCH_SIZE = 32
+MAX_SEQ_LENGTH = 256 # 与运行时一致
+COSINE_WARN = 0.99 # 低于该值的文本单独计数
+
+def load_sample_texts():
+    whole_pub_db = open_pub_db(WHOLE_PUB_PATH)
+    texts = []
+    for pid in whole_pub_db.keys():
+        texts.append(build_feature_text(whole_pub_db.get(pid)))
+        if len(texts) >= SAMPLE_SIZE:
+            break
+    return texts
+
+def timed_encode(model, texts):
+    model.encode(texts[:BATCH_SIZE], batch_size=BATCH_SIZE) # 预热
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=BATCH_SIZE, convert_to_tensor=True,
+                              normalize_embeddings=True, show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+    return embeddings.float().cpu(), len(texts) / max(elapsed, 1e-6)
+
+def check_parity(backends):
+    snapshot_path = find_snapshot_path()
+    texts = load_sample_texts()
+    print(f"样本 {len(texts)} 条，参考模型: torch float32 (cpu)")
+    reference, ref_speed = timed_encode(load_encoder(snapshot_path, "torch", device="cpu", max_seq_length=MAX_SEQ_LENGTH), texts)
+    print(f"  [reference] {ref_speed:.1f} texts/sec")
+
+    for backend in backends:
+        try:
+            model = load_encoder(snapshot_path, backend, device="cpu", max_seq_length=MAX_SEQ_LENGTH)
+        except RuntimeError as e:
+            print(f"  [{backend}] 跳过: {e}")
+            continue
+        embeddings, speed = timed_encode(model, texts)
+        cosine = (embeddings * reference).sum(dim=1)
+        low = int((cosine < COSINE_WARN).sum())
+        print(f"  [{backend}] {speed:.1f} texts/sec ({speed / ref_speed:.2f}x) | "
+              f"余弦 均值 {cosine.mean():.5f} / 最小 {cosine.min():.5f} | 低于 {COSINE_WARN}: {low} 条")
+
+if __name__ == "__main__":
+    backends = sys.argv[1:] or [b for b in BACKENDS if b != "torch"]
+    torch.set_grad_enabled(False)
+    check_parity(backends)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+动态微批编码服务：并发任务各自提交少量文本 (目标论文 1 条、未缓存候选人十几条)，
+后台线程把一段时间内到达的请求拼成一个大批次统一 encode，再按请求切分结果。
+submit 返回 concurrent.futures.Future，协程里用 await service.encode(texts)，不阻塞事件循环。
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EncoderService:
+    def __init__(self, model, max_batch=64, max_wait_ms=5):
+        self.model = model
+        self.max_batch = max_batch          # 一个批次最多多少条文本
+        self.max_wait = max_wait_ms / 1000  # 收到第一个请求后最多再等多久凑批
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="encoder-service", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts):
+        """提交一组文本，Future 的结果为 (len(texts), dim) 的半精度张量"""
+        future = Future()
+        if not texts:
+            future.set_result(None)
+            return future
+        self.start()
+        self._queue.put((list(texts), future))
+        return future
+
+    async def encode(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def encode_blocking(self, texts):
+        return self.submit(texts).result()
+
+    def _collect(self):
+        """阻塞等第一个请求，然后在 max_wait 内继续收集，直到凑满 max_batch 条"""
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                start = time.perf_counter()
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=self.max_batch,
+                    convert_to_tensor=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False
+                ).half()
+                self.encode_seconds += time.perf_counter() - start
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.requests += len(pending)
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for request_texts, future in pending:
+                # clone：结果会进 LRU 缓存，不能让切片一直引用整个批次的张量
+                future.set_result(embeddings[offset:offset + len(request_texts)].clone())
+                offset += len(request_texts)
+
+    def summary(self):
+        avg = self.texts / self.batches if self.batches else 0.0
+        return (f"编码服务: {self.requests} 个请求 / {self.texts} 条文本合并为 {self.batches} 个批次 "
+                f"(平均 {avg:.1f} 条/批) | 编码耗时 {self.encode_seconds:.1f}s")
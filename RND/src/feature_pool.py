@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+特征提取执行池：把召回、画像构建这类同步 CPU 工作从 asyncio 事件循环挪到线程池或进程池里，
+事件循环只负责等待，期间可以继续处理其他任务的 LLM 响应。
+
+  kind="thread"   线程池；torch / numpy 计算会释放 GIL，现场编码经编码服务在线程之间合批
+  kind="process"  进程池；每个工作进程由 initializer 各自加载数据库和模型，传入的函数与参数必须可 pickle
+max_pending 限制同时提交给池子的任务数 (有界队列)，超出的协程在事件循环里排队，不会把整批任务一次塞进执行器。
+
+每个阶段统计两种耗时: wait = 提交到开始执行的排队时间，run = 实际执行时间。
+"""
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+
+
+def _timed_call(fn, args, kwargs):
+    """在执行器里运行，返回 (结果, 开始时刻, 执行耗时)；开始时刻用 time.time() 以便跨进程比较"""
+    started_at = time.time()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, started_at, time.perf_counter() - start
+
+
+class FeaturePool:
+    def __init__(self, kind="thread", max_workers=4, max_pending=16, initializer=None, initargs=()):
+        if kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feature",
+                                               initializer=initializer, initargs=initargs)
+        elif kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=initializer, initargs=initargs)
+        else:
+            raise ValueError(f"未知的执行池类型: {kind}，可选 thread / process")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._slots = None
+        self.stats = defaultdict(lambda: {"count": 0, "wait": 0.0, "run": 0.0, "max_wait": 0.0, "max_run": 0.0})
+
+    async def run(self, stage, fn, *args, **kwargs):
+        if self._slots is None:
+            # 信号量必须在事件循环里创建
+            self._slots = asyncio.Semaphore(self.max_pending)
+        queued_at = time.time()
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            result, started_at, run_seconds = await loop.run_in_executor(self.executor, _timed_call, fn, args, kwargs)
+        wait_seconds = max(started_at - queued_at, 0.0)
+
+        s = self.stats[stage]
+        s["count"] += 1
+        s["wait"] += wait_seconds
+        s["run"] += run_seconds
+        s["max_wait"] = max(s["max_wait"], wait_seconds)
+        s["max_run"] = max(s["max_run"], run_seconds)
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def summary(self):
+        lines = [f"特征执行池 ({self.kind} x {self.max_workers}，最多 {self.max_pending} 个在途):"]
+        for stage, s in self.stats.items():
+            n = max(s["count"], 1)
+            lines.append(f"     [{stage}] {s['count']} 次 | 排队 平均 {s['wait'] / n * 1000:.1f}ms / 最长 {s['max_wait'] * 1000:.1f}ms"
+                         f" | 执行 平均 {s['run'] / n * 1000:.1f}ms / 最长 {s['max_run'] * 1000:.1f}ms")
+        return "\n".join(lines)
@@ -2,30 +2,10 @@
 import dspy
 import os
 import asyncio
-from transformers import AutoTokenizer 
-
-TOKENIZER_DIR = r"D:\download\deepseek_v3_tokenizer\deepseek_v3_tokenizer"
-try:
-    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_DIR, trust_remote_code=True)
-    tokenizer.model_max_length = 100000
-except Exception as e:
-    print(f"Tokenizer 加载失败: {e}")
-    tokenizer = None
-
-def get_token_count(text):
-    """利用官方分词器计算精确长度"""
-    if tokenizer and text:
-        try:
-            tokens = tokenizer.encode(
-                str(text), 
-                add_special_tokens=False, 
-                truncation=False
-            )
-            return len(tokens)
-        except Exception:
-            # 如果极端情况报错，回退到字符估算（学术场景 1 token ≈ 3-4 字符）
-            return len(str(text)) // 4 
-    return 0
+from .llm_client import acall
+from .token_counter import TOKEN_COUNTER
+
+
 class DisambiguationSignature(dspy.Signature):
     prompt = dspy.InputField(desc="完整任务描述")
     
@@ -42,9 +22,15 @@ class Disambiguator(dspy.Module):
     def __call__(self, prompt):
         return self.predictor(prompt=prompt)
 
+    async def acall(self, prompt):
+        return await acall(self.predictor, prompt=prompt)
+
+# 模块实例只创建一次，所有任务共用
+DISAMBIGUATOR = Disambiguator()
+
 async def ask_deepseek_async(task_id, paper_info, candidate_profiles, target_name, current_index=0, total_count=0):
     """
-    异步封装层：利用 dspy.asyncify 实现并发调用
+    异步封装层：共用 DISAMBIGUATOR，经 llm_client 走原生异步请求
     """
     authors_list = paper_info.get('authors', [])
     num_candidates = len(candidate_profiles)
@@ -66,11 +52,7 @@ async def ask_deepseek_async(task_id, paper_info, candidate_profiles, target_nam
     paper_text += f"摘要: {paper_info.get('abstract', 'N/A')[:200]}"
 
     profiles_text = "\n".join([f"【ID: {k}】\n{v}" for k, v in candidate_profiles.items()])
-    in_tokens = get_token_count(paper_text + profiles_text)
 
-    model = Disambiguator()
-    async_model = dspy.asyncify(model)
-    
     try:
         prompt = f"""
 [任务目标]
@@ -98,8 +80,10 @@ reasoning: 不超过200字
 严格按格式输出，不要额外内容。
 """
 
-        prediction = await async_model(prompt=prompt)
-        out_tokens = get_token_count(prediction.best_id + prediction.reasoning)
+        prediction = await DISAMBIGUATOR.acall(prompt=prompt)
+        in_tokens = await TOKEN_COUNTER.count(paper_text + profiles_text)
+        out_tokens = await TOKEN_COUNTER.count(prediction.best_id + prediction.reasoning)
+        TOKEN_COUNTER.record_usage(task_id, prediction)
         res_id = prediction.best_id.strip().replace("'", "").replace('"', "")
         
         if res_id.upper() in ["NIL", "NONE", "NEW_AUTHOR"]:
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 响应缓存：重跑实验 (换评估器、调阈值、清空日志后重跑) 时，论文文本和候选人画像逐字节相同，
+直接复用上次的输出，不再重新请求 DeepSeek。
+  - 存在一个 SQLite 文件里，键 = sha256(模型及其参数, Signature 定义, 渲染后的输入)
+  - 只缓存单个 dspy.Predict 的输出字段 (Disambiguator / L1LightweightFilter / L2DeepAnalysis 各自一条)
+  - 按 Signature 统计命中率，运行结束时在汇总里打印
+  LLM_CACHE=0          关闭缓存 (不读也不写)
+  LLM_CACHE_REPLAY=1   确定性回放：只读缓存，未命中直接报错而不是请求 API，用于基准测试
+                       (LLMCacheMiss 会一直抛到调度器，该任务不记结果，下次运行重试)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import dspy
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "1") != "0"
+LLM_CACHE_REPLAY = os.environ.get("LLM_CACHE_REPLAY", "0") == "1"
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "output/llm_cache.sqlite")
+
+
+class LLMCacheMiss(RuntimeError):
+    """回放模式下缓存未命中"""
+
+
+def from_cache(prediction):
+    """该 prediction 是否由缓存直接返回 (没有发请求，也就没有 API usage)"""
+    return getattr(prediction, "_llm_cache_hit", False)
+
+
+def signature_text(predictor):
+    """Signature 的名字、说明和各字段描述；改了提示词字段描述，缓存自然失效"""
+    sig = predictor.signature
+    fields = {}
+    for name, field in sig.fields.items():
+        extra = getattr(field, "json_schema_extra", None) or {}
+        fields[name] = {k: str(v) for k, v in extra.items()}
+    return json.dumps({"name": sig.__name__, "instructions": getattr(sig, "instructions", ""), "fields": fields},
+                      ensure_ascii=False, sort_keys=True)
+
+
+def model_text():
+    lm = dspy.settings.lm
+    if lm is None:
+        return ""
+    return json.dumps({"model": getattr(lm, "model", str(lm)), "kwargs": getattr(lm, "kwargs", {})},
+                      ensure_ascii=False, sort_keys=True, default=str)
+
+
+class LLMResponseCache:
+    def __init__(self, path=LLM_CACHE_PATH, enabled=LLM_CACHE_ENABLED, replay=LLM_CACHE_REPLAY):
+        self.path = path
+        self.enabled = enabled
+        self.replay = replay
+        self._conn = None
+        # 老版本 dspy 经 asyncify 在工作线程里调用，连接共用一把锁
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        if replay and not enabled:
+            print("警告: 设置了 LLM_CACHE_REPLAY=1 但 LLM_CACHE=0，缓存已关闭，回放模式不生效，请求会直接发给 API")
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, signature TEXT, "
+                               "outputs TEXT, created REAL)")
+            self._conn.commit()
+        return self._conn
+
+    def make_key(self, predictor, inputs):
+        payload = json.dumps([model_text(), signature_text(predictor), inputs],
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, predictor, inputs):
+        """返回 (key, 缓存的 dspy.Prediction 或 None)；回放模式下未命中抛 LLMCacheMiss"""
+        name = predictor.signature.__name__
+        key = self.make_key(predictor, inputs)
+        with self._lock:
+            row = self._connect().execute("SELECT outputs FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.stats[name]["hits"] += 1
+            prediction = dspy.Prediction(**json.loads(row[0]))
+            prediction._llm_cache_hit = True
+            return key, prediction
+        self.stats[name]["misses"] += 1
+        if self.replay:
+            raise LLMCacheMiss(f"回放模式下 LLM 缓存未命中: {name} {key[:12]}")
+        return key, None
+
+    def store(self, key, predictor, prediction):
+        outputs = {name: getattr(prediction, name, None) for name in predictor.signature.output_fields}
+        if not any(outputs.values()):
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses (key, signature, outputs, created) VALUES (?, ?, ?, ?)",
+                         (key, predictor.signature.__name__, json.dumps(outputs, ensure_ascii=False), time.time()))
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def summary(self):
+        if not self.enabled:
+            return "LLM 响应缓存: 已关闭"
+        hits = sum(s["hits"] for s in self.stats.values())
+        total = hits + sum(s["misses"] for s in self.stats.values())
+        mode = "回放" if self.replay else "读写"
+        parts = [f"LLM 响应缓存 ({mode}): 命中 {hits}/{total} ({hits / max(total, 1):.1%})"]
+        for name, s in self.stats.items():
+            n = s["hits"] + s["misses"]
+            parts.append(f"{name} {s['hits']}/{n}")
+        return " | ".join(parts)
+
+
+LLM_CACHE = LLMResponseCache()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用客户端：各 llm 模块的 dspy 实例只创建一次，请求走原生 asyncio 路径。
+  - dspy 的 Predict / Module 有 acall 时直接 await (底层是 litellm.acompletion，不占线程)
+  - 老版本 dspy 没有 acall 时退回 dspy.asyncify，包装按实例只做一次
+  - litellm 共用一个带连接池的 httpx.AsyncClient：keep-alive 复用连接，最大连接数可配
+dspy.asyncify 把每次阻塞调用丢进工作线程，并发上限就是线程池大小；原生路径下
+同一进程可以同时挂着几百个请求。
+单个 dspy.Predict 的调用先查 LLM 响应缓存 (src/llm_cache.py)，未命中才真正发请求；
+真正发出的请求由 LLM_LIMITER (src/concurrency.py，AIMD 自适应并发) 控制同时在途的数量。
+"""
+import os
+import dspy
+
+from .llm_cache import LLM_CACHE
+from .concurrency import AdaptiveLimiter
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 200))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", 100))
+LLM_KEEPALIVE_EXPIRY = 60
+LLM_TIMEOUT = 120
+
+_HTTP_CLIENT = None
+_POOL_UNAVAILABLE = False
+# id(模块实例) -> (实例, asyncify 包装)，仅在 dspy 不支持 acall 时使用
+_ASYNC_WRAPPERS = {}
+# 入口脚本用 LLM_LIMITER.configure(initial, min_limit, max_limit) 设定起始并发和区间
+LLM_LIMITER = AdaptiveLimiter()
+
+
+def init_http_pool(max_connections=LLM_MAX_CONNECTIONS, max_keepalive=LLM_MAX_KEEPALIVE, timeout=LLM_TIMEOUT):
+    """创建共享的 httpx.AsyncClient 并交给 litellm；重复调用直接返回已有的客户端"""
+    global _HTTP_CLIENT, _POOL_UNAVAILABLE
+    if _HTTP_CLIENT is not None or _POOL_UNAVAILABLE:
+        return _HTTP_CLIENT
+    try:
+        import httpx
+        import litellm
+    except ImportError as e:
+        print(f"未安装 httpx / litellm，LLM 请求使用默认连接: {e}")
+        _POOL_UNAVAILABLE = True
+        return None
+    _HTTP_CLIENT = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                            keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(timeout),
+    )
+    litellm.aclient_session = _HTTP_CLIENT
+    print(f"LLM 连接池已就绪: 最多 {max_connections} 个连接，保活 {max_keepalive} 个")
+    return _HTTP_CLIENT
+
+
+async def close_http_pool():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        return
+    await _HTTP_CLIENT.aclose()
+    _HTTP_CLIENT = None
+    try:
+        import litellm
+        litellm.aclient_session = None
+    except ImportError:
+        pass
+
+
+async def _acall(module, **kwargs):
+    if _HTTP_CLIENT is None:
+        init_http_pool()
+    if hasattr(module, "acall"):
+        return await module.acall(**kwargs)
+    entry = _ASYNC_WRAPPERS.get(id(module))
+    if entry is None or entry[0] is not module:
+        entry = _ASYNC_WRAPPERS[id(module)] = (module, dspy.asyncify(module))
+    return await entry[1](**kwargs)
+
+
+async def _request(module, **kwargs):
+    """只在 Predict 这一层占并发名额：两层模块内部的两次请求各占一次，不会嵌套等待；延迟按 Signature 分开统计"""
+    if isinstance(module, dspy.Predict):
+        return await LLM_LIMITER.run(_acall, module, kind=module.signature.__name__, **kwargs)
+    return await _acall(module, **kwargs)
+
+
+async def acall(module, **kwargs):
+    """异步调用一个 dspy Predict / Module；Predict 的调用经过响应缓存"""
+    if not (LLM_CACHE.enabled and isinstance(module, dspy.Predict)):
+        return await _request(module, **kwargs)
+    key, cached = LLM_CACHE.lookup(module, kwargs)
+    if cached is not None:
+        return cached
+    prediction = await _request(module, **kwargs)
+    LLM_CACHE.store(key, module, prediction)
+    return prediction
+
+
+def call(module, **kwargs):
+    """同步调用，缓存逻辑与 acall 相同 (两层模块的同步 forward 使用)"""
+    if not (LLM_CACHE.enabled and isinstance(module, dspy.Predict)):
+        return module(**kwargs)
+    key, cached = LLM_CACHE.lookup(module, kwargs)
+    if cached is not None:
+        return cached
+    prediction = module(**kwargs)
+    LLM_CACHE.store(key, module, prediction)
+    return prediction
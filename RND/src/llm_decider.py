@@ -2,30 +2,14 @@
 import dspy
 import os
 import asyncio
-from transformers import AutoTokenizer 
+from .llm_client import acall
+from .token_counter import TOKEN_COUNTER
 
-TOKENIZER_DIR = r"D:\download\deepseek_v3_tokenizer\deepseek_v3_tokenizer"
-try:
-    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_DIR, trust_remote_code=True)
-    tokenizer.model_max_length = 100000
-except Exception as e:
-    print(f"Tokenizer 加载失败: {e}")
-    tokenizer = None
 
 def get_token_count(text):
-    """利用官方分词器计算精确长度"""
-    if tokenizer and text:
-        try:
-            tokens = tokenizer.encode(
-                str(text), 
-                add_special_tokens=False, 
-                truncation=False
-            )
-            return len(tokens)
-        except Exception:
-            # 如果极端情况报错，回退到字符估算（学术场景 1 token ≈ 3-4 字符）
-            return len(str(text)) // 4 
-    return 0
+    """同步计数，只在 asyncify 的工作线程里调用 (forward)；协程里用 await TOKEN_COUNTER.count(...)"""
+    return TOKEN_COUNTER.count_blocking(text)
+
 
 class DisambiguationSignature(dspy.Signature):
 
@@ -76,9 +60,15 @@ class Disambiguator(dspy.Module):
     def __call__(self, paper_info, candidate_profiles):
         return self.predictor(paper_info=paper_info, candidate_profiles=candidate_profiles)
 
+    async def acall(self, paper_info, candidate_profiles):
+        return await acall(self.predictor, paper_info=paper_info, candidate_profiles=candidate_profiles)
+
+# 模块实例只创建一次，所有任务共用
+DISAMBIGUATOR = Disambiguator()
+
 async def ask_deepseek_async(task_id, paper_info, candidate_profiles, target_name, current_index=0, total_count=0):
     """
-    异步封装层：利用 dspy.asyncify 实现并发调用
+    异步封装层：共用 DISAMBIGUATOR，经 llm_client 走响应缓存和原生异步请求
     """
     authors_list = paper_info.get('authors', [])
     num_candidates = len(candidate_profiles)
@@ -100,14 +90,12 @@ async def ask_deepseek_async(task_id, paper_info, candidate_profiles, target_nam
     paper_text += f"摘要: {paper_info.get('abstract', 'N/A')[:200]}"
 
     profiles_text = "\n".join([f"【ID: {k}】\n{v}" for k, v in candidate_profiles.items()])
-    in_tokens = get_token_count(paper_text + profiles_text)
+    in_tokens = await TOKEN_COUNTER.count(paper_text + profiles_text)
 
-    model = Disambiguator()
-    async_model = dspy.asyncify(model)
-    
     try:
-        prediction = await async_model(paper_info=paper_text, candidate_profiles=profiles_text)
-        out_tokens = get_token_count(prediction.best_id + prediction.reasoning)
+        prediction = await DISAMBIGUATOR.acall(paper_info=paper_text, candidate_profiles=profiles_text)
+        out_tokens = await TOKEN_COUNTER.count(prediction.best_id + prediction.reasoning)
+        TOKEN_COUNTER.record_usage(task_id, prediction)
         res_id = prediction.best_id.strip().replace("'", "").replace('"', "")
         
         if res_id.upper() in ["NIL", "NONE", "NEW_AUTHOR"]:
@@ -3,24 +3,14 @@ import dspy
 import re
 import json
 import asyncio
-from transformers import AutoTokenizer 
+from .llm_client import acall, call
+from .llm_cache import LLMCacheMiss, from_cache
+from .token_counter import TOKEN_COUNTER
 
-TOKENIZER_DIR = r"D:\download\deepseek_v3_tokenizer\deepseek_v3_tokenizer"
-try:
-    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_DIR, trust_remote_code=True)
-    tokenizer.model_max_length = 100000
-except Exception as e:
-    print(f"Tokenizer 加载失败: {e}")
-    tokenizer = None
 
 def get_token_count(text):
-    if tokenizer and text:
-        try:
-            tokens = tokenizer.encode(str(text), add_special_tokens=False, truncation=False)
-            return len(tokens)
-        except Exception:
-            return len(str(text)) // 4 
-    return 0
+    """同步计数，只在 asyncify 的工作线程里调用 (forward)；协程里用 await TOKEN_COUNTER.count(...)"""
+    return TOKEN_COUNTER.count_blocking(text)
 
 
 class L1LightweightFilter(dspy.Signature):
@@ -100,8 +90,8 @@ class TwoStageDisambiguator(dspy.Module):
         return final_ids
 
 
-    def forward(self, paper_text, candidate_profiles_dict,gt_id=None,current_index=0, total_count=0, mode="strict"):
-
+    def _build_l1_inputs(self, candidate_profiles_dict):
+        """L1 只看候选人的机构、关键词和合作者"""
         l1_cands_list = []
         for k, v in candidate_profiles_dict.items():
             orgs_section = v.split("- orgs:")[1].split("- keywords:")[0].strip() if "- orgs:" in v else "N/A"
@@ -112,12 +102,15 @@ class TwoStageDisambiguator(dspy.Module):
             )
 
         l1_cands_text = "\n\n".join(l1_cands_list)
-        l1_in_tokens = get_token_count(paper_text + l1_cands_text)
+        return l1_cands_text
 
-        print(f"[{current_index}/{total_count}] [第一层粗筛结束] 初始候选人: {len(candidate_profiles_dict)} | Tokens: {l1_in_tokens}")
-
-        l1_res = self.l1_filter(paper_info=paper_text, candidate_briefs=l1_cands_text)
-        top_ids = self._parse_and_truncate(l1_res.results)
+    def _build_l2_stage(self, paper_text, candidate_profiles_dict, l1_results, l1_in_tokens, gt_id=None,
+                        current_index=0, total_count=0, mode="strict"):
+        """
+        根据 L1 结果准备第二层：返回 (stage_context, L2 候选人画像, stats)，stats 里的 L2 token 数由调用方补上；
+        strict 模式下 L1 没有入围者时直接返回最终的 dspy.Prediction
+        """
+        top_ids = self._parse_and_truncate(l1_results)
 
         l1_hit = 0
         is_nil_gt = (gt_id is None)
@@ -172,30 +165,70 @@ class TwoStageDisambiguator(dspy.Module):
             }
 
         l2_profiles_text = "\n".join(filtered_profiles.values())
-        l2_in_tokens = get_token_count(paper_text + l2_profiles_text)
-
-        print(f"[{current_index}/{total_count}] [第二层深度分析开始] 输入候选人: {len(filtered_profiles)} | Tokens: {l2_in_tokens}")
 
         stats = {
             "l1_hit": l1_hit,
-            "two_stage_total_input_tokens": l1_in_tokens + l2_in_tokens,
+            "two_stage_total_input_tokens": l1_in_tokens,
             "l1_cands": len(candidate_profiles_dict),
             "l1_tokens": l1_in_tokens,
             "l2_cands": len(filtered_profiles),
-            "l2_tokens": l2_in_tokens,
+            "l2_tokens": 0,
             "mode": mode,
             "l1_empty": int(not top_ids)
         }
+        return stage_context, l2_profiles_text, stats
 
-        res = self.l2_analyzer(
-            stage_context=stage_context,
-            paper_info=paper_text,
-            candidate_profiles=l2_profiles_text
-        )
+    @staticmethod
+    def _add_l2_tokens(stats, l2_in_tokens):
+        stats["l2_tokens"] = l2_in_tokens
+        stats["two_stage_total_input_tokens"] = stats["l1_tokens"] + l2_in_tokens
+
+    def forward(self, paper_text, candidate_profiles_dict,gt_id=None,current_index=0, total_count=0, mode="strict"):
+        l1_cands_text = self._build_l1_inputs(candidate_profiles_dict)
+        l1_in_tokens = get_token_count(paper_text + l1_cands_text)
+        print(f"[{current_index}/{total_count}] [第一层粗筛结束] 初始候选人: {len(candidate_profiles_dict)} | Tokens: {l1_in_tokens}")
+        l1_res = call(self.l1_filter, paper_info=paper_text, candidate_briefs=l1_cands_text)
+        stage = self._build_l2_stage(paper_text, candidate_profiles_dict, l1_res.results, l1_in_tokens,
+                                     gt_id, current_index, total_count, mode)
+        if isinstance(stage, dspy.Prediction):
+            stage.stage_stats["cached_stages"] = int(from_cache(l1_res))
+            return stage
+
+        stage_context, l2_profiles_text, stats = stage
+        l2_in_tokens = get_token_count(paper_text + l2_profiles_text)
+        print(f"[{current_index}/{total_count}] [第二层深度分析开始] 输入候选人: {stats['l2_cands']} | Tokens: {l2_in_tokens}")
+        res = call(self.l2_analyzer, stage_context=stage_context, paper_info=paper_text, candidate_profiles=l2_profiles_text)
+        self._add_l2_tokens(stats, l2_in_tokens)
+        stats["cached_stages"] = int(from_cache(l1_res)) + int(from_cache(res))
+        res.stage_stats = stats
+        return res
+
+    async def aforward(self, paper_text, candidate_profiles_dict, gt_id=None, current_index=0, total_count=0, mode="strict"):
+        """与 forward 相同的两层流程，两次请求都经过 llm_client (响应缓存 + 自适应并发)，不占线程"""
+        l1_cands_text = self._build_l1_inputs(candidate_profiles_dict)
+        l1_in_tokens = await TOKEN_COUNTER.count(paper_text + l1_cands_text)
+        print(f"[{current_index}/{total_count}] [第一层粗筛结束] 初始候选人: {len(candidate_profiles_dict)} | Tokens: {l1_in_tokens}")
+        l1_res = await acall(self.l1_filter, paper_info=paper_text, candidate_briefs=l1_cands_text)
+        stage = self._build_l2_stage(paper_text, candidate_profiles_dict, l1_res.results, l1_in_tokens,
+                                     gt_id, current_index, total_count, mode)
+        if isinstance(stage, dspy.Prediction):
+            stage.stage_stats["cached_stages"] = int(from_cache(l1_res))
+            return stage
+
+        stage_context, l2_profiles_text, stats = stage
+        l2_in_tokens = await TOKEN_COUNTER.count(paper_text + l2_profiles_text)
+        print(f"[{current_index}/{total_count}] [第二层深度分析开始] 输入候选人: {stats['l2_cands']} | Tokens: {l2_in_tokens}")
+        res = await acall(self.l2_analyzer, stage_context=stage_context, paper_info=paper_text,
+                          candidate_profiles=l2_profiles_text)
+        self._add_l2_tokens(stats, l2_in_tokens)
+        stats["cached_stages"] = int(from_cache(l1_res)) + int(from_cache(res))
         res.stage_stats = stats
         return res
 
 
+# 模块实例只创建一次，所有任务共用
+TWO_STAGE_DISAMBIGUATOR = TwoStageDisambiguator()
+
 
 async def ask_deepseek_two_stage_async(task_id, paper_info, candidate_profiles, target_name, gt_id=None,current_index=0, total_count=0):
     """
@@ -221,16 +254,14 @@ async def ask_deepseek_two_stage_async(task_id, paper_info, candidate_profiles,
         paper_text += f"论文关键词: {', '.join(keywords)}"
 
     profiles_text = "\n".join([f"【ID: {k}】\n{v}" for k, v in candidate_profiles.items()])
-    original_in_tokens = get_token_count(paper_text + profiles_text)
-    
-    model = TwoStageDisambiguator()
-    async_model = dspy.asyncify(model)
+    original_in_tokens = await TOKEN_COUNTER.count(paper_text + profiles_text)
     
     try:
-        # 执行两层推理
-        prediction = await async_model(paper_text=paper_text, candidate_profiles_dict=candidate_profiles,gt_id=gt_id,current_index=current_index, total_count=total_count)
+        # 执行两层推理 (L1 / L2 两次请求各自经过响应缓存和自适应并发)
+        prediction = await acall(TWO_STAGE_DISAMBIGUATOR, paper_text=paper_text, candidate_profiles_dict=candidate_profiles,gt_id=gt_id,current_index=current_index, total_count=total_count)
         
-        out_tokens = get_token_count(prediction.best_id + prediction.reasoning)
+        out_tokens = await TOKEN_COUNTER.count(prediction.best_id + prediction.reasoning)
+        TOKEN_COUNTER.record_usage(task_id, prediction, complete=not prediction.stage_stats.get("cached_stages"))
         res_id = prediction.best_id.strip().replace("'", "").replace('"', "")
         
         # 结果标准化
@@ -251,6 +282,8 @@ async def ask_deepseek_two_stage_async(task_id, paper_info, candidate_profiles,
             s["l1_hit"],
             (gt_id is None)
         )
+    except LLMCacheMiss:
+        raise
     except Exception as e:
         print(f" 任务 {task_id} 两层调用异常: {e}")
         return (task_id, None, str(e), 0, 0, 0, 0, 0, 0, (gt_id is None))
\ No newline at end of file
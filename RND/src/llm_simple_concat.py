@@ -2,26 +2,9 @@
 import dspy
 import re
 import asyncio
-from transformers import AutoTokenizer
-
-TOKENIZER_DIR = r"D:\download\deepseek_v3_tokenizer\deepseek_v3_tokenizer"
-try:
-    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_DIR, trust_remote_code=True)
-    tokenizer.model_max_length = 100000
-except Exception as e:
-    print(f"Tokenizer 加载失败: {e}")
-    tokenizer = None
-
-
-def get_token_count(text):
-    """利用官方分词器计算长度。"""
-    if tokenizer and text:
-        try:
-            tokens = tokenizer.encode(str(text), add_special_tokens=False, truncation=False)
-            return len(tokens)
-        except Exception:
-            return len(str(text)) // 4
-    return 0
+from .llm_client import acall
+from .llm_cache import LLMCacheMiss
+from .token_counter import TOKEN_COUNTER
 
 
 class SimpleConcatSignature(dspy.Signature):
@@ -43,6 +26,9 @@ class SimpleConcatDisambiguator(dspy.Module):
     def __call__(self, prompt):
         return self.predictor(prompt=prompt)
 
+    async def acall(self, prompt):
+        return await acall(self.predictor, prompt=prompt)
+
 
 class SimpleConcatFallbackDisambiguator(dspy.Module):
     def __init__(self):
@@ -52,6 +38,14 @@ class SimpleConcatFallbackDisambiguator(dspy.Module):
     def __call__(self, prompt):
         return self.predictor(prompt=prompt)
 
+    async def acall(self, prompt):
+        return await acall(self.predictor, prompt=prompt)
+
+
+# 模块实例只创建一次，所有任务共用
+DISAMBIGUATOR = SimpleConcatDisambiguator()
+FALLBACK_DISAMBIGUATOR = SimpleConcatFallbackDisambiguator()
+
 
 def _extract_fields(prediction_obj):
     """兼容结构化输出失败时的自由文本解析。"""
@@ -120,12 +114,7 @@ async def ask_deepseek_async(task_id, paper_info, candidate_profiles, target_nam
     paper_text += f"摘要: {paper_info.get('abstract', 'N/A')[:200]}"
 
     profiles_text = "\n".join([f"【ID: {k}】\n{v}" for k, v in candidate_profiles.items()])
-    in_tokens = get_token_count(paper_text + profiles_text)
-
-    model = SimpleConcatDisambiguator()
-    async_model = dspy.asyncify(model)
-    fallback_model = SimpleConcatFallbackDisambiguator()
-    fallback_async_model = dspy.asyncify(fallback_model)
+    in_tokens = await TOKEN_COUNTER.count(paper_text + profiles_text)
 
     prompt = f"""请根据下面信息，判断论文作者最可能对应哪个候选人ID。
 如果都不匹配，输出 new_author。
@@ -144,12 +133,15 @@ reasoning: <简要理由，不超过200字>
     try:
         print(f"[{current_index}/{total_count}] [SimpleConcat] 开始请求，候选人: {num_candidates}")
         try:
-            prediction = await asyncio.wait_for(async_model(prompt=prompt), timeout=120)
+            prediction = await asyncio.wait_for(DISAMBIGUATOR.acall(prompt=prompt), timeout=120)
+        except LLMCacheMiss:
+            raise
         except Exception:
-            prediction = await asyncio.wait_for(fallback_async_model(prompt=prompt), timeout=120)
+            prediction = await asyncio.wait_for(FALLBACK_DISAMBIGUATOR.acall(prompt=prompt), timeout=120)
 
         best_id, reasoning = _extract_fields(prediction)
-        out_tokens = get_token_count((best_id or "") + (reasoning or ""))
+        out_tokens = await TOKEN_COUNTER.count((best_id or "") + (reasoning or ""))
+        TOKEN_COUNTER.record_usage(task_id, prediction)
         res_id = (best_id or "").strip().replace("'", "").replace('"', "")
 
         if res_id.upper() in ["NIL", "NONE", "NEW_AUTHOR", ""]:
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+批量预计算待消歧论文 (目标论文) 的向量，写入向量缓存目录下的 targets 打包库，
+键为论文 ID，目录本身按数据集和特征模式区分 (见 util.get_vector_cache_path)。
+库的 meta 里记录模型标识 (模型 + 截断长度 + 编码器后端)，与当前设置不一致时整体重编；
+运行时 build_author_profiles 先查这里 (模型标识对不上时忽略整个库)，未命中才现场编码。
+"""
+import json
+import os
+import time
+from tqdm import tqdm
+from util import get_vector_cache_path, build_feature_text, build_sa_paper_info, embedding_model_id, TARGET_MAX_SEQ_LENGTH
+from vector_store import PackedVectorStore
+from encoder_backend import load_encoder, find_snapshot_path, ENCODER_BACKEND
+
+# --- 配置区 ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VALID_UNASS_PUB_PATH = os.path.join(BASE_DIR, "..", "dataset", "valid", "cna_valid_unass_pub2.json")
+SA_UNASS_PATH = os.path.join(BASE_DIR, "..", "dataset", "sa_lzk_data", "unass.json")
+CHUNK_SIZE = 4096   # 每次送进 encode 的文本数，编码完即提交一次
+BATCH_SIZE = 128
+
+# --- 模型加载 ---
+snapshot_path = find_snapshot_path()
+print(f"正在加载模型: {snapshot_path}")
+MODEL = load_encoder(snapshot_path, backend=ENCODER_BACKEND, max_seq_length=TARGET_MAX_SEQ_LENGTH) # 必须与 bge_feature_extractor 现场编码目标论文时一致
+MODEL_ID = embedding_model_id(ENCODER_BACKEND, TARGET_MAX_SEQ_LENGTH)
+
+def load_valid_targets():
+    with open(VALID_UNASS_PUB_PATH, 'r', encoding='utf-8') as f:
+        pubs_db = json.load(f)
+    return {pid: build_feature_text(paper) for pid, paper in pubs_db.items()}
+
+def load_sa_targets():
+    with open(SA_UNASS_PATH, 'r', encoding='utf-8') as f:
+        unass_list = json.load(f)
+    return {
+        item['wos']: build_feature_text(build_sa_paper_info(item))
+        for item in unass_list if item.get('wos')
+    }
+
+def precompute(dataset_name, load_targets):
+    # get_vector_cache_path 依据 CURRENT_DATASET 区分数据集目录
+    if dataset_name:
+        os.environ["CURRENT_DATASET"] = dataset_name
+    else:
+        os.environ.pop("CURRENT_DATASET", None)
+    store = PackedVectorStore(get_vector_cache_path(), name="targets")
+    if len(store) and store.model_id != MODEL_ID:
+        print(f"[{dataset_name or 'valid'}] 已有库的模型标识 {store.model_id} 与当前 {MODEL_ID} 不一致，清空后重编")
+        store.clear()
+    store.model_id = MODEL_ID
+
+    texts = load_targets()
+    pending = [pid for pid in texts if pid not in store]
+    print(f"[{dataset_name or 'valid'}] 目标论文 {len(texts)} 篇，已缓存 {len(texts) - len(pending)}，待编码 {len(pending)}")
+    # 按长度排序，同一批次内 padding 更少
+    pending.sort(key=lambda pid: len(texts[pid]))
+
+    start = time.perf_counter()
+    for i in tqdm(range(0, len(pending), CHUNK_SIZE)):
+        chunk = pending[i:i + CHUNK_SIZE]
+        embeddings = MODEL.encode(
+            [texts[pid] for pid in chunk],
+            batch_size=BATCH_SIZE,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).half().cpu().numpy()
+        for pid, emb in zip(chunk, embeddings):
+            store.append(pid, emb)
+        store.flush()
+    store.close()
+    elapsed = time.perf_counter() - start
+    if pending:
+        print(f"编码完成: {len(pending)} 篇，{len(pending) / max(elapsed, 1e-6):.1f} texts/sec")
+
+if __name__ == "__main__":
+    if os.path.exists(VALID_UNASS_PUB_PATH):
+        precompute(None, load_valid_targets)
+    if os.path.exists(SA_UNASS_PATH):
+        precompute("sa_lzk", load_sa_targets)
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import json
 import os
+import time
+import multiprocessing
+import numpy as np
 import torch
 import glob
+from collections import Counter
 from tqdm import tqdm
-from safetensors.torch import save_file
-from sentence_transformers import SentenceTransformer
-from util import get_vector_cache_path, build_feature_text
+from util import get_vector_cache_path, get_content_cache_path, build_feature_text, text_hash, embedding_model_id, EMBEDDING_MAX_SEQ_LENGTH
+from pub_store import open_pub_db
+from vector_store import DedupVectorStore
+from encoder_backend import load_encoder, ENCODER_BACKEND
 
 # --- 配置区 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +20,18 @@ VECTOR_CACHE_DIR = os.path.join(BASE_DIR, "..", "output", "vector_cache")
 WHOLE_AUTHOR_PATH = os.path.join(DATA_DIR, "whole_author_profiles.json")
 WHOLE_PUB_PATH = os.path.join(DATA_DIR, "whole_author_profiles_pub.json")
 TEST_AUTHOR_NUM = None # 正式运行时设为 None 遍历全部作者
+FLUSH_EVERY = 500 # 每处理多少个作者提交一次向量库索引
+# 编码模式: "bucketed" = 所有作者的待编码文本进全局队列，按长度分桶大批量编码；
+#           "sharded"  = 全局队列切成分片，NUM_WORKERS 个进程各带一份模型并行编码，可中断续跑；
+#           "per_author" = 旧流程，逐作者 encode(batch_size=32)，用于吞吐对比
+ENCODE_MODE = "bucketed"
+NUM_WORKERS = 4 # sharded 模式的工作进程数
+THREADS_PER_WORKER = None # 每个进程的 torch 线程数，None 表示按 CPU 核数平均分配
+SHARD_SIZE = 2000 # 每个分片的文本条数
+BUCKET_TOKEN_BUDGET = 32768 # 每批 条数 x 最长 token 数 的上限 (显存/内存不足时调小)
+BUCKET_MAX_BATCH = 256
+FLUSH_BUCKETS = 50 # 每编码多少个桶提交一次内容库
+MAX_SEQ_LENGTH = EMBEDDING_MAX_SEQ_LENGTH # 编码截断长度，改这里时内容哈希随之改变
 os.makedirs(VECTOR_CACHE_DIR, exist_ok=True)
 
 # --- 模型加载 ---
@@ -24,63 +41,304 @@ snapshot_pattern = os.path.expanduser("~/.cache/huggingface/hub/models--BAAI--bg
 snapshot_paths = glob.glob(snapshot_pattern)
 snapshot_path = snapshot_paths[0] if snapshot_paths else "BAAI/bge-m3"
 
-print(f"正在加载模型: {snapshot_path}")
-MODEL = SentenceTransformer(snapshot_path, device=device)
-MODEL.max_seq_length = 512
-MODEL.half() # 针对3060显存优化
+MODEL = None
+# 内容哈希的模型标识由实际加载模型用的后端和截断长度拼出，二者任一变化都不会命中旧向量
+MODEL_ID = embedding_model_id(ENCODER_BACKEND, MAX_SEQ_LENGTH)
 
-def run_preprocessing():
+def load_model():
+    """按需加载模型；sharded 模式下每个工作进程各自加载一份"""
+    global MODEL
+    if MODEL is None:
+        print(f"正在加载模型: {snapshot_path}")
+        # GPU 上为半精度 (针对3060显存优化)，CPU 上可经 ENCODER_BACKEND 选 int8 / onnx 后端
+        MODEL = load_encoder(snapshot_path, backend=ENCODER_BACKEND, device=device, max_seq_length=MAX_SEQ_LENGTH)
+    return MODEL
+
+MANIFEST_NAME = "manifest.json"
+
+def load_manifest(path):
+    """manifest: auth_id -> {"pubs": [...], "hashes": [...]}，记录作者视图每一行来自哪篇论文、哪段文本"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _atomic_write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def save_manifest(path, manifest):
+    _atomic_write_json(path, manifest)
+
+def diff_pubs(entry, pub_ids, text_keys):
+    """与 manifest 对比，统计新增 / 文本变化 / 删除的论文数"""
+    old = dict(zip(entry["pubs"], entry["hashes"])) if entry else {}
+    new = dict(zip(pub_ids, text_keys))
+    added = sum(1 for pid in new if pid not in old)
+    changed = sum(1 for pid, key in new.items() if pid in old and old[pid] != key)
+    removed = sum(1 for pid in old if pid not in new)
+    return added, changed, removed
+
+def encode_texts(texts, batch_size=32):
+    return load_model().encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_tensor=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    ).half().cpu().numpy()
+
+def token_lengths(texts, chunk_size=10000):
+    """用模型自带的分词器算截断后的 token 数，分桶时据此控制 padding"""
+    model = load_model()
+    lengths = []
+    for i in range(0, len(texts), chunk_size):
+        encoded = model.tokenizer(texts[i:i + chunk_size], add_special_tokens=True,
+                                  truncation=True, max_length=model.max_seq_length)
+        lengths.extend(len(ids) for ids in encoded["input_ids"])
+    return lengths
+
+def iter_length_buckets(lengths, token_budget=None, max_batch=None):
+    """按长度升序切批：每批 (条数 x 批内最长) 不超过 token 预算，批内长度接近、padding 很少"""
+    token_budget = token_budget or BUCKET_TOKEN_BUDGET
+    max_batch = max_batch or BUCKET_MAX_BATCH
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batch = []
+    for idx in order:
+        length = max(lengths[idx], 1)
+        if batch and ((len(batch) + 1) * length > token_budget or len(batch) >= max_batch):
+            yield batch
+            batch = []
+        batch.append(idx)
+    if batch:
+        yield batch
+
+def encode_bucketed(store, pending):
+    """全局队列：所有作者待编码的文本统一分桶编码，再按哈希写回内容库；返回纯编码耗时"""
+    keys = list(pending.keys())
+    texts = [pending[k] for k in keys]
+    buckets = list(iter_length_buckets(token_lengths(texts)))
+    print(f"全局待编码 {len(texts)} 条文本，分为 {len(buckets)} 个长度桶")
+    encode_seconds = 0.0
+    for b, batch in enumerate(tqdm(buckets)):
+        start = time.perf_counter()
+        vectors = encode_texts([texts[i] for i in batch], batch_size=len(batch))
+        encode_seconds += time.perf_counter() - start
+        for i, vector in zip(batch, vectors):
+            store.add_text(keys[i], vector)
+        # 内容行随时提交，中断后重跑只需编码剩下的文本
+        if (b + 1) % FLUSH_BUCKETS == 0:
+            store.flush()
+    store.flush()
+    return encode_seconds
+
+def get_shard_dir():
+    """分片工作目录放在共享内容库下，与数据集无关"""
+    return os.path.join(get_content_cache_path(), "shards")
+
+def _init_shard_worker(num_threads):
+    # 每个工作进程限定 torch 线程数，并加载自己的模型副本
+    torch.set_num_threads(num_threads)
+    load_model()
+
+def _encode_shard(in_path):
+    """工作进程：编码一个分片，结果先写临时文件再改名，改名成功即视为该分片完成"""
+    with open(in_path, 'r', encoding='utf-8') as f:
+        shard = json.load(f)
+    texts = shard["texts"]
+    start = time.perf_counter()
+    vectors = np.zeros((len(texts), load_model().get_sentence_embedding_dimension()), dtype=np.float16)
+    for batch in iter_length_buckets(token_lengths(texts)):
+        vectors[batch] = encode_texts([texts[i] for i in batch], batch_size=len(batch))
+    seconds = time.perf_counter() - start
+    out_path = in_path[:-len(".in.json")] + ".out.npy"
+    tmp_path = out_path + ".tmp.npy"
+    np.save(tmp_path, vectors)
+    os.replace(tmp_path, out_path)
+    return in_path, out_path, seconds
+
+def _merge_shard(store, in_path, out_path):
+    """主进程是内容库唯一的写入者：合并一个完成的分片并提交，然后删除分片文件"""
+    with open(in_path, 'r', encoding='utf-8') as f:
+        keys = json.load(f)["keys"]
+    vectors = np.load(out_path)
+    for key, vector in zip(keys, vectors):
+        store.add_text(key, vector)
+    store.flush()
+    os.remove(out_path)
+    os.remove(in_path)
+    return len(keys)
+
+def encode_sharded(store, pending):
+    """
+    多进程分片编码：待编码文本按长度排序后切成分片写到工作目录，
+    NUM_WORKERS 个进程各自加载模型并行编码，完成一个合并一个。
+    进程被杀后重跑：已完成但未合并的分片先合并，其余文本重新切片，已完成的分片不会重做。
+    返回各工作进程编码耗时之和 / 墙钟时间。
+    """
+    shard_dir = get_shard_dir()
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # 1. 合并上次中断时已完成的分片
+    recovered = 0
+    for out_path in sorted(glob.glob(os.path.join(shard_dir, "*.out.npy"))):
+        in_path = out_path[:-len(".out.npy")] + ".in.json"
+        if os.path.exists(in_path):
+            recovered += _merge_shard(store, in_path, out_path)
+    for stale in glob.glob(os.path.join(shard_dir, "*")):
+        os.remove(stale)
+    if recovered:
+        print(f"已合并上次中断前完成的分片: {recovered} 条文本")
+
+    # 2. 剩余文本按长度排序后切片 (同一分片内长度接近，工作进程内再精确分桶)
+    keys = sorted((k for k in pending if not store.has_text(k)), key=lambda k: len(pending[k]))
+    shard_paths = []
+    for shard_id, i in enumerate(range(0, len(keys), SHARD_SIZE)):
+        shard_keys = keys[i:i + SHARD_SIZE]
+        in_path = os.path.join(shard_dir, f"shard_{shard_id:05d}.in.json")
+        _atomic_write_json(in_path, {"keys": shard_keys, "texts": [pending[k] for k in shard_keys]})
+        shard_paths.append(in_path)
+    if not shard_paths:
+        return 0.0, 0.0
+
+    num_threads = THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // NUM_WORKERS)
+    print(f"共 {len(keys)} 条文本切成 {len(shard_paths)} 个分片，{NUM_WORKERS} 个进程 x {num_threads} 线程")
+
+    # 3. 并行编码，主进程按完成顺序逐个合并提交
+    encode_seconds = 0.0
+    wall_start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(NUM_WORKERS, initializer=_init_shard_worker, initargs=(num_threads,)) as pool:
+        for in_path, out_path, seconds in tqdm(pool.imap_unordered(_encode_shard, shard_paths)):
+            _merge_shard(store, in_path, out_path)
+            encode_seconds += seconds
+    return encode_seconds, time.perf_counter() - wall_start
+
+def run_preprocessing(author_path=WHOLE_AUTHOR_PATH, pub_path=WHOLE_PUB_PATH, encode_mode=None):
+    encode_mode = encode_mode or ENCODE_MODE
     # 1. 加载基础数据库
     print("加载数据库中...")
-    with open(WHOLE_AUTHOR_PATH, 'r', encoding='utf-8') as f:
+    with open(author_path, 'r', encoding='utf-8') as f:
         author_db = json.load(f)
-    with open(WHOLE_PUB_PATH, 'r', encoding='utf-8') as f:
-        whole_pub_db = json.load(f)
+    whole_pub_db = open_pub_db(pub_path)
 
     # 2. 遍历所有作者
     all_auth_ids = list(author_db.keys())
     if TEST_AUTHOR_NUM:
         all_auth_ids = all_auth_ids[:TEST_AUTHOR_NUM]
-    print(f"共发现 {len(all_auth_ids)} 个作者，开始离线计算向量...")
+    print(f"共发现 {len(all_auth_ids)} 个作者，开始离线计算向量 (编码模式: {encode_mode})...")
 
+    # 向量按文本内容哈希去重存放 (所有作者、所有数据集共用)，作者视图只存行号
     current_cache_dir = get_vector_cache_path()
-    for auth_id in tqdm(all_auth_ids):
-        cache_path = os.path.join(current_cache_dir, f"{auth_id}.safetensors")
-        
-        # 如果已经存在则跳过，方便断点续传
-        if os.path.exists(cache_path):
-            continue
+    store = DedupVectorStore(current_cache_dir, get_content_cache_path())
+    manifest_path = os.path.join(current_cache_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    stats = Counter()
+    # 换了编码器后端时内容哈希跟着变，manifest 比对不上，作者视图会指向新后端编出的向量
+    print(f"内容哈希模型标识: {MODEL_ID}")
 
+    # 3. 规划：找出需要重写视图的作者，以及库里还没有的文本
+    updates = []
+    global_pending = {}
+    for auth_id in tqdm(all_auth_ids):
         basic_info = author_db.get(auth_id, {})
         pub_ids = basic_info.get('pubs', [])
-        
-        pub_texts = []
-        for pid in pub_ids:
-            pub_detail = whole_pub_db.get(pid)
-            if not pub_detail: continue
-            # 文本构建逻辑必须与主程序一致！
-            text = build_feature_text(pub_detail)
-            if text:
-                pub_texts.append(text)
-
-        if not pub_texts:
+        if not pub_ids:
             continue
 
-        # 3. 批量推理
+        # 文本构建逻辑必须与主程序一致！缺失的论文按空文本处理，
+        # 保证向量行与 pubs 列表一一对应 (与 build_author_profiles 现场编码的对齐方式相同)
+        pub_texts = [build_feature_text(whole_pub_db.get(pid) or {}) for pid in pub_ids]
+        text_keys = [text_hash(text, model_id=MODEL_ID) for text in pub_texts]
+
+        # 增量判断：论文列表和文本都没变的作者直接跳过
+        entry = manifest.get(auth_id)
+        if auth_id in store:
+            if entry and entry["pubs"] == pub_ids and entry["hashes"] == text_keys:
+                stats["unchanged"] += 1
+                continue
+            if entry is None and store.matches(auth_id, text_keys):
+                # 没有 manifest 时建好的视图，核对一致后补记
+                manifest[auth_id] = {"pubs": pub_ids, "hashes": text_keys}
+                stats["unchanged"] += 1
+                continue
+
+        added, changed, removed = diff_pubs(entry, pub_ids, text_keys)
+        stats["added_pubs"] += added
+        stats["changed_pubs"] += changed
+        stats["removed_pubs"] += removed
+
+        missing = 0
+        for key, text in zip(text_keys, pub_texts):
+            if not store.has_text(key):
+                missing += 1
+                if encode_mode in ("bucketed", "sharded"):
+                    global_pending.setdefault(key, text)
+        stats["reused"] += len(text_keys) - missing
+        updates.append((auth_id, pub_ids, pub_texts, text_keys))
+
+    # 4. 编码 + 写回作者视图 (先提交向量库，再提交 manifest)
+    encode_seconds = 0.0
+    wall_seconds = None
+    if encode_mode == "bucketed":
+        encode_seconds = encode_bucketed(store, global_pending)
+        stats["encoded"] = len(global_pending)
+    elif encode_mode == "sharded":
+        encode_seconds, wall_seconds = encode_sharded(store, global_pending)
+        stats["encoded"] = len(global_pending)
+
+    dirty = 0
+    for auth_id, pub_ids, pub_texts, text_keys in tqdm(updates):
         try:
-            cand_embeddings = MODEL.encode(
-                pub_texts,
-                batch_size=32, # 离线模式可以调大 batch_size 提高吞吐量
-                convert_to_tensor=True,
-                normalize_embeddings=True,
-                show_progress_bar=False
-            ).half()
-
-            # 4. 使用 safetensors 保存
-            save_file({"embeddings": cand_embeddings}, cache_path)
+            if encode_mode == "per_author":
+                # 逐作者编码 (旧流程)：只编码库里没有的文本
+                pending = {}
+                for key, text in zip(text_keys, pub_texts):
+                    if not store.has_text(key):
+                        pending.setdefault(key, text)
+                if pending:
+                    start = time.perf_counter()
+                    cand_embeddings = encode_texts(list(pending.values()), batch_size=32)
+                    encode_seconds += time.perf_counter() - start
+                    for key, vector in zip(pending.keys(), cand_embeddings):
+                        store.add_text(key, vector)
+                    stats["encoded"] += len(pending)
+
+            store.set_author(auth_id, text_keys)
+            manifest[auth_id] = {"pubs": pub_ids, "hashes": text_keys}
+            stats["updated_authors"] += 1
+            dirty += 1
+            if dirty >= FLUSH_EVERY:
+                store.flush()
+                save_manifest(manifest_path, manifest)
+                dirty = 0
             
         except Exception as e:
             print(f"处理作者 {auth_id} 时出错: {e}")
 
+    # 5. 作者库里已经不存在 (或已没有论文) 的作者，从视图和 manifest 中删除
+    if not TEST_AUTHOR_NUM:
+        live_ids = {aid for aid, info in author_db.items() if info.get('pubs')}
+        for auth_id in [aid for aid in store.keys() if aid not in live_ids]:
+            store.remove_author(auth_id)
+            stats["removed_authors"] += 1
+        for auth_id in [aid for aid in manifest if aid not in live_ids]:
+            del manifest[auth_id]
+
+    store.close()
+    save_manifest(manifest_path, manifest)
+    reclaimed = store.compact_views()
+    print(f"完成: 未变化作者 {stats['unchanged']} | 更新作者 {stats['updated_authors']} | 删除作者 {stats['removed_authors']}")
+    print(f"      论文 新增 {stats['added_pubs']} / 文本变化 {stats['changed_pubs']} / 移除 {stats['removed_pubs']}")
+    print(f"      新编码 {stats['encoded']} 条文本，复用已有向量 {stats['reused']} 条，回收视图废弃行 {reclaimed}")
+    if stats["encoded"]:
+        print(f"编码吞吐 [{encode_mode}]: {stats['encoded']} 条 / {encode_seconds:.1f}s = "
+              f"{stats['encoded'] / max(encode_seconds, 1e-6):.1f} texts/sec")
+        if wall_seconds:
+            print(f"多进程墙钟吞吐: {stats['encoded'] / max(wall_seconds, 1e-6):.1f} texts/sec")
+    return stats
+
 if __name__ == "__main__":
     run_preprocessing()
\ No newline at end of file
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+(论文, 作者) 事实表：离线把画像构建时对每篇论文做的解析预先算好——
+作者在作者列表中的位置、规范化后的机构、其余合作者姓名。
+热门论文会在上千个任务里被反复选进 top-k，运行时只需查表和 Counter 累加，
+不再重复 same_name / normalize_org 的正则计算。
+
+目录结构 (whole_author_profiles.facts/)，与 pub_store 的列存格式一致:
+  meta.json
+  ids.npy                    排序后的 "pid<TAB>author_id" 键
+  position.npy               int32，作者在论文作者列表中首次匹配的位置，未匹配为 -1
+  org.bin/.off.npy + org.lst.npy         规范化机构列表 (每个同名条目一个)
+  collab.bin/.off.npy + collab.lst.npy   合作者姓名列表
+"""
+import json
+import os
+import shutil
+import sys
+import numpy as np
+from .feature_extractor import same_name, normalize_org
+from .pub_store import SortedKeys, StrColumn, StrColumnWriter, save_sorted_keys, open_pub_db
+
+FACTS_VERSION = 1
+
+
+def get_facts_dir(author_json_path):
+    """whole_author_profiles.json -> whole_author_profiles.facts"""
+    root, _ = os.path.splitext(author_json_path)
+    return root + ".facts"
+
+
+def _fact_key(pid, auth_id):
+    return f"{pid}\t{auth_id}"
+
+
+def extract_pub_facts(pub_detail, author_name):
+    """与 build_author_profiles 中逐篇解析作者列表的逻辑完全一致"""
+    position = -1
+    orgs = []
+    collabs = []
+    for i, auth_entry in enumerate(pub_detail.get('authors', [])):
+        entry_name = auth_entry.get('name', '')
+        if same_name(entry_name, author_name):
+            if position < 0:
+                position = i
+            if auth_entry.get('org'):
+                norm_org = normalize_org(auth_entry.get('org'))
+                if norm_org: orgs.append(norm_org)
+        else:
+            if entry_name: collabs.append(entry_name)
+    return position, orgs, collabs
+
+
+def build_pub_facts(author_json_path, pub_json_path, facts_dir=None):
+    facts_dir = facts_dir or get_facts_dir(author_json_path)
+    with open(author_json_path, 'r', encoding='utf-8') as f:
+        author_db = json.load(f)
+    whole_pub_db = open_pub_db(pub_json_path)
+
+    keys = sorted({
+        _fact_key(pid, auth_id)
+        for auth_id, info in author_db.items()
+        for pid in info.get('pubs', [])
+        if pid in whole_pub_db
+    })
+    print(f"共 {len(keys)} 个 (论文, 作者) 对，开始构建事实表...")
+
+    tmp_dir = facts_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    org_writer = StrColumnWriter(tmp_dir, "org")
+    collab_writer = StrColumnWriter(tmp_dir, "collab")
+    org_lst, collab_lst = [0], [0]
+    positions = np.empty(len(keys), dtype=np.int32)
+    for row, key in enumerate(keys):
+        pid, auth_id = key.split("\t", 1)
+        position, orgs, collabs = extract_pub_facts(whole_pub_db.get(pid), author_db[auth_id].get('name', ''))
+        positions[row] = position
+        for org in orgs:
+            org_writer.append(org)
+        org_lst.append(org_lst[-1] + len(orgs))
+        for name in collabs:
+            collab_writer.append(name)
+        collab_lst.append(collab_lst[-1] + len(collabs))
+
+    org_writer.close()
+    collab_writer.close()
+    save_sorted_keys(os.path.join(tmp_dir, "ids.npy"), keys)
+    np.save(os.path.join(tmp_dir, "position.npy"), positions)
+    np.save(os.path.join(tmp_dir, "org.lst.npy"), np.asarray(org_lst, dtype=np.int64))
+    np.save(os.path.join(tmp_dir, "collab.lst.npy"), np.asarray(collab_lst, dtype=np.int64))
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"version": FACTS_VERSION, "count": len(keys), "authors": len(author_db)}, f)
+
+    if os.path.exists(facts_dir):
+        shutil.rmtree(facts_dir)
+    os.replace(tmp_dir, facts_dir)
+    print(f"事实表构建完成: {facts_dir}")
+    return facts_dir
+
+
+class PubFacts:
+    """只读事实表，get(pid, auth_id) -> {"position", "orgs", "collabs"} 或 None"""
+
+    def __init__(self, facts_dir):
+        with open(os.path.join(facts_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FACTS_VERSION:
+            raise ValueError(f"事实表版本不匹配: {facts_dir}，请重新构建")
+        self.keys = SortedKeys(os.path.join(facts_dir, "ids.npy"))
+        self.positions = np.load(os.path.join(facts_dir, "position.npy"), mmap_mode="r")
+        self.orgs = StrColumn(facts_dir, "org")
+        self.collabs = StrColumn(facts_dir, "collab")
+        self.org_lst = np.load(os.path.join(facts_dir, "org.lst.npy"), mmap_mode="r")
+        self.collab_lst = np.load(os.path.join(facts_dir, "collab.lst.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, pid, auth_id):
+        row = self.keys.row(_fact_key(pid, auth_id))
+        if row < 0:
+            return None
+        return {
+            "position": int(self.positions[row]),
+            "orgs": self.orgs.slice(int(self.org_lst[row]), int(self.org_lst[row + 1])),
+            "collabs": self.collabs.slice(int(self.collab_lst[row]), int(self.collab_lst[row + 1])),
+        }
+
+
+def open_pub_facts(author_json_path):
+    """事实表存在时打开，否则返回 None (画像构建会回退到逐篇解析)"""
+    facts_dir = get_facts_dir(author_json_path)
+    if os.path.exists(os.path.join(facts_dir, "meta.json")):
+        print(f"使用论文事实表: {facts_dir}")
+        return PubFacts(facts_dir)
+    print(f"未找到论文事实表 {facts_dir}，画像构建将逐篇解析 (可运行 python -m src.pub_facts 预先构建)")
+    return None
+
+
+if __name__ == "__main__":
+    # 用法 (在 RND 目录下): python -m src.pub_facts [author_json pub_json]
+    if len(sys.argv) > 2:
+        build_pub_facts(sys.argv[1], sys.argv[2])
+    else:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for data_dir in [
+            os.path.join(project_root, "dataset", "valid"),
+            os.path.join(project_root, "dataset", "sa_lzk_data", "profiles"),
+        ]:
+            author_path = os.path.join(data_dir, "whole_author_profiles.json")
+            pub_path = os.path.join(data_dir, "whole_author_profiles_pub.json")
+            if os.path.exists(author_path) and os.path.exists(pub_path):
+                build_pub_facts(author_path, pub_path)
+            else:
+                print(f"跳过不存在的数据目录: {data_dir}")
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+论文库列式存储：把 whole_author_profiles_pub.json 一次性转换成只读的内存映射列存，
+对外保持和 dict 一致的 .get(pid) 接口，启动时不再整体 json.load。
+
+目录结构 (xxx_pub.store/):
+  meta.json            版本与行数
+  ids.npy              排序后的论文 ID (定长 bytes)，二分查找定位行号
+  year.npy             int32，缺失为 -1
+  <col>.bin/.off.npy   字符串列：utf-8 拼接字节 + 行偏移 (title, venue, abstract)
+  <col>.lst.npy        列表列的行偏移，元素本身是一个字符串列 (keywords, author_name, author_org)
+"""
+import json
+import os
+import shutil
+import sys
+import numpy as np
+
+STORE_VERSION = 1
+STR_COLUMNS = ["title", "venue", "abstract"]
+YEAR_MISSING = -1
+
+
+def get_store_dir(json_path):
+    """whole_author_profiles_pub.json -> whole_author_profiles_pub.store"""
+    root, _ = os.path.splitext(json_path)
+    return root + ".store"
+
+
+class StrColumnWriter:
+    def __init__(self, store_dir, name):
+        self.name = name
+        self.store_dir = store_dir
+        self.fh = open(os.path.join(store_dir, f"{name}.bin"), "wb")
+        self.offsets = [0]
+
+    def append(self, text):
+        data = (text or "").encode("utf-8")
+        self.fh.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.fh.close()
+        np.save(os.path.join(self.store_dir, f"{self.name}.off.npy"), np.asarray(self.offsets, dtype=np.int64))
+
+
+class SortedKeys:
+    """排序后的定长 bytes 键数组 (内存映射)，二分查找得到行号"""
+
+    def __init__(self, path):
+        self.ids = np.load(path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, key):
+        if not key:
+            return -1
+        key = str(key).encode("utf-8")
+        if len(key) > self.ids.dtype.itemsize:
+            return -1
+        row = int(np.searchsorted(self.ids, key))
+        if row < len(self.ids) and self.ids[row] == key:
+            return row
+        return -1
+
+    def __iter__(self):
+        return (k.decode("utf-8") for k in self.ids)
+
+
+def save_sorted_keys(path, keys):
+    """keys 必须已经排好序"""
+    np.save(path, np.array([k.encode("utf-8") for k in keys], dtype=bytes))
+
+
+class StrColumn:
+    def __init__(self, store_dir, name):
+        self.offsets = np.load(os.path.join(store_dir, f"{name}.off.npy"), mmap_mode="r")
+        bin_path = os.path.join(store_dir, f"{name}.bin")
+        # 空文件无法 memmap
+        if os.path.getsize(bin_path) > 0:
+            self.data = np.memmap(bin_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def slice(self, start, end):
+        return [self[i] for i in range(start, end)]
+
+
+def _to_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return YEAR_MISSING
+
+
+def convert_pub_json(json_path, store_dir=None):
+    """一次性转换：读取原始 json，写出列存目录 (先写临时目录再整体替换)"""
+    store_dir = store_dir or get_store_dir(json_path)
+    print(f"正在读取原始论文库: {json_path}")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        pub_db = json.load(f)
+
+    tmp_dir = store_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    pids = sorted(pub_db.keys())
+    str_writers = {name: StrColumnWriter(tmp_dir, name) for name in STR_COLUMNS}
+    kw_writer = StrColumnWriter(tmp_dir, "keywords")
+    name_writer = StrColumnWriter(tmp_dir, "author_name")
+    org_writer = StrColumnWriter(tmp_dir, "author_org")
+    kw_lst, author_lst = [0], [0]
+    years = np.empty(len(pids), dtype=np.int32)
+
+    for row, pid in enumerate(pids):
+        pub = pub_db[pid] or {}
+        for name, writer in str_writers.items():
+            writer.append(pub.get(name) or "")
+        years[row] = _to_year(pub.get('year'))
+
+        kws = pub.get('keywords') or []
+        if not isinstance(kws, list):
+            kws = [str(kws)]
+        for kw in kws:
+            kw_writer.append(kw)
+        kw_lst.append(kw_lst[-1] + len(kws))
+
+        authors = pub.get('authors') or []
+        for auth in authors:
+            name_writer.append(auth.get('name') or "")
+            org_writer.append(auth.get('org') or "")
+        author_lst.append(author_lst[-1] + len(authors))
+
+    for writer in list(str_writers.values()) + [kw_writer, name_writer, org_writer]:
+        writer.close()
+    save_sorted_keys(os.path.join(tmp_dir, "ids.npy"), pids)
+    np.save(os.path.join(tmp_dir, "year.npy"), years)
+    np.save(os.path.join(tmp_dir, "keywords.lst.npy"), np.asarray(kw_lst, dtype=np.int64))
+    np.save(os.path.join(tmp_dir, "authors.lst.npy"), np.asarray(author_lst, dtype=np.int64))
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"version": STORE_VERSION, "count": len(pids), "source": os.path.basename(json_path)}, f)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    print(f"转换完成: {len(pids)} 篇论文 -> {store_dir}")
+    return store_dir
+
+
+class PubStore:
+    """只读列存论文库，接口与 dict 一致：get / in / len / keys"""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"列存版本不匹配: {store_dir}，请重新运行转换")
+        self.store_dir = store_dir
+        self.ids = SortedKeys(os.path.join(store_dir, "ids.npy"))
+        self.years = np.load(os.path.join(store_dir, "year.npy"), mmap_mode="r")
+        self.cols = {name: StrColumn(store_dir, name) for name in STR_COLUMNS}
+        self.keywords = StrColumn(store_dir, "keywords")
+        self.author_names = StrColumn(store_dir, "author_name")
+        self.author_orgs = StrColumn(store_dir, "author_org")
+        self.kw_lst = np.load(os.path.join(store_dir, "keywords.lst.npy"), mmap_mode="r")
+        self.author_lst = np.load(os.path.join(store_dir, "authors.lst.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _row(self, pid):
+        return self.ids.row(pid)
+
+    def __contains__(self, pid):
+        return self._row(pid) >= 0
+
+    def keys(self):
+        return iter(self.ids)
+
+    def __iter__(self):
+        return self.keys()
+
+    def get(self, pid, default=None):
+        row = self._row(pid)
+        if row < 0:
+            return default
+        pub = {"id": pid}
+        for name, col in self.cols.items():
+            pub[name] = col[row]
+        year = int(self.years[row])
+        if year != YEAR_MISSING:
+            pub["year"] = year
+        pub["keywords"] = self.keywords.slice(int(self.kw_lst[row]), int(self.kw_lst[row + 1]))
+        a_start, a_end = int(self.author_lst[row]), int(self.author_lst[row + 1])
+        pub["authors"] = [
+            {"name": self.author_names[i], "org": self.author_orgs[i]}
+            for i in range(a_start, a_end)
+        ]
+        return pub
+
+    def __getitem__(self, pid):
+        pub = self.get(pid)
+        if pub is None:
+            raise KeyError(pid)
+        return pub
+
+
+def open_pub_db(json_path):
+    """优先打开列存 (已转换过)，否则回退到整体 json.load"""
+    store_dir = get_store_dir(json_path)
+    if os.path.exists(os.path.join(store_dir, "meta.json")):
+        print(f"使用内存映射论文库: {store_dir}")
+        return PubStore(store_dir)
+    print(f"未找到列存 {store_dir}，回退为 json.load (可运行 src/pub_store.py 一次性转换)")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        convert_pub_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for path in [
+            os.path.join(project_root, "dataset", "valid", "whole_author_profiles_pub.json"),
+            os.path.join(project_root, "dataset", "sa_lzk_data", "profiles", "whole_author_profiles_pub.json"),
+        ]:
+            if os.path.exists(path):
+                convert_pub_json(path)
+            else:
+                print(f"跳过不存在的文件: {path}")
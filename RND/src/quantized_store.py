@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+向量库的量化副本，用于 build_author_profiles 的第一轮粗排：
+  int8   每行对称量化 (codes = round(x / scale), scale = max|x| / 127)，体积约为 float16 的 1/2
+  binary 每维只留符号位 (packbits)，1024 维压成 128 字节，体积约为 float16 的 1/16，粗排分数 = -汉明距离
+粗排后每个候选人只保留少量短名单，再读原始 float16 行精确重排。
+
+量化文件与被量化的打包库 (内容去重库的 content 或按作者打包的 vectors) 放在同一目录，行号一一对应:
+  {name}.int8.npy / {name}.int8scale.npy / {name}.binary.npy
+打包库只追加写入，量化之后新增的行在粗排时一律进入短名单，由精确重排处理。
+
+构建量化副本并输出体积与 top-k 重合度报告: python -m src.quantized_store [int8|binary ...]
+"""
+import os
+import sys
+import numpy as np
+
+QUANT_MODES = ("int8", "binary")
+BUILD_CHUNK_ROWS = 65536
+# 每个字节里 1 的个数，用来算汉明距离
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _paths(store, mode):
+    base = os.path.join(store.store_dir, store.name)
+    if mode == "int8":
+        return [f"{base}.int8.npy", f"{base}.int8scale.npy"]
+    return [f"{base}.binary.npy"]
+
+
+def quantize_int8(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scale = np.abs(matrix).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scale[:, None]), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def quantize_binary(matrix):
+    return np.packbits(np.asarray(matrix) > 0, axis=1)
+
+
+def build_quantized(store, mode):
+    """按块量化 store.matrix 的全部行，写临时文件后原子替换"""
+    if mode not in QUANT_MODES:
+        raise ValueError(f"未知的量化方式: {mode}，可选 {QUANT_MODES}")
+    matrix = store.matrix
+    rows, dim = matrix.shape
+    paths = _paths(store, mode)
+    tmp_paths = [p[:-len(".npy")] + ".tmp.npy" for p in paths]
+    if mode == "int8":
+        codes = np.lib.format.open_memmap(tmp_paths[0], mode="w+", dtype=np.int8, shape=(rows, dim))
+        scales = np.lib.format.open_memmap(tmp_paths[1], mode="w+", dtype=np.float32, shape=(rows,))
+        for i in range(0, rows, BUILD_CHUNK_ROWS):
+            codes[i:i + BUILD_CHUNK_ROWS], scales[i:i + BUILD_CHUNK_ROWS] = quantize_int8(matrix[i:i + BUILD_CHUNK_ROWS])
+        outputs = [codes, scales]
+    else:
+        codes = np.lib.format.open_memmap(tmp_paths[0], mode="w+", dtype=np.uint8, shape=(rows, (dim + 7) // 8))
+        for i in range(0, rows, BUILD_CHUNK_ROWS):
+            codes[i:i + BUILD_CHUNK_ROWS] = quantize_binary(matrix[i:i + BUILD_CHUNK_ROWS])
+        scales = None
+        outputs = [codes]
+    for out in outputs:
+        out.flush()
+    outputs = codes = scales = None # 先释放内存映射再改名
+    for tmp_path, path in zip(tmp_paths, paths):
+        os.replace(tmp_path, path)
+    return QuantizedVectors(store, mode)
+
+
+class QuantizedVectors:
+    """store 的量化副本 (只读，内存映射)；行号与 store.matrix 相同"""
+
+    def __init__(self, store, mode):
+        self.store = store
+        self.mode = mode
+        paths = _paths(store, mode)
+        self.codes = np.load(paths[0], mmap_mode="r")
+        self.scales = np.load(paths[1], mmap_mode="r") if mode == "int8" else None
+        self.rows = self.codes.shape[0]
+
+    @staticmethod
+    def exists(store, mode):
+        return all(os.path.exists(p) for p in _paths(store, mode))
+
+    @classmethod
+    def open(cls, store, mode):
+        """不存在或已与打包库对不上 (被 compact 过) 时返回 None"""
+        if store is None or not cls.exists(store, mode):
+            return None
+        quantized = cls(store, mode)
+        if quantized.rows > store.rows:
+            print(f"量化副本行数 {quantized.rows} 超过向量库 {store.rows}，已忽略 (请重新构建)")
+            return None
+        return quantized
+
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approx_scores(self, row_ids, query):
+        """粗排分数，只用于排序；query 为 float32 的一维向量"""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        scores = np.full(len(row_ids), np.inf, dtype=np.float32)
+        known = row_ids < self.rows
+        rows = row_ids[known]
+        if self.mode == "int8":
+            scores[known] = (self.codes[rows].astype(np.float32) @ query) * self.scales[rows]
+        else:
+            query_bits = np.packbits(query > 0)
+            scores[known] = -_POPCOUNT[self.codes[rows] ^ query_bits].sum(axis=1, dtype=np.float32)
+        return scores
+
+    def shortlist(self, row_id_lists, query, size):
+        """每组行号各自按粗排分数取前 size 个，返回组内下标 (顺序不保证)"""
+        counts = [len(r) for r in row_id_lists]
+        if not counts:
+            return []
+        scores = self.approx_scores(np.concatenate(row_id_lists), query)
+        result = []
+        offset = 0
+        for count in counts:
+            segment = scores[offset:offset + count]
+            if count <= size:
+                result.append(np.arange(count))
+            else:
+                result.append(np.argpartition(-segment, size - 1)[:size])
+            offset += count
+        return result
+
+
+def report(store, views, modes, k=6, rescore_factor=4, sample_authors=2000, sample_queries=20, seed=0):
+    """
+    体积对比 + top-k 重合度：随机取若干作者和查询向量，
+    比较 float16 精确 top-k 与 (量化直接 top-k) / (量化短名单 + 精确重排 top-k) 的重合比例。
+    """
+    rng = np.random.default_rng(seed)
+    matrix = store.matrix
+    float_bytes = matrix.shape[0] * matrix.shape[1] * matrix.dtype.itemsize
+    print(f"float16 原始矩阵: {matrix.shape[0]} 行 x {matrix.shape[1]} 维 = {float_bytes / 1024 ** 2:.1f} MB")
+
+    keys = list(views.keys())
+    if not keys or not matrix.shape[0]:
+        print("向量库为空，跳过重合度评估")
+        return
+    authors = [keys[i] for i in rng.choice(len(keys), size=min(sample_authors, len(keys)), replace=False)]
+    row_id_lists = [views.row_ids(a) for a in authors]
+    row_id_lists = [r for r in row_id_lists if len(r) > k]
+    query_rows = rng.choice(matrix.shape[0], size=min(sample_queries, matrix.shape[0]), replace=False)
+    print(f"评估样本: {len(row_id_lists)} 个论文数 > {k} 的作者 x {len(query_rows)} 个查询向量")
+
+    for mode in modes:
+        quantized = QuantizedVectors.open(store, mode)
+        if quantized is None:
+            quantized = build_quantized(store, mode)
+        raw_overlap = rescored_overlap = total = 0
+        for q in query_rows:
+            query = np.asarray(matrix[q], dtype=np.float32)
+            shortlists = quantized.shortlist(row_id_lists, query, k * rescore_factor)
+            for rows, short in zip(row_id_lists, shortlists):
+                exact = np.asarray(matrix[rows], dtype=np.float32) @ query
+                truth = set(np.argsort(-exact)[:k].tolist())
+                approx = quantized.approx_scores(rows, query)
+                raw_overlap += len(truth & set(np.argsort(-approx)[:k].tolist()))
+                rescored = short[np.argsort(-exact[short])[:k]]
+                rescored_overlap += len(truth & set(rescored.tolist()))
+                total += k
+        ratio = quantized.nbytes() / float_bytes
+        print(f"  [{mode}] {quantized.nbytes() / 1024 ** 2:.1f} MB (为 float16 的 {ratio:.1%}，节省 {1 - ratio:.1%}) | "
+              f"top-{k} 重合: 直接量化 {raw_overlap / max(total, 1):.2%} / 短名单 {k * rescore_factor} 条精确重排 {rescored_overlap / max(total, 1):.2%}")
+
+
+if __name__ == "__main__":
+    from .util import get_vector_cache_path, get_content_cache_path
+    from .vector_store import DedupVectorStore, PackedVectorStore
+
+    modes = [m for m in sys.argv[1:] if m in QUANT_MODES] or list(QUANT_MODES)
+    cache_dir = get_vector_cache_path()
+    if DedupVectorStore.exists(cache_dir):
+        views = DedupVectorStore(cache_dir, get_content_cache_path())
+        base = views.content
+    else:
+        views = base = PackedVectorStore(cache_dir)
+    for mode in modes:
+        print(f"构建 {mode} 量化副本: {base.store_dir}")
+        build_quantized(base, mode)
+    report(base, views, modes)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+结果写出器：由调度器的写入协程独占使用 (见 src/scheduler.py)。
+  - 分析日志 (JSONL) 用一个带缓冲的句柄追加，每 FSYNC_EVERY 条或 FSYNC_INTERVAL 秒 flush + fsync 一次
+  - result.json 的 {作者: [任务ID, ...]} 在内存里维护，成员判断用集合
+  - result.json 只在检查点 (每 CHECKPOINT_EVERY 条) 和关闭时整体重写 (临时文件 + 原子替换)
+分析日志是断点恢复的依据，进程被杀最多丢掉最后一次 fsync 之后的几条，重跑时这些任务会重新处理。
+结果稀疏时 (批尾的慢任务) 调度器在结果队列空闲时调用 maybe_sync，已写入的记录最迟约
+FSYNC_INTERVAL + 调度器空闲检查间隔 (默认 1 秒) 后落盘，不用等到下一条结果到达。
+给了 resume_index (src/resume_index.py) 时，每次 fsync 后把已落盘的记录和日志偏移一起提交到断点索引。
+"""
+import json
+import os
+import time
+
+FSYNC_EVERY = 50
+FSYNC_INTERVAL = 5.0
+CHECKPOINT_EVERY = 500
+LOG_BUFFER_BYTES = 1 << 20
+
+
+class ResultWriter:
+    def __init__(self, log_path, save_path, results=None, resume_index=None, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL, checkpoint_every=CHECKPOINT_EVERY):
+        self.log_path = log_path
+        self.save_path = save_path
+        self.resume_index = resume_index
+        self.results = results if results is not None else {}
+        self._members = {key: set(tids) for key, tids in self.results.items()}
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.checkpoint_every = checkpoint_every
+        self.written = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        # 二进制追加，tell() 即日志的字节长度，供断点索引记录偏移
+        self._log = open(log_path, "ab", buffering=LOG_BUFFER_BYTES)
+        self._log.seek(0, os.SEEK_END)
+
+    def add_result(self, key, tid):
+        """登记到 result.json 的内存副本，同一任务不会重复登记"""
+        members = self._members.setdefault(key, set())
+        if tid not in members:
+            members.add(tid)
+            self.results.setdefault(key, []).append(tid)
+
+    def write(self, analysis_entry, key, tid):
+        self._log.write((json.dumps(analysis_entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.add_result(key, tid)
+        if self.resume_index is not None:
+            self.resume_index.add(tid, analysis_entry.get("result"), key)
+        self.written += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+        else:
+            self.maybe_sync()
+        if self.written % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def maybe_sync(self):
+        """有未落盘的记录且距上次 fsync 已超过 fsync_interval 时落盘"""
+        if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        if self.resume_index is not None:
+            self.resume_index.commit(self._log.tell())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def checkpoint(self):
+        """先把日志落盘，再原子替换 result.json"""
+        self.sync()
+        os.makedirs(os.path.dirname(os.path.abspath(self.save_path)), exist_ok=True)
+        tmp_path = self.save_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.results, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.save_path)
+
+    def close(self):
+        if self._log.closed:
+            return
+        self.checkpoint()
+        self._log.close()
+        if self.resume_index is not None:
+            self.resume_index.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+断点索引：把 已处理任务 -> 结果 记在一个小 SQLite 文件里，与分析日志 (JSONL) 保持同步。
+启动时直接读索引，不再逐行解析整个日志 (reasoning 字段很长，日志只增不减)。
+
+索引同时记录它已覆盖到的日志字节偏移 log_offset：
+  - 日志比偏移长 (上次 fsync 之后、提交索引之前被杀)：只回放多出来的尾部几行
+  - 日志比偏移短 (日志被删或被替换)：清空索引，从头回放整个日志
+  - 没有索引文件 (旧的输出目录)：从头回放一次，之后就只读索引
+日志最后一行不完整 (写到一半被杀) 时截掉，避免和下一条写入粘在一起。
+"""
+import json
+import os
+import sqlite3
+
+
+def result_key(result):
+    """result.json 里的分组键：NIL 记在 new_author 下"""
+    return result if result and result != "NIL" else "new_author"
+
+
+class ResumeIndex:
+    def __init__(self, db_path, log_path):
+        self.db_path = db_path
+        self.log_path = log_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, result TEXT, result_key TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.commit()
+        self._sync_with_log()
+
+    def _log_offset(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'log_offset'").fetchone()
+        return row[0] if row else 0
+
+    def _sync_with_log(self):
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        offset = self._log_offset()
+        if size < offset:
+            print(f"分析日志比断点索引记录的短，按日志重建断点索引: {self.log_path}")
+            self.conn.execute("DELETE FROM tasks")
+            offset = 0
+        if size == offset:
+            self.commit(offset)
+            return
+
+        replayed = 0
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        complete = tail.rfind(b"\n") + 1
+        for line in tail[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            tid = entry.get("task_id")
+            if tid:
+                result = entry.get("result", "NIL")
+                self.add(tid, result, result_key(result))
+                replayed += 1
+        if complete < len(tail):
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(offset + complete)
+        self.commit(offset + complete)
+        print(f"断点索引: 从日志回放 {replayed} 条记录")
+
+    def add(self, task_id, result, key):
+        self.conn.execute("INSERT OR REPLACE INTO tasks (task_id, result, result_key) VALUES (?, ?, ?)",
+                          (task_id, result, key))
+
+    def commit(self, log_offset):
+        """log_offset 必须是已经 fsync 的日志长度"""
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('log_offset', ?)", (log_offset,))
+        self.conn.commit()
+
+    def processed(self):
+        return {row[0] for row in self.conn.execute("SELECT task_id FROM tasks")}
+
+    def results(self):
+        """{result.json 分组键: [任务ID, ...]}，按写入顺序"""
+        results = {}
+        for task_id, key in self.conn.execute("SELECT task_id, result_key FROM tasks ORDER BY rowid"):
+            results.setdefault(key, []).append(task_id)
+        return results
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+连续调度：固定数量的 worker 协程从任务队列里取任务，做完一个立刻取下一个，
+结果放进结果队列由唯一的写入协程按完成顺序处理。
+与"切成固定批次再 gather"相比，慢任务 (两阶段 LLM) 只占住自己的 worker，不会拖住整批，
+批尾也不会出现并发降到零的空档。
+"""
+import asyncio
+import traceback
+
+_DONE = object()
+IDLE_INTERVAL = 1.0
+
+
+async def run_worker_pool(items, process, handle_result, num_workers=10, result_queue_size=0,
+                          on_idle=None, idle_interval=IDLE_INTERVAL):
+    """
+    items:          待处理任务 (已去掉断点记录里完成的)
+    process:        async process(idx, item) -> result，idx 为任务在 items 里的下标
+    handle_result:  async/同步 handle_result(result)，只在写入协程里串行调用，无需再加锁
+    on_idle:        同步 on_idle()，结果队列空闲 idle_interval 秒时在写入协程里调用 (例如 ResultWriter.maybe_sync)
+    抛异常的任务不会产生结果，下次运行时按断点逻辑重跑；handle_result 对某条结果抛异常时记录后跳过，
+    写入协程继续处理后面的结果。返回成功处理的结果数。
+    """
+    task_queue = asyncio.Queue()
+    for idx, item in enumerate(items):
+        task_queue.put_nowait((idx, item))
+    result_queue = asyncio.Queue(maxsize=result_queue_size)
+
+    async def worker():
+        while True:
+            try:
+                idx, item = task_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                result = await process(idx, item)
+            except Exception:
+                print(f" 任务 {item} 执行异常，已跳过 (下次运行重试):\n{traceback.format_exc()}")
+                continue
+            await result_queue.put(result)
+
+    async def writer():
+        handled = failed = 0
+        while True:
+            if on_idle is None:
+                result = await result_queue.get()
+            else:
+                try:
+                    result = await asyncio.wait_for(result_queue.get(), timeout=idle_interval)
+                except asyncio.TimeoutError:
+                    on_idle()
+                    continue
+            if result is _DONE:
+                if failed:
+                    print(f" 共 {failed} 条结果写入失败，已跳过 (下次运行重试)")
+                return handled
+            try:
+                outcome = handle_result(result)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            except Exception:
+                failed += 1
+                print(f" 结果写入异常，已跳过 (下次运行重试):\n{traceback.format_exc()}")
+                continue
+            handled += 1
+
+    writer_task = asyncio.create_task(writer())
+    workers = asyncio.gather(*(worker() for _ in range(max(1, min(num_workers, len(items))))))
+    try:
+        await asyncio.wait({workers, writer_task}, return_when=asyncio.FIRST_COMPLETED)
+        if writer_task.done():
+            # 写入协程意外退出：停掉 worker，不再继续消耗 LLM 请求，异常立即抛给调用方
+            workers.cancel()
+            await asyncio.gather(workers, return_exceptions=True)
+            return writer_task.result()
+        await workers
+    except BaseException:
+        workers.cancel()
+        writer_task.cancel()
+        raise
+    await result_queue.put(_DONE)
+    return await writer_task
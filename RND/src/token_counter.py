@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Token 统计：analysis_log 里用于对比的字段 (单层 / 两层输入、输出) 一律用本地计数，来源二选一
+  1. 本地快速分词器：DEEPSEEK_TOKENIZER_DIR 指向 DeepSeek V3 分词器目录时，由后台线程加载，
+     并发任务提交的文本在后台线程里凑批一次编码 (与 src/encoder_service.py 相同的微批方式)，结果进 LRU 缓存
+  2. 字符估算：默认按 DeepSeek API 文档 (Token 用量计算) 的经验换算 1 英文字符 ≈ 0.3 token、1 中文字符 ≈ 0.6 token，
+     这两个数并非针对本项目文本测得；分词器可用时，后台线程用最先分词的 CALIBRATION_TEXTS 段文本重新拟合，
+     之后 estimate_tokens (例如 src/candidate_budget.py 的预算截断) 改用拟合值
+API 返回的 usage (dspy 开启 track_usage 后 prediction.get_lm_usage()) 含提示词模板和 dspy 的格式说明，
+与本地计数不可比，按任务单独记在 stats.api_usage 下；命中 LLM 响应缓存的请求没有 usage。
+协程里 await TOKEN_COUNTER.count(...)：缓存命中和字符估算直接返回，分词只在后台线程做，不占事件循环。
+原来各 LLM 模块 import 时从 D:\\download\\... 加载分词器，Linux 上加载失败后计数一律为 0。
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+TOKENIZER_DIR = os.environ.get("DEEPSEEK_TOKENIZER_DIR")
+# 字符估算的默认换算率 (token / 字符)，出处见模块说明
+ASCII_TOKENS_PER_CHAR = 0.3
+CJK_TOKENS_PER_CHAR = 0.6
+CALIBRATION_TEXTS = 500 # 分词器数过这么多段文本后拟合一次换算率
+TOKEN_CACHE_SIZE = 20000
+
+# 当前生效的 [英文, 中文] 换算率，calibrate 之后为拟合值
+_RATIOS = [ASCII_TOKENS_PER_CHAR, CJK_TOKENS_PER_CHAR]
+
+
+def char_counts(text):
+    """(ASCII 字符数, 非 ASCII 字符数)；非 ASCII 字符按 UTF-8 多出的字节数折算 (中文 3 字节)，全程是 C 层操作"""
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return len(text) - non_ascii, non_ascii
+
+
+def estimate_tokens(text):
+    """字符估算，按当前换算率 (默认值或分词器拟合值) 折算"""
+    if not text:
+        return 0
+    ascii_chars, non_ascii = char_counts(str(text))
+    return int(round(ascii_chars * _RATIOS[0] + non_ascii * _RATIOS[1]))
+
+
+def calibrate(samples):
+    """
+    samples 为 [(英文字符数, 中文字符数, 分词器 token 数)]，过原点最小二乘拟合两个换算率并替换当前值；
+    样本里只出现一类字符时只拟合那一类，拟合出非正数时保持原值。返回生效的 (英文, 中文) 换算率
+    """
+    data = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+    cols = [j for j in (0, 1) if data[:, j].any()]
+    if cols:
+        fitted = np.linalg.lstsq(data[:, cols], data[:, 2], rcond=None)[0]
+        if (fitted > 0).all():
+            for j, ratio in zip(cols, fitted):
+                _RATIOS[j] = float(ratio)
+    return tuple(_RATIOS)
+
+
+def usage_tokens(prediction):
+    """API 返回的 (prompt_tokens, completion_tokens)，没有 usage 时为 None"""
+    get_usage = getattr(prediction, "get_lm_usage", None)
+    usage = get_usage() if callable(get_usage) else None
+    if not usage:
+        return None
+    prompt = sum((u or {}).get("prompt_tokens") or 0 for u in usage.values())
+    completion = sum((u or {}).get("completion_tokens") or 0 for u in usage.values())
+    return (prompt, completion) if prompt or completion else None
+
+
+def enable_usage_tracking():
+    """让 dspy 在 prediction 上记录 API usage，入口脚本在 init_dspy() 之后调用一次"""
+    try:
+        import dspy
+        dspy.settings.configure(track_usage=True)
+    except Exception as e:
+        print(f"当前 dspy 不支持 track_usage，token 统计改用本地计数: {e}")
+
+
+class TokenCounter:
+    def __init__(self, tokenizer_dir=TOKENIZER_DIR, max_batch=256, max_wait_ms=5, cache_size=TOKEN_CACHE_SIZE):
+        self.tokenizer_dir = tokenizer_dir
+        self.tokenizer = None
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._samples = []  # 校准用的 (英文字符数, 中文字符数, token 数)
+        self.calibrated = None
+        self.stats = {"api": 0, "tokenizer": 0, "estimate": 0, "cache_hits": 0, "batches": 0}
+        self.api_usage = {}  # task_id -> API usage，由入口脚本写日志时取走
+
+    def start(self):
+        """启动后台线程并开始加载分词器；没有配置分词器目录时什么也不做"""
+        if not self.tokenizer_dir:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-counter", daemon=True)
+                self._thread.start()
+
+    def _load_tokenizer(self):
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_dir, trust_remote_code=True, use_fast=True)
+            tokenizer.model_max_length = 10 ** 7
+            print(f"Token 计数分词器已加载: {self.tokenizer_dir}")
+            return tokenizer
+        except Exception as e:
+            print(f"Token 计数分词器加载失败，改用字符估算: {e}")
+            return False
+
+    def _cache_get(self, text):
+        key = hash(text)
+        with self._cache_lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+        return n
+
+    def _cache_put(self, text, n):
+        with self._cache_lock:
+            self._cache[hash(text)] = n
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def submit(self, texts):
+        """Future 的结果为每段文本的 token 数"""
+        future = Future()
+        self.start()
+        self._queue.put((texts, future))
+        return future
+
+    def _lookup(self, texts):
+        """先查缓存；返回 (文本, 已知计数, 需要分词的文本下标)"""
+        texts = [str(t) if t else "" for t in texts]
+        counts, missing = [0] * len(texts), []
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            if not self.tokenizer_dir or self.tokenizer is False:
+                counts[i] = estimate_tokens(text)
+                self.stats["estimate"] += 1
+                continue
+            n = self._cache_get(text)
+            if n is None:
+                missing.append(i)
+            else:
+                counts[i] = n
+                self.stats["cache_hits"] += 1
+        return texts, counts, missing
+
+    async def count(self, *texts):
+        """几段文本的 token 数之和"""
+        texts, counts, missing = self._lookup(texts)
+        if missing:
+            encoded = await asyncio.wrap_future(self.submit([texts[i] for i in missing]))
+            for i, n in zip(missing, encoded):
+                counts[i] = n
+        return sum(counts)
+
+    def count_blocking(self, *texts):
+        """同步版本，只在工作线程里用 (例如 asyncify 包装的 forward)"""
+        texts, counts, missing = self._lookup(texts)
+        if missing:
+            for i, n in zip(missing, self.submit([texts[i] for i in missing]).result()):
+                counts[i] = n
+        return sum(counts)
+
+    def usage(self, prediction):
+        """API usage (并计入统计)，没有时为 None"""
+        usage = usage_tokens(prediction)
+        if usage is not None:
+            self.stats["api"] += 1
+        return usage
+
+    def record_usage(self, task_id, prediction, complete=True):
+        """
+        记下一个任务的 API usage；complete=False 表示有阶段命中了 LLM 响应缓存，
+        usage 只包含实际发出的那部分请求
+        """
+        usage = self.usage(prediction)
+        if usage is not None:
+            self.api_usage[task_id] = {"prompt_tokens": usage[0], "completion_tokens": usage[1], "complete": complete}
+        return usage
+
+    def pop_usage(self, task_id):
+        return self.api_usage.pop(task_id, None)
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self):
+        self.tokenizer = self._load_tokenizer()
+        while True:
+            pending = self._collect()
+            batch = [text for texts, _ in pending for text in texts]
+            try:
+                if self.tokenizer:
+                    ids = self.tokenizer(batch, add_special_tokens=False, return_attention_mask=False)["input_ids"]
+                    counts = [len(x) for x in ids]
+                    self.stats["tokenizer"] += len(batch)
+                    self._collect_samples(batch, counts)
+                else:
+                    counts = [estimate_tokens(text) for text in batch]
+                    self.stats["estimate"] += len(batch)
+                self.stats["batches"] += 1
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for texts, future in pending:
+                part = counts[start:start + len(texts)]
+                start += len(texts)
+                if self.tokenizer:
+                    for text, n in zip(texts, part):
+                        self._cache_put(text, n)
+                future.set_result(part)
+
+    def _collect_samples(self, batch, counts):
+        if self.calibrated is not None:
+            return
+        self._samples.extend(char_counts(text) + (n,) for text, n in zip(batch, counts))
+        if len(self._samples) >= CALIBRATION_TEXTS:
+            self.calibrated = calibrate(self._samples)
+            self._samples = []
+            print(f"字符估算换算率已按分词器校准: 英文 {self.calibrated[0]:.3f} / 中文 {self.calibrated[1]:.3f} token/字符")
+
+    def summary(self):
+        s = self.stats
+        source = self.tokenizer_dir if self.tokenizer else "字符估算"
+        ratios = "已校准" if self.calibrated else "默认"
+        return (f"Token 统计 ({source}): API usage {s['api']} 次 | 分词 {s['tokenizer']} 段 / {s['batches']} 批"
+                f" | 缓存命中 {s['cache_hits']} 段 | 字符估算 {s['estimate']} 段"
+                f" (换算率{ratios}: 英文 {_RATIOS[0]:.3f} / 中文 {_RATIOS[1]:.3f})")
+
+
+TOKEN_COUNTER = TokenCounter()
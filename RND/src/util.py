@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
 
 # --- 1. 实验全局配置 ---
@@ -11,6 +12,16 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # 建议向量缓存根目录
 VECTOR_CACHE_ROOT = os.path.join(BASE_DIR, "..", "output", "vector_cache")
 
+# 离线向量的模型名，与截断长度一起组成模型标识 (embedding_model_id)，参与内容哈希，换模型或长度后不会误用旧向量
+EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
+# preprocess_vectors 编码候选人论文时的截断长度，embedding_model_id 不传长度时用它
+EMBEDDING_MAX_SEQ_LENGTH = 512
+# 运行时 (bge_feature_extractor) 现场编码与 precompute_targets 预计算目标论文时的截断长度
+TARGET_MAX_SEQ_LENGTH = 256
+# 编码器后端 (与 src/encoder_backend.py 读同一个环境变量) 也参与内容哈希：int8 / onnx 编出的向量与 torch 有偏差，
+# 不能与它共用键；torch 保持原来的键，已有的向量库不用重编
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+
 # 文件夹简写映射（让目录名短一点，方便在终端查看）
 MODE_DIR_MAP = {
     "title": "T",
@@ -41,6 +52,36 @@ def get_vector_cache_path():
         os.makedirs(target_path, exist_ok=True)
     return target_path
 
+def get_content_cache_path():
+    """按文本内容去重的向量库：output/vector_cache/content，所有数据集和特征模式共用"""
+    target_path = os.path.join(VECTOR_CACHE_ROOT, "content")
+    os.makedirs(target_path, exist_ok=True)
+    return target_path
+
+def embedding_model_id(backend=None, max_seq_length=None):
+    """内容哈希里的模型标识：模型 + 截断长度，非 torch 后端再加上后端名；应传入实际加载模型时用的后端和长度"""
+    backend = backend or ENCODER_BACKEND
+    model_id = f"{EMBEDDING_MODEL_NAME}@{max_seq_length or EMBEDDING_MAX_SEQ_LENGTH}"
+    return model_id if backend == "torch" else f"{model_id}+{backend}"
+
+def text_hash(text, mode=None, model_id=None):
+    """build_feature_text 输出的内容哈希 (含模型、编码器后端与特征模式)，作为去重向量库的键"""
+    active_mode = mode if mode else CURRENT_FEATURE_MODE
+    model_id = model_id or embedding_model_id()
+    payload = f"{model_id}\x1f{active_mode}\x1f{text}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def build_sa_paper_info(item):
+    """
+    sa_lzk 数据集的一条待消歧记录 -> bge_feature_extractor 使用的论文字段
+    (title=lzmc, venue=cbsorqkmc，新数据中没有摘要)
+    """
+    return {
+        "title": item.get("lzmc", ""),
+        "venue": item.get("cbsorqkmc", ""),
+        "abstract": "" # 新数据中若无摘要则留空
+    }
+
 # --- 3. 核心逻辑：特征提取函数 ---
 def build_feature_text(pub_detail, mode=None):
     """
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+打包向量库：所有作者的论文向量写进一个连续的矩阵文件 (内存映射)，
+另存 key -> (offset, count) 索引，查询就是对矩阵的零拷贝切片。
+
+目录下的文件:
+  {name}.bin          行优先的原始矩阵 (默认 float16)
+  {name}.index.json   {"dim", "dtype", "rows", "index": {key: [offset, count]}}
+  {name}.meta.json    只含 dim / dtype / rows / generation / model_id，只按行号取数的读者不必解析整个索引
+
+只追加写入：同一个 key 重写时旧行变成垃圾，可用 compact() 回收。
+compact() 会重排行号并把 generation 加一，按行号建的派生索引 (src/ann_index.py) 据此判断是否过期。
+model_id 由写入方设置 (编码向量用的模型标识，见 util.embedding_model_id)，读者据此拒绝别的模型编出的库。
+索引文件是权威记录，重新打开时数据文件会截断到索引记录的行数，中途崩溃不会留下脏数据。
+"""
+import glob
+import json
+import os
+import sys
+import numpy as np
+
+STORE_VERSION = 1
+
+
+class PackedVectorStore:
+    def __init__(self, store_dir, name="vectors", dtype="float16"):
+        self.store_dir = store_dir
+        self.name = name
+        self.data_path = os.path.join(store_dir, f"{name}.bin")
+        self.index_path = os.path.join(store_dir, f"{name}.index.json")
+        self.meta_path = os.path.join(store_dir, f"{name}.meta.json")
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.rows = 0
+        self.generation = 0
+        self.model_id = None
+        self._index = None
+        self._fh = None
+        self._matrix = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self._apply_meta(json.load(f))
+        elif os.path.exists(self.index_path):
+            self._load_index()
+        else:
+            self._index = {}
+        self._remap()
+
+    @staticmethod
+    def exists(store_dir, name="vectors"):
+        return os.path.exists(os.path.join(store_dir, f"{name}.index.json"))
+
+    def _apply_meta(self, meta):
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"向量库版本不匹配: {self.index_path}")
+        self.dtype = np.dtype(meta["dtype"])
+        self.dim = meta["dim"]
+        self.rows = meta["rows"]
+        self.generation = meta.get("generation", 0)
+        self.model_id = meta.get("model_id")
+
+    def _load_index(self):
+        # 索引文件是权威记录，行数以它为准
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        rows_before = self.rows
+        self._apply_meta(meta)
+        self._index = meta["index"]
+        if self.rows != rows_before:
+            self._remap()
+
+    @property
+    def index(self):
+        """key -> [offset, count]，首次用到时才加载"""
+        if self._index is None:
+            self._load_index()
+        return self._index
+
+    def _remap(self):
+        if self.rows and self.dim:
+            # mode="c"：写时复制，torch.from_numpy 可直接零拷贝包装且不会改到磁盘文件
+            self._matrix = np.memmap(self.data_path, dtype=self.dtype, mode="c", shape=(self.rows, self.dim))
+        else:
+            self._matrix = None
+
+    def _ensure_mapped(self):
+        """append 后尚未 flush 的行不在旧映射里：把写缓冲刷进文件 (不提交索引) 后按当前行数重新映射"""
+        mapped = 0 if self._matrix is None else self._matrix.shape[0]
+        if mapped < self.rows:
+            if self._fh is not None:
+                self._fh.flush()
+            self._remap()
+
+    @property
+    def matrix(self):
+        """整个矩阵 (rows, dim)，按行号直接取数用"""
+        self._ensure_mapped()
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return self._matrix
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def garbage_rows(self):
+        """已不被索引引用的行数 (重写/删除留下)"""
+        return self.rows - sum(count for _, count in self.index.values())
+
+    def span(self, key):
+        """返回 (offset, count)，不存在时为 None"""
+        return self.index.get(key)
+
+    def row_ids(self, key):
+        """key 对应的行号 (int64 数组)，不存在时为 None"""
+        span = self.index.get(key)
+        if span is None:
+            return None
+        return np.arange(span[0], span[0] + span[1], dtype=np.int64)
+
+    def get(self, key):
+        span = self.index.get(key)
+        if span is None:
+            return None
+        offset, count = span
+        self._ensure_mapped() # 可能是上次 flush 之后才追加的 key
+        return self._matrix[offset:offset + count]
+
+    # ---------- 写入 ----------
+    def _open_writer(self):
+        if self._fh is not None:
+            return
+        self.index  # 写入前必须加载权威索引
+        os.makedirs(self.store_dir, exist_ok=True)
+        mode = "r+b" if os.path.exists(self.data_path) else "wb"
+        self._fh = open(self.data_path, mode)
+        # 丢弃上次崩溃时索引之外的残留数据
+        self._fh.truncate(self.rows * (self.dim or 0) * self.dtype.itemsize)
+        self._fh.seek(0, os.SEEK_END)
+
+    def append(self, key, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不一致: {vectors.shape[1]} != {self.dim}")
+        self._open_writer()
+        self._fh.write(vectors.tobytes())
+        self.index[key] = [self.rows, int(vectors.shape[0])]
+        self.rows += int(vectors.shape[0])
+
+    def remove(self, key):
+        self.index.pop(key, None)
+
+    def flush(self):
+        """落盘数据后再原子替换索引，然后重新映射"""
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        os.makedirs(self.store_dir, exist_ok=True)
+        meta = {
+            "version": STORE_VERSION,
+            "dtype": self.dtype.name,
+            "dim": self.dim,
+            "rows": self.rows,
+            "generation": self.generation,
+            "model_id": self.model_id,
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(meta, index=self.index), f)
+        os.replace(tmp_path, self.index_path)
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self._remap()
+
+    def close(self):
+        self.flush()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def clear(self):
+        """删除数据和索引文件，清空整个库 (换模型后整体重建用)"""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self._matrix = None
+        for path in (self.data_path, self.index_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.__init__(self.store_dir, self.name, self.dtype)
+
+    def compact(self):
+        """只保留索引仍引用的行，回收重写/删除留下的空间"""
+        self.close()
+        tmp = PackedVectorStore(self.store_dir, name=self.name + ".compact", dtype=self.dtype)
+        tmp.generation = self.generation + 1
+        tmp.model_id = self.model_id
+        for key in list(self.index.keys()):
+            tmp.append(key, self.get(key))
+        tmp.close()
+        self._matrix = None
+        os.replace(tmp.data_path, self.data_path)
+        os.replace(tmp.index_path, self.index_path)
+        os.replace(tmp.meta_path, self.meta_path)
+        self.__init__(self.store_dir, self.name, self.dtype)
+
+
+class DedupVectorStore:
+    """
+    内容去重向量库：
+      content 库 (跨作者、跨数据集共享) 以文本哈希为键，每个不同的文本只存一行；
+      author_rows 库 (每个数据集/特征模式一份) 为每个作者存一列行号，与其 pubs 列表一一对应。
+    get(auth_id) 与 PackedVectorStore.get 接口一致，返回按行号聚合出的 (count, dim) 矩阵。
+    """
+
+    def __init__(self, view_dir, content_dir):
+        self.content = PackedVectorStore(content_dir, name="content")
+        self.views = PackedVectorStore(view_dir, name="author_rows", dtype="int64")
+
+    @staticmethod
+    def exists(view_dir):
+        return PackedVectorStore.exists(view_dir, "author_rows")
+
+    def __len__(self):
+        return len(self.views)
+
+    def __contains__(self, auth_id):
+        return auth_id in self.views
+
+    def keys(self):
+        return self.views.keys()
+
+    def get(self, auth_id):
+        rows = self.views.get(auth_id)
+        if rows is None:
+            return None
+        return self.content.matrix[rows[:, 0]]
+
+    def row_ids(self, auth_id):
+        """作者各篇论文在 content 矩阵里的行号"""
+        rows = self.views.get(auth_id)
+        if rows is None:
+            return None
+        return np.asarray(rows[:, 0], dtype=np.int64)
+
+    def has_text(self, text_key):
+        return text_key in self.content
+
+    def add_text(self, text_key, vector):
+        if text_key not in self.content:
+            self.content.append(text_key, vector)
+
+    def set_author(self, auth_id, text_keys):
+        """text_keys 中的文本必须都已 add_text"""
+        rows = np.asarray([self.content.span(k)[0] for k in text_keys], dtype=np.int64)
+        self.views.append(auth_id, rows[:, None])
+
+    def matches(self, auth_id, text_keys):
+        """作者视图当前引用的行是否正好是这些文本"""
+        rows = self.views.get(auth_id)
+        if rows is None or len(rows) != len(text_keys):
+            return False
+        spans = [self.content.span(k) for k in text_keys]
+        if any(span is None for span in spans):
+            return False
+        return [span[0] for span in spans] == rows[:, 0].tolist()
+
+    def remove_author(self, auth_id):
+        self.views.remove(auth_id)
+
+    def compact_views(self, max_garbage_ratio=0.2):
+        """视图里的废弃行超过一定比例时重写视图文件 (内容库只追加，不回收)"""
+        garbage = self.views.garbage_rows()
+        if self.views.rows and garbage / self.views.rows > max_garbage_ratio:
+            self.views.compact()
+            return garbage
+        return 0
+
+    def flush(self):
+        # 先提交内容行，再提交引用它们的视图
+        self.content.flush()
+        self.views.flush()
+
+    def close(self):
+        self.content.close()
+        self.views.close()
+
+
+def import_safetensors_dir(cache_dir, store=None, remove_files=False, flush_every=2000):
+    """把旧的 {auth_id}.safetensors 逐个导入打包库，可选导入后删除小文件"""
+    from safetensors.numpy import load_file
+
+    store = store or PackedVectorStore(cache_dir)
+    paths = sorted(glob.glob(os.path.join(cache_dir, "*.safetensors")))
+    print(f"发现 {len(paths)} 个旧缓存文件，开始导入: {cache_dir}")
+    imported = 0
+    for i, path in enumerate(paths):
+        key = os.path.splitext(os.path.basename(path))[0]
+        if key not in store:
+            store.append(key, load_file(path)["embeddings"])
+            imported += 1
+        if (i + 1) % flush_every == 0:
+            store.flush()
+    store.flush()
+    if remove_files:
+        for path in paths:
+            if os.path.splitext(os.path.basename(path))[0] in store:
+                os.remove(path)
+    print(f"导入完成: 新增 {imported} 个作者，库中共 {len(store)} 个作者 / {store.rows} 行")
+    return store
+
+
+if __name__ == "__main__":
+    # 用法: python src/vector_store.py [cache_dir] [--remove]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args:
+        target_dir = args[0]
+    else:
+        from util import get_vector_cache_path
+        target_dir = get_vector_cache_path()
+    import_safetensors_dir(target_dir, remove_files="--remove" in sys.argv).close()
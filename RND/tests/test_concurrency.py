@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""src/concurrency.py 的 AIMD 限流器：延迟与负载无关时不应塌缩，真正过载时要回退"""
+import asyncio
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.concurrency import AdaptiveLimiter, MIN_P95_SAMPLES
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+async def drive(limiter, total, latency, fail=None, kinds=("L1LightweightFilter", "L2DeepAnalysis")):
+    """max_limit 个工作协程不停发请求；latency(i) 返回第 i 个请求的耗时，fail(i) 为真时该请求报 429"""
+    issued = 0
+
+    async def worker():
+        nonlocal issued
+        while issued < total:
+            i = issued
+            issued += 1
+            started_at = await limiter.acquire()
+            await asyncio.sleep(latency(i))
+            exc = RateLimitError("429 Too Many Requests") if fail and fail(i) else None
+            await limiter.release(started_at, exc, kind=kinds[i % len(kinds)])
+
+    await asyncio.gather(*(worker() for _ in range(limiter.max_limit)))
+
+
+def test_no_collapse_when_latency_is_independent_of_load():
+    for seed in range(3):
+        rng = random.Random(seed)
+        limiter = AdaptiveLimiter(initial=10, min_limit=1, max_limit=32)
+        asyncio.run(drive(limiter, 1500, lambda i: rng.lognormvariate(math.log(0.005), 0.6)))
+        assert limiter.limit >= 10, limiter.summary()
+        assert limiter.peak_limit > 10, limiter.summary()
+
+
+def test_backs_off_on_rate_limit():
+    limiter = AdaptiveLimiter(initial=16, min_limit=1, max_limit=32)
+    asyncio.run(drive(limiter, 200, lambda i: 0.002, fail=lambda i: i >= 100 and i % 5 == 0))
+    assert limiter.decreases > 0
+    assert limiter.limit < 16, limiter.summary()
+
+
+def test_backs_off_when_latency_rises_far_above_baseline():
+    limiter = AdaptiveLimiter(initial=16, min_limit=1, max_limit=16)
+    switch = MIN_P95_SAMPLES * 6
+    asyncio.run(drive(limiter, switch + MIN_P95_SAMPLES * 2,
+                      lambda i: 0.002 if i < switch else 0.02, kinds=("Disambiguator",)))
+    assert limiter.decreases > 0
+    assert limiter.limit < 16, limiter.summary()
+
+
+def test_cancellation_is_not_an_overload():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=8)
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def main():
+        tasks = [asyncio.create_task(limiter.run(slow)) for _ in range(8)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    assert limiter.limit == 8 and limiter.decreases == 0
+    assert limiter.overloads == 0 and limiter.errors == 0 and limiter.in_flight == 0